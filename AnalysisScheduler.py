@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Analysis Scheduler - Shares one loaded model between the analyzers of several canvases
+Requests wait in per-session queues and run one at a time. Sessions are served round-robin,
+cheap requests go ahead of long ones, and requests that can no longer finish before their
+deadline expire. Wait and service time are tracked per session
+
+Usage:
+    python AnalysisScheduler.py --simulate     # simulated kiosk load, prints per-session wait/service times
+"""
+
+import argparse
+import itertools
+import sys
+import time
+from collections import deque
+
+from PyQt6.QtCore import QObject, QThread, QTimer, pyqtSignal
+
+# Request states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+EXPIRED = "expired"
+CANCELLED = "cancelled"
+
+# Requests with an estimated cost up to this many tokens are cheap and go first. With the default
+# 500-token story limit a single story costs about 530 and a multi-task request (story, vocabulary
+# card and German sentence) about 650, so single stories go ahead of multi-task requests
+CHEAP_COST = 600
+
+# A waiting request's effective cost drops by this many tokens per second, so long requests are not starved
+AGING_TOKENS_PER_SECOND = 20.0
+
+# Weight of the newest request in the running estimate of seconds per token
+SERVICE_RATE_SMOOTHING = 0.3
+
+
+def estimateCost(prompt, max_new_tokens):
+    """Rough token cost of a request: prompt words plus the output token limit."""
+    return len(prompt.split()) + max_new_tokens
+
+
+class AnalysisRequest:
+    """One queued unit of model work (a worker thread that is started when the request is scheduled)."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, session, worker, cost, deadline_seconds=None):
+        self.id = next(self._ids)
+        self.session = session
+        self.worker = worker
+        self.cost = cost
+        self.state = QUEUED
+        self.submitted_at = time.monotonic()
+        self.deadline = self.submitted_at + deadline_seconds if deadline_seconds else None
+        self.started_at = None
+        self.finished_at = None
+        self.cancelled = False  # set while a running request is asked to stop
+
+    def effectiveCost(self, now):
+        """Cost used for ordering; it shrinks while the request waits."""
+        return self.cost - (now - self.submitted_at) * AGING_TOKENS_PER_SECOND
+
+    def waitSeconds(self):
+        """Time spent queued (so far, if the request has not started)."""
+        end = self.started_at if self.started_at is not None else (self.finished_at or time.monotonic())
+        return end - self.submitted_at
+
+    def serviceSeconds(self):
+        """Time spent running (0 if it never ran)."""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+
+class AnalysisScheduler(QObject):
+    """Runs analysis requests of several sessions on one shared model, one at a time.
+
+    Request selection, in order:
+    1. Cheap requests (effective cost <= CHEAP_COST) before expensive ones.
+    2. Requests that would miss their deadline by waiting for another request of
+       their size (earliest deadline first).
+    3. Round-robin over the sessions, starting after the session served last.
+    Requests that can no longer finish before their deadline expire instead of running.
+    Within a session, the cheapest request goes first. All methods must be called
+    from the GUI thread; workers report back through finish().
+    """
+
+    requestStarted = pyqtSignal(object)  # AnalysisRequest
+    requestExpired = pyqtSignal(object)  # AnalysisRequest
+    queueChanged = pyqtSignal()
+
+    def __init__(self, parent=None, max_running=1):
+        super().__init__(parent)
+        self.max_running = max_running
+        self.queues = {}  # session -> deque of requests, in submission order
+        self.running = []
+        self.sessions = {}  # session -> counters
+        self.last_session = None
+        self.seconds_per_token = None
+
+    def addSession(self, name=None):
+        """Register a session (one canvas/analyzer) and return its name."""
+        name = name or f"session-{len(self.sessions) + 1}"
+        if name not in self.sessions:
+            self.queues[name] = deque()
+            self.sessions[name] = {
+                "requests": 0,
+                "served": 0,
+                "cache_hits": 0,
+                "expired": 0,
+                "cancelled": 0,
+                "wait_seconds": 0.0,
+                "max_wait_seconds": 0.0,
+                "service_seconds": 0.0,
+            }
+        return name
+
+    def submit(self, request):
+        """Queue a request; its worker is started when the scheduler picks it.
+
+        Connect the worker's completion signals to finish() before submitting,
+        since the worker may start right away.
+        """
+        self.addSession(request.session)
+        self.queues[request.session].append(request)
+        self.sessions[request.session]["requests"] += 1
+        if request.deadline is not None:
+            QTimer.singleShot(int((request.deadline - time.monotonic()) * 1000) + 1, self._expireOverdue)
+        self._dispatch()
+        self.queueChanged.emit()
+        return request
+
+    def recordCacheHit(self, session):
+        """Count a request that was answered from the cache without queueing."""
+        self.addSession(session)
+        stats = self.sessions[session]
+        stats["requests"] += 1
+        stats["served"] += 1
+        stats["cache_hits"] += 1
+
+    def finish(self, request):
+        """Mark a running request as done (called when its worker finished, failed or stopped)."""
+        if request.state != RUNNING:
+            return
+        if request.cancelled:
+            # Counted in cancel(); a cut-short run says nothing about the service rate
+            self._retire(request, CANCELLED)
+            self._dispatch()
+            self.queueChanged.emit()
+            return
+        self._retire(request, DONE)
+        service = request.serviceSeconds()
+        stats = self.sessions.get(request.session)
+        if stats is not None:
+            stats["served"] += 1
+            stats["service_seconds"] += service
+            self._recordWait(request)
+        if request.cost > 0:
+            rate = service / request.cost
+            self.seconds_per_token = rate if self.seconds_per_token is None else (
+                SERVICE_RATE_SMOOTHING * rate + (1 - SERVICE_RATE_SMOOTHING) * self.seconds_per_token)
+        self._dispatch()
+        self.queueChanged.emit()
+
+    def cancel(self, request):
+        """Remove a queued request, or ask a running one to stop.
+
+        A running worker is interrupted cooperatively (QThread.requestInterruption(), which
+        generation checks between tokens); it keeps the model until it returns and calls
+        finish(), and its result must be dropped.
+        """
+        if request.state == RUNNING:
+            if request.cancelled:
+                return
+            request.cancelled = True
+            request.worker.requestInterruption()
+        elif request.state == QUEUED:
+            self._retire(request, CANCELLED)
+        else:
+            return
+        stats = self.sessions.get(request.session)
+        if stats is not None:
+            stats["cancelled"] += 1
+        self._dispatch()
+        self.queueChanged.emit()
+
+    def position(self, request):
+        """Number of requests that currently run or would be picked before this one (0 = running)."""
+        if request.state != QUEUED:
+            return 0
+        return len(self.running) + self._order(time.monotonic()).index(request)
+
+    def queuedCount(self):
+        """Number of requests waiting to run."""
+        return sum(len(queue) for queue in self.queues.values())
+
+    def estimatedSeconds(self, request):
+        """Expected service time of a request (None until a request has completed)."""
+        if self.seconds_per_token is None:
+            return None
+        return request.cost * self.seconds_per_token
+
+    def stats(self, session=None):
+        """Get per-session wait and service time metrics (one session, or all by name)."""
+        if session is not None:
+            return self._sessionStats(self.sessions[session])
+        return {name: self._sessionStats(counters) for name, counters in self.sessions.items()}
+
+    def _sessionStats(self, counters):
+        queued = counters["served"] - counters["cache_hits"]
+        waited = queued + counters["expired"]
+        return dict(
+            counters,
+            mean_wait_seconds=counters["wait_seconds"] / waited if waited else 0.0,
+            mean_service_seconds=counters["service_seconds"] / queued if queued else 0.0,
+        )
+
+    def _retire(self, request, state):
+        """Move a request out of its queue or the running set."""
+        if request.state == RUNNING:
+            self.running.remove(request)
+        elif request.state == QUEUED:
+            self.queues[request.session].remove(request)
+        request.state = state
+        request.finished_at = time.monotonic()
+
+    def _recordWait(self, request):
+        stats = self.sessions[request.session]
+        wait = request.waitSeconds()
+        stats["wait_seconds"] += wait
+        stats["max_wait_seconds"] = max(stats["max_wait_seconds"], wait)
+
+    def _expireOverdue(self):
+        """Drop queued requests that can no longer finish before their deadline."""
+        now = time.monotonic()
+        expired = [request for queue in self.queues.values() for request in queue
+                   if request.deadline is not None and request.deadline <= now + (self.estimatedSeconds(request) or 0.0)]
+        for request in expired:
+            self._retire(request, EXPIRED)
+            self._recordWait(request)
+            self.sessions[request.session]["expired"] += 1
+            self.requestExpired.emit(request)
+        if expired:
+            self.queueChanged.emit()
+
+    def _rank(self, request, now):
+        """Sort key within a round: cheap requests first, then urgent ones (earliest deadline first)."""
+        urgent = self._urgent(request, now)
+        return (request.effectiveCost(now) > CHEAP_COST, not urgent, request.deadline if urgent else 0.0)
+
+    def _order(self, now):
+        """Queued requests in the order they would be started.
+
+        Each round takes one request per session, so a session's second request
+        never goes ahead of another session's first.
+        """
+        sessions = list(self.queues)
+        if self.last_session in sessions:
+            # Round-robin: the session after the one served last comes first
+            start = sessions.index(self.last_session) + 1
+            sessions = sessions[start:] + sessions[:start]
+        ranked = []
+        for turn, session in enumerate(sessions):
+            queue = sorted(self.queues[session],
+                           key=lambda request: self._rank(request, now) + (request.effectiveCost(now), request.id))
+            ranked += [((depth,) + self._rank(request, now) + (turn,), request) for depth, request in enumerate(queue)]
+        ranked.sort(key=lambda item: item[0])
+        return [request for _, request in ranked]
+
+    def _urgent(self, request, now):
+        """Check if the request would miss its deadline by waiting for another request of its size."""
+        if request.deadline is None:
+            return False
+        slack = request.deadline - now
+        expected = self.estimatedSeconds(request)
+        return expected is not None and slack <= 2 * expected
+
+    def _dispatch(self):
+        """Start queued requests while the model is free."""
+        self._expireOverdue()
+        while len(self.running) < self.max_running:
+            order = self._order(time.monotonic())
+            if not order:
+                return
+            request = order[0]
+            self.queues[request.session].remove(request)
+            request.state = RUNNING
+            request.started_at = time.monotonic()
+            self.running.append(request)
+            self.last_session = request.session
+            self.requestStarted.emit(request)
+            request.worker.start()
+
+
+_shared_scheduler = None
+
+
+def sharedScheduler():
+    """The process-wide scheduler used by all SketchAnalyzer instances."""
+    global _shared_scheduler
+    if _shared_scheduler is None:
+        _shared_scheduler = AnalysisScheduler()
+    return _shared_scheduler
+
+
+# Estimated costs of the default story and multi-task requests, used by the simulation
+STORY_COST = 532
+MULTI_TASK_COST = 653
+
+
+class _SimulatedWorker(QThread):
+    """Stand-in for SketchAnalyzerWorker that just takes its service time."""
+
+    done = pyqtSignal()
+
+    def __init__(self, seconds):
+        super().__init__()
+        self.seconds = seconds
+
+    def run(self):
+        time.sleep(self.seconds)
+        self.done.emit()
+
+
+def simulateKiosk(sessions=4, requests_per_session=4, seconds_per_token=0.002, deadline_seconds=None, seed=0):
+    """Replay a kiosk workload through a scheduler with simulated workers. Returns per-session stats.
+
+    The first session is a busy child sending multi-task requests back to back; the others
+    send a mix of single stories and multi-task requests at random times (costs as estimated
+    for the default prompts and token limits).
+    """
+    import random
+    from PyQt6.QtCore import QCoreApplication
+
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+    rng = random.Random(seed)
+    scheduler = AnalysisScheduler()
+    names = [scheduler.addSession(f"canvas-{i + 1}") for i in range(sessions)]
+    workers = []
+
+    def submit(session, cost):
+        worker = _SimulatedWorker(cost * seconds_per_token)
+        workers.append(worker)
+        request = AnalysisRequest(session, worker, cost, deadline_seconds)
+        worker.done.connect(lambda: scheduler.finish(request))
+        scheduler.submit(request)
+
+    for index, session in enumerate(names):
+        for i in range(requests_per_session):
+            if index == 0:
+                at_ms, cost = 0, MULTI_TASK_COST
+            else:
+                at_ms, cost = rng.randint(0, 1500), rng.choice((STORY_COST, STORY_COST, MULTI_TASK_COST))
+            QTimer.singleShot(at_ms, lambda session=session, cost=cost: submit(session, cost))
+
+    def onFinished():
+        done = sum(stats["served"] + stats["expired"] for stats in scheduler.sessions.values())
+        if done == sessions * requests_per_session:
+            app.quit()
+
+    scheduler.queueChanged.connect(onFinished)
+    app.exec()
+    for worker in workers:
+        worker.wait()
+    return scheduler.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared analysis scheduler for several canvases.")
+    parser.add_argument("--simulate", action="store_true", help="Replay a simulated kiosk workload")
+    parser.add_argument("--sessions", type=int, default=4, help="Number of simulated canvases")
+    parser.add_argument("--deadline", type=float, help="Deadline of every simulated request (seconds)")
+    args = parser.parse_args()
+
+    if not args.simulate:
+        parser.print_help()
+        return 0
+
+    stats = simulateKiosk(args.sessions, deadline_seconds=args.deadline)
+    print(f"{'session':>10} {'served':>6} {'expired':>7} {'mean wait s':>11} {'max wait s':>10} {'mean service s':>14}")
+    for name, session in stats.items():
+        print(f"{name:>10} {session['served']:>6} {session['expired']:>7} {session['mean_wait_seconds']:>11.2f} "
+              f"{session['max_wait_seconds']:>10.2f} {session['mean_service_seconds']:>14.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
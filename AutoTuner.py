@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Auto Tuner - Finds the fastest inference settings for this machine
+Runs a short calibration with a fixed reference sketch and saves the winner per machine;
+settings whose output drifts from the highest-fidelity output are not eligible
+
+Usage:
+    python AutoTuner.py            # (re-)run the calibration and save the fastest config
+    python AutoTuner.py --show     # show the saved config for this machine
+    python AutoTuner.py --reset    # delete it (the app falls back to the default settings)
+"""
+
+import argparse
+import gc
+import hashlib
+import json
+import os
+import platform
+import sys
+import time
+
+import torch
+
+CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".config", "drawlingo")
+
+# Calibration settings: short generations are enough to rank configurations
+CALIBRATION_TOKENS = 16
+IMAGE_SIZES = (336, 448, 672)
+
+# Share of the greedy calibration tokens that must match the reference output
+# (highest-fidelity load at the largest image size) for a config to be chosen
+MIN_AGREEMENT = 0.75
+
+# Loads from highest to lowest output fidelity
+LOAD_FIDELITY = (("float32", "none"), ("bfloat16", "none"), ("float16", "none"), ("float32", "int8"), ("auto", "4bit"))
+
+# Unquantized loads need the whole 2B model in RAM (float32 ~9 GB, bfloat16 ~4.5 GB)
+MIN_MEMORY_GB = {"float32": 16, "bfloat16": 8}
+
+
+def cpuFeatures():
+    """Describe the CPU: model name, logical cores, AVX-512 support and RAM."""
+    model = platform.processor() or platform.machine()
+    flags = set()
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    model = line.split(":", 1)[1].strip()
+                elif line.startswith("flags"):
+                    flags = set(line.split(":", 1)[1].split())
+                    break
+    except OSError:
+        pass
+    try:
+        memory_gb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3
+    except (AttributeError, ValueError, OSError):
+        memory_gb = 0.0
+    return {
+        "model": model,
+        "cores": os.cpu_count() or 1,
+        "avx512": "avx512f" in flags,
+        "avx512_bf16": "avx512_bf16" in flags,
+        "memory_gb": round(memory_gb, 1),
+    }
+
+
+def machineId():
+    """Short stable id of this machine's hardware (CPU and GPU)."""
+    features = cpuFeatures()
+    gpu = torch.cuda.get_device_name(0) if torch.cuda.is_available() else "none"
+    key = f"{features['model']}|{features['cores']}|{features['avx512']}|{gpu}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+def configPath():
+    """Path of this machine's tuned config file."""
+    return os.path.join(CONFIG_DIR, f"tuned_{machineId()}.json")
+
+
+def loadTunedConfig():
+    """Load the tuned inference config for this machine, or None if it was never tuned."""
+    path = configPath()
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)["config"]
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring unreadable tuned config {path}: {e}")
+        return None
+
+
+def saveTunedConfig(config, results):
+    """Save the winning config together with the calibration results."""
+    os.makedirs(CONFIG_DIR, exist_ok=True)
+    data = {
+        "machine": dict(cpuFeatures(), id=machineId()),
+        "tuned_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "config": config,
+        "results": results,
+    }
+    with open(configPath(), "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+
+def resetTunedConfig():
+    """Delete this machine's tuned config; the defaults are used until it is tuned again."""
+    path = configPath()
+    if os.path.exists(path):
+        os.remove(path)
+    return path
+
+
+def candidateGrid():
+    """Candidate configurations, grouped by how the model has to be loaded.
+
+    Returns a list of (load settings, [(num_threads, image_size), ...]) so that
+    every model variant is loaded only once.
+    """
+    features = cpuFeatures()
+    # The default 4-bit load is always a candidate; it is skipped if bitsandbytes cannot load it
+    loads = [{"dtype": "auto", "quantization": "4bit"}]
+    if torch.cuda.is_available():
+        loads.append({"dtype": "float16", "quantization": "none"})
+        threads = [0]
+    else:
+        if features["avx512_bf16"] and features["memory_gb"] >= MIN_MEMORY_GB["bfloat16"]:
+            loads.append({"dtype": "bfloat16", "quantization": "none"})
+        if features["memory_gb"] >= MIN_MEMORY_GB["float32"]:
+            loads.append({"dtype": "float32", "quantization": "none"})
+            loads.append({"dtype": "float32", "quantization": "int8"})
+        cores = features["cores"]
+        threads = sorted({max(1, cores // 2), cores} | ({4} if cores > 4 else set()))
+
+    loads.sort(key=lambda load: LOAD_FIDELITY.index((load["dtype"], load["quantization"])))
+    # The largest image size runs first, so the first loaded variant produces the reference output
+    runs = [(num_threads, image_size) for num_threads in threads for image_size in sorted(IMAGE_SIZES, reverse=True)]
+    return [(load, runs) for load in loads]
+
+
+def agreement(tokens, reference):
+    """Share of positions at which two greedy token sequences match."""
+    if not reference:
+        return 1.0
+    return sum(a == b for a, b in zip(tokens, reference)) / len(reference)
+
+
+def _timeGeneration(model, processor, image, image_size, device):
+    """Latency and generated token ids of a short generation for the reference sketch at one image size."""
+    from SketchAnalyzer import SketchAnalyzer, buildMessages, fitImage, prepareInputs
+
+    messages = buildMessages(fitImage(image, image_size), SketchAnalyzer.generatePrompt())
+    inputs = prepareInputs(processor, messages, device)
+    start = time.perf_counter()
+    with torch.no_grad():
+        output = model.generate(**inputs, max_new_tokens=CALIBRATION_TOKENS, min_new_tokens=CALIBRATION_TOKENS,
+                                do_sample=False)
+    return time.perf_counter() - start, output[0, inputs.input_ids.shape[1]:].tolist()
+
+
+def runCalibration(status=print, model_name=None):
+    """Measure every candidate config on the reference sketch.
+
+    Returns (fastest config whose output agrees with the reference, results).
+    """
+    from transformers import AutoProcessor
+    from ReferenceSketches import referenceSketch
+    from SketchAnalyzer import MODEL_NAME, loadQwenModel
+
+    model_name = model_name or MODEL_NAME
+    processor = AutoProcessor.from_pretrained(model_name, trust_remote_code=True)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    image = referenceSketch()
+    default_threads = torch.get_num_threads()
+
+    results = []
+    reference = None
+    try:
+        for load, runs in candidateGrid():
+            status(f"Calibrating {load['dtype']} / {load['quantization']}...")
+            try:
+                model = loadQwenModel(model_name, load)
+            except Exception as e:
+                print(f"Skipping {load}: {e}")
+                continue
+
+            # Warm-up run so that one-time initialization is not measured
+            _timeGeneration(model, processor, image, IMAGE_SIZES[0], device)
+            for num_threads, image_size in runs:
+                torch.set_num_threads(num_threads or default_threads)
+                seconds, tokens = _timeGeneration(model, processor, image, image_size, device)
+                if reference is None:
+                    reference = tokens
+                score = agreement(tokens, reference)
+                results.append(dict(load, num_threads=num_threads, image_size=image_size, seconds=seconds,
+                                    agreement=score))
+                print(f"{load['dtype']:>9} {load['quantization']:>5} threads={num_threads:<3} "
+                      f"image={image_size:<4} {seconds:.2f}s agreement={score:.2f}")
+
+            del model
+            gc.collect()
+    finally:
+        torch.set_num_threads(default_threads)
+
+    if not results:
+        raise RuntimeError("No configuration could be calibrated")
+    # The reference run itself always qualifies
+    eligible = [result for result in results if result["agreement"] >= MIN_AGREEMENT]
+    best = min(eligible, key=lambda result: result["seconds"])
+    config = {key: best[key] for key in ("num_threads", "dtype", "quantization", "image_size")}
+    return config, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune Drawlingo inference settings for this machine.")
+    parser.add_argument("--show", action="store_true", help="Show the saved config for this machine")
+    parser.add_argument("--reset", action="store_true", help="Delete the saved config for this machine")
+    args = parser.parse_args()
+
+    path = configPath()
+    if args.show:
+        config = loadTunedConfig()
+        print(f"{path}: {json.dumps(config, indent=2) if config else 'not tuned yet'}")
+        return
+    if args.reset:
+        resetTunedConfig()
+        print(f"Removed {path}")
+        return
+
+    try:
+        config, results = runCalibration()
+    except RuntimeError as e:
+        sys.exit(f"Tuning failed: {e}")
+    saveTunedConfig(config, results)
+    print(f"Fastest config saved to {path}:")
+    print(json.dumps(config, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,17 @@
 Drawing Canvas Widget - Supports mouse, touch, and tablet input
 """
 
+import os
+
+import numpy as np
 from PyQt6.QtWidgets import QWidget
-from PyQt6.QtCore import Qt, QPoint
-from PyQt6.QtGui import QPainter, QPen, QPixmap, QPaintEvent, QResizeEvent, QMouseEvent, QTabletEvent, QColor
+from PyQt6.QtCore import Qt, QLine, QPoint, QPointF, QRect, QTimer
+from PyQt6.QtGui import (QPainter, QPen, QPixmap, QPaintEvent, QResizeEvent, QMouseEvent, QTabletEvent, QColor, QRegion,
+                         QImage, QEventPoint)
 from PyQt6.QtCore import QEvent
+from UndoHistory import UndoHistory
+from StrokePredictor import MAX_PREDICTION_PX, StrokePredictor, saveStroke
+from StrokeTessellator import PressureStroke
 
 class DrawingCanvas(QWidget):
     """Custom widget for drawing sketches with mouse, touch, or tablet support."""
@@ -17,9 +24,20 @@ class DrawingCanvas(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.m_drawing = False
-        self.m_hasDrawing = False
         self.m_lastPoint = QPoint()
         
+        # Last position of every active touch contact (by touch point id); contacts that
+        # overlap in time form one stroke in the undo history. Touch keeps its own state,
+        # separate from the mouse and stylus stroke in m_drawing. Contacts that were down
+        # during a mouse or stylus stroke (e.g. a resting palm) are ignored until lifted
+        self.m_touchPoints = {}
+        self.m_ignoredTouches = set()
+        
+        # Running bounding box of the ink and a counter bumped on every content change
+        self.m_inkRect = QRect()
+        self.m_inkNeedsRescan = False
+        self.m_contentVersion = 0
+        
         # Tool and color settings
         self.m_currentTool = self.TOOL_PEN
         self.m_currentColor = QColor(Qt.GlobalColor.black)
@@ -34,6 +52,38 @@ class DrawingCanvas(QWidget):
         # Initialize pixmap with default size
         self.m_pixmap = QPixmap(800, 600)
         self.m_pixmap.fill(Qt.GlobalColor.white)
+        
+        # Undo history of stroke dirty regions
+        self.m_history = UndoHistory()
+        self.m_history.reset(self.m_pixmap)
+        self.m_strokeRects = []
+        self.m_strokeInkBefore = QRect()
+        
+        # Recorded edits are copied and compressed in small steps while the input is idle
+        self.m_historyTimer = QTimer(self)
+        self.m_historyTimer.setInterval(0)
+        self.m_historyTimer.timeout.connect(self.processHistory)
+        
+        # Optional predicted ink overlay for stylus strokes (DRAWLINGO_STROKE_PREDICTION=1)
+        self.m_predictor = StrokePredictor()
+        self.m_predictionEnabled = os.environ.get("DRAWLINGO_STROKE_PREDICTION", "0") == "1"
+        self.m_predictedPath = []
+        self.m_predictedRect = QRect()
+        self.m_predictionStale = False  # new samples arrived; the overlay is fitted in the next paintEvent
+        self.m_predictionArea = QRect()  # repaint requested for the overlay since the last paintEvent
+        
+        # Stylus strokes are filled as variable-width outlines once the queued events are handled
+        # (DRAWLINGO_PRESSURE_TESSELLATION=0 draws one constant-width line per event instead)
+        self.m_tessellationEnabled = os.environ.get("DRAWLINGO_PRESSURE_TESSELLATION", "1") != "0"
+        self.m_pressureStroke = None
+        self.m_strokeTimer = QTimer(self)
+        self.m_strokeTimer.setSingleShot(True)
+        self.m_strokeTimer.setInterval(0)
+        self.m_strokeTimer.timeout.connect(self.flushStroke)
+        
+        # Stylus samples of the current stroke, appended to this file if set (for StrokePredictor.py)
+        self.m_recordStrokesPath = os.environ.get("DRAWLINGO_RECORD_STROKES") or None
+        self.m_strokeSamples = []
     
     def setupPen(self):
         """Initialize the pen for drawing."""
@@ -77,29 +127,167 @@ class DrawingCanvas(QWidget):
     
     def clearCanvas(self):
         """Clear the canvas."""
+        ink_before = self.inkRect()
+        self.m_history.capturePending()
         self.m_pixmap.fill(Qt.GlobalColor.white)
-        self.m_hasDrawing = False
+        self.m_inkRect = QRect()
+        self.m_inkNeedsRescan = False
+        self.m_contentVersion += 1
+        if not ink_before.isEmpty():
+            self.m_history.record(self.m_pixmap, [ink_before], ink_before, QRect())
+            self.m_historyTimer.start()
         self.update()
     
+    def undo(self):
+        """Undo the last stroke or clear."""
+        if self.m_drawing or self.m_touchPoints:
+            return
+        entry = self.m_history.undo(self.m_pixmap)
+        if entry:
+            self.m_historyTimer.start()  # compresses the redo pixels taken from the canvas
+            self.restoreInk(entry.ink_before)
+            self.updateRects(entry.rects)
+    
+    def redo(self):
+        """Redo the last undone stroke or clear."""
+        if self.m_drawing or self.m_touchPoints:
+            return
+        entry = self.m_history.redo(self.m_pixmap)
+        if entry:
+            self.restoreInk(entry.ink_after)
+            self.updateRects(entry.rects)
+    
+    def restoreInk(self, ink_rect):
+        """Take over the ink bounding box stored with a history entry."""
+        self.m_inkRect = QRect(ink_rect)
+        self.m_inkNeedsRescan = False
+        self.m_contentVersion += 1
+    
+    def updateRects(self, rects):
+        """Schedule a repaint of the given rectangles only."""
+        region = QRegion()
+        for rect in rects:
+            region = region.united(rect)
+        self.update(region)
+    
+    def canUndo(self):
+        """Check if there is something to undo."""
+        return self.m_history.canUndo()
+    
+    def canRedo(self):
+        """Check if there is something to redo."""
+        return self.m_history.canRedo()
+    
+    def setHistoryLimit(self, max_bytes):
+        """Set the memory cap of the stored undo edits in bytes (the history's canvas copy is not counted)."""
+        self.m_history.setMaxBytes(max_bytes)
+    
     def hasDrawing(self):
         """Check if there's a drawing on the canvas."""
-        return self.m_hasDrawing
+        return not self.inkRect().isEmpty()
+    
+    def contentVersion(self):
+        """Get a counter that increases whenever the canvas content changes."""
+        return self.m_contentVersion
+    
+    def inkRect(self):
+        """Get the bounding box of the ink on the canvas (empty if there is none).
+        
+        The box is the union of the strokes' repaint rectangles, so it is padded: up to
+        about 2 px past the ink for lines, more for pressure strokes (room for miter joins).
+        After erasing it is rescanned and exact.
+        """
+        if self.m_pressureStroke is not None:
+            self.flushStroke()
+        if self.m_inkNeedsRescan:
+            self.shrinkInkRect()
+        return QRect(self.m_inkRect)
+    
+    def shrinkInkRect(self):
+        """Tighten the ink bounding box after erasing by scanning only the old box."""
+        self.m_inkNeedsRescan = False
+        if self.m_inkRect.isEmpty():
+            return
+        image = self.m_pixmap.copy(self.m_inkRect).toImage().convertToFormat(QImage.Format.Format_RGB32)
+        bits = image.constBits()
+        bits.setsize(image.sizeInBytes())
+        pixels = np.frombuffer(bits, dtype=np.uint32).reshape(image.height(), image.bytesPerLine() // 4)
+        ink = pixels[:, :image.width()] != 0xFFFFFFFF
+        rows = np.flatnonzero(ink.any(axis=1))
+        cols = np.flatnonzero(ink.any(axis=0))
+        if len(rows) == 0:
+            self.m_inkRect = QRect()
+            return
+        self.m_inkRect = QRect(self.m_inkRect.x() + int(cols[0]), self.m_inkRect.y() + int(rows[0]),
+                               int(cols[-1] - cols[0]) + 1, int(rows[-1] - rows[0]) + 1)
     
     def getSketch(self):
         """Get the current sketch as a QPixmap."""
         return self.m_pixmap
     
+    def getInkSketch(self, scale=1.0, margin=16):
+        """Get only the inked region (inkRect(), which is padded, plus margin) as a QPixmap, scaled by scale.
+        
+        Returns a null QPixmap if there is no ink. Cost depends on the ink region, not the canvas.
+        """
+        ink_rect = self.inkRect()
+        if ink_rect.isEmpty():
+            return QPixmap()
+        region = ink_rect.adjusted(-margin, -margin, margin, margin).intersected(self.m_pixmap.rect())
+        sketch = self.m_pixmap.copy(region)
+        if scale != 1.0:
+            sketch = sketch.scaled(max(1, round(region.width() * scale)), max(1, round(region.height() * scale)),
+                                   Qt.AspectRatioMode.IgnoreAspectRatio,
+                                   Qt.TransformationMode.SmoothTransformation)
+        return sketch
+    
+    def setPredictionEnabled(self, enabled):
+        """Enable or disable the predicted ink overlay for stylus strokes."""
+        self.m_predictionEnabled = enabled
+        if not enabled:
+            self.clearPrediction()
+    
+    def isPredictionEnabled(self):
+        """Check if the predicted ink overlay is enabled."""
+        return self.m_predictionEnabled
+    
+    def setPressureTessellation(self, enabled):
+        """Draw stylus strokes as filled variable-width outlines (True) or one line per event (False)."""
+        if not self.m_drawing:
+            self.m_tessellationEnabled = enabled
+    
+    def isPressureTessellationEnabled(self):
+        """Check if stylus strokes are drawn as variable-width outlines."""
+        return self.m_tessellationEnabled
+    
     def paintEvent(self, event: QPaintEvent):
         """Paint the canvas."""
         painter = QPainter(self)
         painter.drawPixmap(0, 0, self.m_pixmap)
+        
+        # Provisional end of the pressure stroke, replaced as more samples arrive
+        if self.m_pressureStroke is not None:
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+            self.m_pressureStroke.drawTail(painter)
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing, False)
+        
+        # Temporary predicted ink, replaced by real ink when the next event arrives
+        self.m_predictionArea = QRect()
+        if self.m_predictionStale:
+            self.updatePrediction()
+        if self.m_predictedPath:
+            painter.setPen(self.predictionPen())
+            previous = QPointF(self.m_lastPoint)
+            for point in self.m_predictedPath:
+                painter.drawLine(previous, point)
+                previous = point
     
     def mousePressEvent(self, event: QMouseEvent):
         """Handle mouse press events."""
         if event.button() == Qt.MouseButton.LeftButton:
+            self.beginStroke()
             self.m_lastPoint = event.position().toPoint()
             self.m_drawing = True
-            self.m_hasDrawing = True
     
     def mouseMoveEvent(self, event: QMouseEvent):
         """Handle mouse move events."""
@@ -111,6 +299,7 @@ class DrawingCanvas(QWidget):
         if event.button() == Qt.MouseButton.LeftButton and self.m_drawing:
             self.drawLineTo(event.position().toPoint())
             self.m_drawing = False
+            self.endStroke()
     
     def tabletEvent(self, event: QTabletEvent):
         """Handle tablet/stylus events."""
@@ -118,17 +307,28 @@ class DrawingCanvas(QWidget):
         
         if event_type == QEvent.Type.TabletPress:
             if not self.m_drawing:
+                self.beginStroke()
                 self.m_lastPoint = event.position().toPoint()
                 self.m_drawing = True
-                self.m_hasDrawing = True
+                self.m_predictor.reset()
+                self.m_strokeSamples = []
+                if self.m_tessellationEnabled:
+                    base_width = self.m_penWidth * 2 if self.m_currentTool == self.TOOL_ERASER else self.m_penWidth
+                    self.m_pressureStroke = PressureStroke(self.m_pen.color(), base_width)
+                    self.addPressureSample(event)
+                self.trackStylus(event)
                 
                 # Adjust pen pressure
-                if event.pressure() > 0.0:
+                if self.m_pressureStroke is None and event.pressure() > 0.0:
                     base_width = self.m_penWidth * 2 if self.m_currentTool == self.TOOL_ERASER else self.m_penWidth
                     self.m_pen.setWidthF(base_width * event.pressure())
         elif event_type == QEvent.Type.TabletMove:
-            if self.m_drawing:
+            if self.m_drawing and self.m_pressureStroke is not None:
+                self.addPressureSample(event)
+                self.trackStylus(event)
+            elif self.m_drawing:
                 self.drawLineTo(event.position().toPoint())
+                self.trackStylus(event)
                 
                 # Adjust pen pressure
                 if event.pressure() > 0.0:
@@ -136,8 +336,19 @@ class DrawingCanvas(QWidget):
                     self.m_pen.setWidthF(base_width * event.pressure())
         elif event_type == QEvent.Type.TabletRelease:
             if self.m_drawing:
-                self.drawLineTo(event.position().toPoint())
+                if self.m_pressureStroke is not None:
+                    self.addPressureSample(event)
+                    self.flushStroke(final=True)
+                    self.m_strokeTimer.stop()
+                    self.m_pressureStroke = None
+                else:
+                    self.drawLineTo(event.position().toPoint())
                 self.m_drawing = False
+                self.clearPrediction()
+                self.trackStylus(event)
+                if self.m_recordStrokesPath and len(self.m_strokeSamples) > 1:
+                    saveStroke(self.m_recordStrokesPath, self.m_strokeSamples)
+                self.endStroke()
                 self.setupPen()  # Reset pen
         
         event.accept()
@@ -147,30 +358,170 @@ class DrawingCanvas(QWidget):
         event_type = event.type()
         
         if event_type in (QEvent.Type.TouchBegin, QEvent.Type.TouchUpdate, QEvent.Type.TouchEnd):
-            touch_event = event
-            touch_points = touch_event.points()
-            
-            if touch_points:
-                touch_point = touch_points[0]
-                pos = touch_point.position().toPoint()
-                
-                if event_type == QEvent.Type.TouchBegin:
-                    self.m_lastPoint = pos
-                    self.m_drawing = True
-                    self.m_hasDrawing = True
-                elif event_type == QEvent.Type.TouchUpdate:
-                    if self.m_drawing:
-                        self.drawLineTo(pos)
-                elif event_type == QEvent.Type.TouchEnd:
-                    if self.m_drawing:
-                        self.drawLineTo(pos)
-                        self.m_drawing = False
-                
-                event.accept()
-                return True
+            self.handleTouchPoints(event.points(), event_type == QEvent.Type.TouchEnd)
+            event.accept()
+            return True
+        if event_type == QEvent.Type.TouchCancel:
+            self.handleTouchPoints([], True)
+            event.accept()
+            return True
         
         return super().event(event)
     
+    def handleTouchPoints(self, touch_points, ended):
+        """Continue the stroke of every touch contact; all moved contacts are drawn with one painter.
+
+        Touches are ignored while a mouse or stylus stroke is drawn (e.g. a palm resting on the screen).
+        """
+        ignored = self.m_ignoredTouches
+        released = QEventPoint.State.Released
+        if self.m_drawing:
+            for touch_point in touch_points:
+                if touch_point.state() == released:
+                    ignored.discard(touch_point.id())
+                else:
+                    ignored.add(touch_point.id())
+            if ended:
+                ignored.clear()
+            return
+        
+        segments = []
+        contacts = self.m_touchPoints
+        active = bool(contacts)
+        stationary = QEventPoint.State.Stationary
+        for touch_point in touch_points:
+            state = touch_point.state()
+            if state == stationary:
+                continue
+            point_id = touch_point.id()
+            if ignored and point_id in ignored:
+                if state == released:
+                    ignored.discard(point_id)
+                continue
+            if not active:
+                self.beginStroke()
+                active = True
+            pos = touch_point.position().toPoint()
+            # A new contact starts its ink with its first movement or its release
+            last = contacts.get(point_id, pos)
+            if state == released:
+                contacts.pop(point_id, None)
+                segments.append((last, pos))
+            else:
+                contacts[point_id] = pos
+                if last != pos:
+                    segments.append((last, pos))
+        if segments:
+            self.drawSegments(segments)
+        
+        if ended:
+            contacts.clear()
+            ignored.clear()
+        if active and not contacts:
+            self.endStroke()
+    
+    def drawSegments(self, segments):
+        """Draw line segments (pairs of QPoints) in one drawLines() call and repaint their rectangles."""
+        painter = QPainter(self.m_pixmap)
+        painter.setPen(self.m_pen)
+        rad = (self.m_pen.width() // 2) + 2
+        if len(segments) == 1:
+            # A single contact costs the same as a mouse move
+            start, end = segments[0]
+            painter.drawLine(start, end)
+            painter.end()
+            rect = QRect(start, end).normalized().adjusted(-rad, -rad, +rad, +rad)
+            self.update(rect)
+            self.recordStrokeRect(rect)
+            return
+        painter.drawLines([QLine(start, end) for start, end in segments])
+        painter.end()
+        
+        rects = [QRect(start, end).normalized().adjusted(-rad, -rad, +rad, +rad) for start, end in segments]
+        bounds = QRect()
+        for rect in rects:
+            self.update(rect)
+            bounds = bounds.united(rect)
+        self.recordStrokeRects(rects, bounds)
+    
+    def trackStylus(self, event: QTabletEvent):
+        """Feed a stylus sample to the predictor (and recorder) and mark the predicted overlay stale."""
+        position = event.position()
+        sample = (float(event.timestamp()), position.x(), position.y(), event.pressure())
+        if self.m_recordStrokesPath:
+            self.m_strokeSamples.append(sample)
+        if not self.m_predictionEnabled or not self.m_drawing:
+            return
+        
+        self.m_predictor.addSample(*sample)
+        self.clearPrediction()
+        
+        # The fit runs once per frame in paintEvent(). The prediction stays within MAX_PREDICTION_PX
+        # of the newest sample; twice that area is requested, so that the following events of the
+        # frame usually fall inside it and need no update() of their own
+        self.m_predictionStale = True
+        reach = int(MAX_PREDICTION_PX + self.predictionWidth() / 2) + 2
+        point = QRect(self.m_lastPoint, self.m_lastPoint)
+        if not self.m_predictionArea.contains(point.adjusted(-reach, -reach, +reach, +reach)):
+            self.m_predictionArea = point.adjusted(-2 * reach, -2 * reach, +2 * reach, +2 * reach)
+            self.update(self.m_predictionArea)
+    
+    def updatePrediction(self):
+        """Fit the predicted overlay to the samples so far (called from paintEvent)."""
+        self.m_predictionStale = False
+        self.m_predictedPath = [QPointF(x, y) for x, y, _ in self.m_predictor.predict()]
+        if self.m_predictedPath:
+            rad = int(self.predictionWidth() / 2) + 2
+            rect = QRect(self.m_lastPoint, self.m_lastPoint)
+            for point in self.m_predictedPath:
+                rect = rect.united(QRect(point.toPoint(), point.toPoint()))
+            self.m_predictedRect = rect.normalized().adjusted(-rad, -rad, +rad, +rad)
+    
+    def predictionWidth(self):
+        """Line width of the predicted overlay (as wide as the end of a pressure stroke)."""
+        if self.m_pressureStroke is None:
+            return self.m_pen.widthF()
+        return 2 * self.m_pressureStroke.lastRadius()
+    
+    def predictionPen(self):
+        """Pen of the predicted overlay."""
+        if self.m_pressureStroke is None:
+            return self.m_pen
+        pen = QPen(self.m_pen)
+        pen.setWidthF(self.predictionWidth())
+        return pen
+    
+    def clearPrediction(self):
+        """Remove the predicted overlay (the real ink underneath is repainted)."""
+        self.m_predictionStale = False
+        if self.m_predictedPath:
+            self.m_predictedPath = []
+            self.update(self.m_predictedRect)
+    
+    def beginStroke(self):
+        """Start collecting the dirty region of a new stroke."""
+        # A mouse or stylus stroke ends the touch stroke; its contacts are ignored until lifted
+        if self.m_touchPoints:
+            self.m_ignoredTouches.update(self.m_touchPoints)
+            self.m_touchPoints.clear()
+            self.endStroke()
+        self.m_historyTimer.stop()
+        self.m_history.capturePending()
+        self.m_strokeRects = []
+        self.m_strokeInkBefore = self.inkRect()
+    
+    def endStroke(self):
+        """Record the finished stroke's dirty region in the undo history."""
+        if self.m_strokeRects:
+            self.m_history.record(self.m_pixmap, self.m_strokeRects, self.m_strokeInkBefore, self.inkRect())
+            self.m_historyTimer.start()
+            self.m_strokeRects = []
+    
+    def processHistory(self):
+        """Store a few more rectangles of the pending undo entries (runs from the idle history timer)."""
+        if not self.m_history.processPending():
+            self.m_historyTimer.stop()
+    
     def drawLineTo(self, endPoint: QPoint):
         """Draw a line from the last point to the end point."""
         painter = QPainter(self.m_pixmap)
@@ -179,13 +530,55 @@ class DrawingCanvas(QWidget):
         
         # Update the widget
         rad = (self.m_pen.width() // 2) + 2
-        update_rect = self.m_lastPoint.x(), self.m_lastPoint.y(), endPoint.x(), endPoint.y()
-        from PyQt6.QtCore import QRect
         update_rect = QRect(self.m_lastPoint, endPoint).normalized().adjusted(-rad, -rad, +rad, +rad)
         self.update(update_rect)
+        self.recordStrokeRect(update_rect)
         
         self.m_lastPoint = endPoint
     
+    def addPressureSample(self, event: QTabletEvent):
+        """Queue a stylus sample of the pressure stroke; it is drawn once the queued events are handled."""
+        position = event.position()
+        self.m_pressureStroke.addSample(position.x(), position.y(), event.pressure())
+        self.m_lastPoint = position.toPoint()
+        if not self.m_strokeTimer.isActive():
+            self.m_strokeTimer.start()
+    
+    def flushStroke(self, final=False):
+        """Fill the final segments of the pressure stroke into the pixmap and repaint them and the tail."""
+        if self.m_pressureStroke is None:
+            return
+        tail_rect = self.m_pressureStroke.tail_rect
+        painter = QPainter(self.m_pixmap)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        rects = self.m_pressureStroke.flush(painter, self.m_history.committedImage(), final)
+        painter.end()
+        if rects:
+            bounds = QRect()
+            for rect in rects:
+                bounds = bounds.united(rect)
+            self.recordStrokeRects(rects, bounds)
+        self.updateRects(rects + [tail_rect, self.m_pressureStroke.tail_rect])
+    
+    def recordStrokeRect(self, rect):
+        """Account a drawn rectangle of the current stroke for undo and the ink bounding box."""
+        self.recordStrokeRects([rect], rect)
+    
+    def recordStrokeRects(self, rects, bounds):
+        """Account several drawn rectangles of the current stroke; bounds is their bounding box.
+        
+        The ink box grows by bounds as is. Aliased round caps reach a pixel past half the pen
+        width, so the repaint padding cannot be taken off without cutting ink.
+        """
+        self.m_strokeRects.extend(rects)
+        
+        # The eraser can only shrink the ink, which is resolved lazily in inkRect()
+        if self.m_currentTool == self.TOOL_ERASER:
+            self.m_inkNeedsRescan = True
+        else:
+            self.m_inkRect = self.m_inkRect.united(bounds.intersected(self.m_pixmap.rect()))
+        self.m_contentVersion += 1
+    
     def resizeEvent(self, event: QResizeEvent):
         """Handle resize events."""
         # Resize pixmap if widget is larger
@@ -199,6 +592,7 @@ class DrawingCanvas(QWidget):
             painter = QPainter(newPixmap)
             painter.drawPixmap(0, 0, self.m_pixmap)
             self.m_pixmap = newPixmap
+            self.m_history.resize(newWidth, newHeight)
         
         super().resizeEvent(event)
 
@@ -4,10 +4,11 @@ Main Window - Main UI for Drawlingo application
 
 from PyQt6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QTextEdit, QPushButton, QLabel, QProgressBar, QMessageBox, QApplication, QLineEdit, QButtonGroup
+    QTextEdit, QPushButton, QLabel, QProgressBar, QMessageBox, QApplication, QLineEdit, QButtonGroup,
+    QCheckBox
 )
 from PyQt6.QtCore import Qt, QTimer
-from PyQt6.QtGui import QPixmap, QTextCursor, QColor
+from PyQt6.QtGui import QPixmap, QTextCursor, QColor, QKeySequence, QShortcut, QCloseEvent
 from DrawingCanvas import DrawingCanvas
 from SketchAnalyzer import SketchAnalyzer
 
@@ -21,7 +22,7 @@ except ImportError:
 class MainWindow(QMainWindow):
     """Main application window."""
     
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, session=None):
         super().__init__(parent)
         
         self.m_centralWidget = None
@@ -33,6 +34,7 @@ class MainWindow(QMainWindow):
         self.m_statusLabel = None
         self.m_analyzer = None
         self.m_customPromptInput = None
+        self.m_vocabularyCheckBox = None
         self.m_penButton = None
         self.m_eraserButton = None
         self.m_toolButtonGroup = None
@@ -40,12 +42,15 @@ class MainWindow(QMainWindow):
         self.setupUI()
         
         # Initialize analyzer
-        self.m_analyzer = SketchAnalyzer(self)
+        # Each window is its own session of the shared analysis scheduler
+        self.m_analyzer = SketchAnalyzer(self, session)
         self.m_analyzer.analysisComplete.connect(self.onAnalysisComplete)
+        self.m_analyzer.tasksComplete.connect(self.onTasksComplete)
         self.m_analyzer.analysisError.connect(self.onAnalysisError)
         self.m_analyzer.statusUpdate.connect(self.onStatusUpdate)
         
-        self.setWindowTitle("Drawlingo - Sketch Language Learning")
+        title = "Drawlingo - Sketch Language Learning"
+        self.setWindowTitle(f"{title} ({session})" if session else title)
         self.resize(1200, 700)
     
     def setupUI(self):
@@ -86,8 +91,18 @@ class MainWindow(QMainWindow):
             "}"
         )
         
+        # Optional extra outputs, generated from the same image encode as the story
+        self.m_vocabularyCheckBox = QCheckBox("Also create a vocabulary card and a German sentence", self)
+        self.m_vocabularyCheckBox.setStyleSheet(
+            "QCheckBox {"
+            "    font-size: 13px;"
+            "    color: white;"
+            "}"
+        )
+        
         leftSideLayout.addWidget(promptLabel)
         leftSideLayout.addWidget(self.m_customPromptInput)
+        leftSideLayout.addWidget(self.m_vocabularyCheckBox)
         
         # Text area on the left (for generated story)
         self.m_textArea = QTextEdit(self)
@@ -273,6 +288,36 @@ class MainWindow(QMainWindow):
         
         toolbarLayout.addStretch()
         
+        # Undo / redo buttons
+        historyButtonStyle = (
+            "QPushButton {"
+            "    padding: 6px 12px;"
+            "    font-size: 12px;"
+            "    border: 2px solid #607D8B;"
+            "    border-radius: 4px;"
+            "    background-color: white;"
+            "    color: #607D8B;"
+            "}"
+            "QPushButton:hover {"
+            "    background-color: #607D8B;"
+            "    color: white;"
+            "}"
+        )
+        undoButton = QPushButton("↶ Undo", self)
+        undoButton.setStyleSheet(historyButtonStyle)
+        undoButton.setToolTip("Undo (Ctrl+Z)")
+        undoButton.clicked.connect(self.m_canvas.undo)
+        toolbarLayout.addWidget(undoButton)
+        
+        redoButton = QPushButton("↷ Redo", self)
+        redoButton.setStyleSheet(historyButtonStyle)
+        redoButton.setToolTip("Redo (Ctrl+Shift+Z)")
+        redoButton.clicked.connect(self.m_canvas.redo)
+        toolbarLayout.addWidget(redoButton)
+        
+        QShortcut(QKeySequence.StandardKey.Undo, self, self.m_canvas.undo)
+        QShortcut(QKeySequence.StandardKey.Redo, self, self.m_canvas.redo)
+        
         # Clear button
         clearButton = QPushButton("🗑️ Clear", self)
         clearButton.setStyleSheet(
@@ -367,8 +412,12 @@ class MainWindow(QMainWindow):
             "Please wait, this may take a while on the first run (model download and loading)."
         )
         
-        sketch = self.m_canvas.getSketch()
-        self.m_analyzer.analyzeSketch(sketch)
+        # Only the inked region is sent, not the whole (oversized) canvas
+        sketch = self.m_canvas.getInkSketch()
+        if self.m_vocabularyCheckBox.isChecked():
+            self.m_analyzer.analyzeSketchTasks(sketch)
+        else:
+            self.m_analyzer.analyzeSketch(sketch)
     
     def onAnalysisComplete(self, story: str):
         """Handle successful analysis."""
@@ -435,6 +484,33 @@ class MainWindow(QMainWindow):
         elif germanText:
             self.speakText(germanText, "de")
     
+    def onTasksComplete(self, results: dict):
+        """Handle a story generated together with a vocabulary card and a German sentence."""
+        self.m_progressBar.setVisible(False)
+        self.m_statusLabel.setText("✅ Story generated successfully!")
+        self.m_analyzeButton.setEnabled(True)
+        
+        story = results.get("story", "")
+        vocabulary = results.get("vocabulary", "")
+        germanSentence = results.get("german_sentence", "")
+        
+        text = story
+        if vocabulary:
+            text += "\n\n📚 Vocabulary: " + vocabulary
+        if germanSentence:
+            text += "\n\n🇩🇪 German: " + germanSentence
+        self.m_textArea.setPlainText(text)
+        self.m_textArea.moveCursor(QTextCursor.MoveOperation.Start)
+        QApplication.processEvents()  # Ensure UI updates immediately
+        
+        # Read the story in English, then the German sentence
+        if story:
+            self.speakText(story, "en")
+            if germanSentence:
+                QTimer.singleShot(3000, lambda: self.speakText(germanSentence, "de"))
+        elif germanSentence:
+            self.speakText(germanSentence, "de")
+    
     def onAnalysisError(self, error: str):
         """Handle analysis error."""
         self.m_progressBar.setVisible(False)
@@ -550,4 +626,8 @@ class MainWindow(QMainWindow):
         """Handle tool selection change."""
         tool_id = self.m_toolButtonGroup.id(button)
         self.m_canvas.setTool(tool_id)
-
+    
+    def closeEvent(self, event: QCloseEvent):
+        """Save pending semantic cache changes before the window closes."""
+        self.m_analyzer.saveCache()
+        super().closeEvent(event)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Model Snapshot - One-time preparation of a local, ready-to-load copy of the model
+The quantized or converted weights are saved as safetensors (memory-mapped on load)
+together with the processor, so later starts load offline in seconds
+
+Usage:
+    python ModelSnapshot.py                # prepare model_snapshot/ (next to this file) with this machine's inference config
+    python ModelSnapshot.py --show         # show the snapshot metadata
+    python ModelSnapshot.py --verify       # save and reload a tiny random model and compare outputs
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import torch
+
+DEFAULT_SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_snapshot")
+METADATA_FILE = "drawlingo_snapshot.json"
+
+
+def snapshotMetadata(snapshot_dir):
+    """Load the metadata of a prepared snapshot, or None if there is none."""
+    path = os.path.join(snapshot_dir, METADATA_FILE)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable snapshot metadata {path}: {e}")
+        return None
+
+
+def saveSnapshot(model, processor, output_dir, source, config):
+    """Save a loaded model (and processor) with the metadata needed to load it back."""
+    os.makedirs(output_dir, exist_ok=True)
+    model.save_pretrained(output_dir, safe_serialization=True)
+    if processor is not None:
+        processor.save_pretrained(output_dir)
+
+    metadata = {
+        "source": source,
+        "config": config,
+        "prepared_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "torch_version": torch.__version__,
+    }
+    with open(os.path.join(output_dir, METADATA_FILE), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+    return metadata
+
+
+def loadSnapshotModel(snapshot_dir, metadata):
+    """Load the snapshot weights from local files only (no network access)."""
+    from transformers import Qwen2VLForConditionalGeneration
+
+    model = Qwen2VLForConditionalGeneration.from_pretrained(
+        snapshot_dir,
+        device_map="auto",
+        torch_dtype="auto",
+        local_files_only=True,
+    )
+    if metadata["config"].get("quantization") == "int8":
+        # Dynamically quantized modules cannot be serialized, so this step runs at load time
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def loadSnapshot(snapshot_dir, metadata=None):
+    """Load model and processor from a prepared snapshot. Returns (model, processor, metadata)."""
+    from transformers import AutoProcessor
+
+    metadata = metadata or snapshotMetadata(snapshot_dir)
+    if metadata is None:
+        raise RuntimeError(f"No model snapshot found in {snapshot_dir}. Run: python ModelSnapshot.py")
+    processor = AutoProcessor.from_pretrained(snapshot_dir, local_files_only=True)
+    model = loadSnapshotModel(snapshot_dir, metadata)
+    return model, processor, metadata
+
+
+def prepareSnapshot(model_name, config, output_dir, status=print):
+    """Load the model from the hub with the given inference config and save it as a snapshot."""
+    from transformers import AutoProcessor
+    from SketchAnalyzer import loadQwenModel
+
+    # int8 is applied at load time (see loadSnapshotModel); save the float32 weights it starts from
+    load_config = dict(config, quantization="none", dtype="float32") if config["quantization"] == "int8" else config
+
+    status(f"Loading {model_name} ({config['dtype']} / {config['quantization']})...")
+    start = time.perf_counter()
+    processor = AutoProcessor.from_pretrained(model_name, trust_remote_code=True)
+    model = loadQwenModel(model_name, load_config)
+    hub_seconds = time.perf_counter() - start
+    status(f"Hub load took {hub_seconds:.1f}s")
+
+    status(f"Saving snapshot to {output_dir}...")
+    metadata = saveSnapshot(model, processor, output_dir, model_name, config)
+    del model
+
+    start = time.perf_counter()
+    loadSnapshot(output_dir, metadata)
+    snapshot_seconds = time.perf_counter() - start
+    status(f"Snapshot load took {snapshot_seconds:.1f}s")
+    return hub_seconds, snapshot_seconds
+
+
+def verifySnapshot():
+    """Save a tiny random model in each supported format and check the reloaded logits."""
+    from OnnxExport import buildTinyModel
+
+    torch.manual_seed(0)
+    input_ids = torch.randint(2, 900, (1, 12))
+    ok = True
+    for dtype, quantization in (("float32", "none"), ("bfloat16", "none"), ("float32", "int8")):
+        model = buildTinyModel()
+        if dtype != "float32":
+            model = model.to(getattr(torch, dtype))
+        config = {"dtype": dtype, "quantization": quantization}
+        reference = model
+        if quantization == "int8":
+            reference = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            metadata = saveSnapshot(model, None, snapshot_dir, "tiny-random", config)
+            start = time.perf_counter()
+            loaded = loadSnapshotModel(snapshot_dir, metadata)
+            seconds = time.perf_counter() - start
+            with torch.no_grad():
+                expected = reference(input_ids=input_ids).logits.float()
+                actual = loaded(input_ids=input_ids).logits.float()
+
+        # bfloat16 logits differ slightly because rotary buffers are recomputed in float32 on load
+        tolerance = 1e-4 if dtype == "float32" else 2e-2
+        diff = (expected - actual).abs().max().item()
+        passed = diff < tolerance and next(loaded.parameters()).dtype == getattr(torch, dtype)
+        ok = ok and passed
+        print(f"{dtype:>9} {quantization:>5}: max logits diff {diff:.2e}, load {seconds * 1000:.0f} ms "
+              f"{'OK' if passed else 'FAILED'}")
+    return ok
+
+
+def main():
+    from SketchAnalyzer import DEFAULT_INFERENCE_CONFIG, MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Prepare a local ready-to-load Drawlingo model snapshot.")
+    parser.add_argument("--model", default=MODEL_NAME, help="Hugging Face model name or local path")
+    parser.add_argument("--output", default=DEFAULT_SNAPSHOT_DIR, help="Snapshot directory")
+    parser.add_argument("--dtype", help="Override the dtype of the tuned config (e.g. bfloat16)")
+    parser.add_argument("--quantization", choices=("4bit", "int8", "none"),
+                        help="Override the quantization of the tuned config")
+    parser.add_argument("--show", action="store_true", help="Show the metadata of an existing snapshot")
+    parser.add_argument("--verify", action="store_true",
+                        help="Save and reload a tiny random model and compare its outputs")
+    args = parser.parse_args()
+
+    if args.verify:
+        return 0 if verifySnapshot() else 1
+
+    if args.show:
+        metadata = snapshotMetadata(args.output)
+        print(f"{args.output}: {json.dumps(metadata, indent=2) if metadata else 'not prepared yet'}")
+        return 0
+
+    from AutoTuner import loadTunedConfig
+
+    config = dict(DEFAULT_INFERENCE_CONFIG, **(loadTunedConfig() or {}))
+    if args.dtype:
+        config["dtype"] = args.dtype
+    if args.quantization:
+        config["quantization"] = args.quantization
+
+    prepareSnapshot(args.model, config, args.output)
+    print(f"Snapshot ready. SketchAnalyzer loads it from {args.output} (or DRAWLINGO_SNAPSHOT_DIR).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
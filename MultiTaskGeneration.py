@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Multi-Task Generation - Several outputs for one sketch from a single image encode
+The prompts of all tasks share the system prompt and the image; that prefix is prefilled once
+and each task decodes from the shared KV cache
+
+Usage:
+    python MultiTaskGeneration.py --verify     # tiny random model, outputs must match separate generate() calls
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import torch
+
+from OnnxBackend import computeRopeIndex
+
+TASK_STORY = "story"
+TASK_VOCABULARY = "vocabulary"
+TASK_GERMAN_SENTENCE = "german_sentence"
+
+# Prompts of the extra tasks (the story prompt comes from SketchAnalyzer or the user)
+TASK_PROMPTS = {
+    TASK_VOCABULARY: (
+        "Name the main object in the sketch as a vocabulary card: one English word, then the German word "
+        "with its article. Format: English - German. Example: Tree - der Baum. Do not add any other response."
+    ),
+    TASK_GERMAN_SENTENCE: (
+        "Write one short and simple German sentence about the sketch for a child learning German. "
+        "Do not add any other response."
+    ),
+}
+
+TASK_MAX_NEW_TOKENS = {
+    TASK_STORY: 500,
+    TASK_VOCABULARY: 16,
+    TASK_GERMAN_SENTENCE: 48,
+}
+
+
+def taskPrompts(story_prompt):
+    """Prompts of the story, vocabulary card and German sentence tasks, in display order."""
+    return {TASK_STORY: story_prompt, **TASK_PROMPTS}
+
+
+def sharedPrefixLength(sequences, image_token_id):
+    """Length of the token prefix shared by all sequences.
+
+    Every sequence keeps at least one token of its own (its first logits are task specific),
+    and the prefix must contain the whole image span so the image is encoded only once.
+    """
+    sequences = [np.asarray(sequence).reshape(-1) for sequence in sequences]
+    length = min(len(sequence) for sequence in sequences) - 1
+    for sequence in sequences[1:]:
+        different = np.flatnonzero(sequence[:length] != sequences[0][:length])
+        if len(different):
+            length = int(different[0])
+
+    image_positions = np.flatnonzero(sequences[0] == image_token_id)
+    if len(image_positions) and image_positions[-1] >= length:
+        raise ValueError("Task prompts differ before the end of the image; the image cannot be shared")
+    return length
+
+
+def multiTaskGenerate(model, task_input_ids, pixel_values, image_grid_thw, max_new_tokens=None,
+                      temperature=None, seed=None):
+    """Generate one output per task with the PyTorch model from a single shared prefill.
+
+    task_input_ids maps task names to (1, L) prompt ids that contain the same image.
+    Returns ({task: new token ids}, stats).
+    """
+    from transformers import DynamicCache
+    from SpeculativeDecoding import _decodingSettings, _positionIds, _probabilities
+
+    max_new_tokens = max_new_tokens or TASK_MAX_NEW_TOKENS
+    greedy, temperature, top_k, top_p = _decodingSettings(model, temperature)
+    generator = torch.Generator(device="cpu")
+    if seed is not None:
+        generator.manual_seed(seed)
+    eos_token_ids = model.generation_config.eos_token_id
+    if not isinstance(eos_token_ids, list):
+        eos_token_ids = [eos_token_ids]
+
+    def pick(logits):
+        if greedy:
+            return int(torch.argmax(logits))
+        probs = _probabilities(logits, temperature, top_k, top_p)
+        return int(torch.multinomial(probs.float().cpu(), 1, generator=generator))
+
+    start = time.perf_counter()
+    config = model.config
+    first_ids = next(iter(task_input_ids.values()))
+    device = first_ids.device
+    prefix_len = sharedPrefixLength([ids.cpu().numpy() for ids in task_input_ids.values()], config.image_token_id)
+
+    # Prefill the shared prefix (system prompt + image) once
+    position_ids, rope_delta = computeRopeIndex(
+        first_ids.cpu().numpy(), config.image_token_id, image_grid_thw.cpu().numpy(),
+        config.vision_config.spatial_merge_size
+    )
+    position_ids = torch.from_numpy(position_ids).to(device)
+    cache = DynamicCache()
+    with torch.no_grad():
+        model(
+            input_ids=first_ids[:, :prefix_len],
+            attention_mask=torch.ones(1, prefix_len, dtype=torch.long, device=device),
+            pixel_values=pixel_values,
+            image_grid_thw=image_grid_thw,
+            position_ids=position_ids[..., :prefix_len],
+            past_key_values=cache,
+            use_cache=True,
+        )
+    prefill_seconds = time.perf_counter() - start
+
+    results = {}
+    for task, input_ids in task_input_ids.items():
+        # The task's own prompt tokens follow the prefix; text positions continue linearly
+        seq_len = input_ids.shape[1]
+        with torch.no_grad():
+            logits = model(
+                input_ids=input_ids[:, prefix_len:],
+                attention_mask=torch.ones(1, seq_len, dtype=torch.long, device=device),
+                position_ids=_positionIds(prefix_len, seq_len - prefix_len, rope_delta, device),
+                past_key_values=cache,
+                use_cache=True,
+            ).logits[0, -1]
+
+            tokens = []
+            limit = max_new_tokens.get(task, TASK_MAX_NEW_TOKENS[TASK_STORY])
+            while True:
+                token = pick(logits)
+                tokens.append(token)
+                if token in eos_token_ids or len(tokens) >= limit:
+                    break
+                logits = model(
+                    input_ids=torch.tensor([[token]], device=device),
+                    attention_mask=torch.ones(1, seq_len + 1, dtype=torch.long, device=device),
+                    position_ids=_positionIds(seq_len, 1, rope_delta, device),
+                    past_key_values=cache,
+                    use_cache=True,
+                ).logits[0, -1]
+                seq_len += 1
+        results[task] = tokens
+
+        # Roll the cache back to the shared prefix for the next task (negative crop removes that many tokens)
+        appended = seq_len - prefix_len
+        if appended > 0:
+            cache.crop(-appended)
+
+    stats = _stats(task_input_ids, prefix_len, results, prefill_seconds, time.perf_counter() - start)
+    return results, stats
+
+
+def multiTaskGenerateOnnx(onnx_model, task_input_ids, pixel_values, image_grid_thw, max_new_tokens=None,
+                          temperature=None, seed=None):
+    """ONNX Runtime version of multiTaskGenerate() (task_input_ids hold NumPy arrays)."""
+    max_new_tokens = max_new_tokens or TASK_MAX_NEW_TOKENS
+    rng = np.random.default_rng(seed)
+
+    start = time.perf_counter()
+    first_ids = np.asarray(next(iter(task_input_ids.values())))
+    prefix_len = sharedPrefixLength(list(task_input_ids.values()), onnx_model.metadata["image_token_id"])
+    _, prefix_past, rope_delta = onnx_model.prefill(first_ids[:, :prefix_len], pixel_values, image_grid_thw)
+    prefill_seconds = time.perf_counter() - start
+
+    results = {}
+    for task, input_ids in task_input_ids.items():
+        # ONNX Runtime returns new cache arrays, so the prefix cache is reused as is
+        input_ids = np.asarray(input_ids)
+        logits, past = onnx_model.extend(input_ids[0, prefix_len:], prefix_past, prefix_len, rope_delta)
+        limit = max_new_tokens.get(task, TASK_MAX_NEW_TOKENS[TASK_STORY])
+        results[task] = onnx_model.decode(logits, past, input_ids.shape[1], rope_delta, limit, temperature, rng)
+
+    stats = _stats(task_input_ids, prefix_len, results, prefill_seconds, time.perf_counter() - start)
+    return results, stats
+
+
+def _stats(task_input_ids, prefix_len, results, prefill_seconds, seconds):
+    """Prefix sharing and timing statistics of one multi-task generation."""
+    return {
+        "tasks": len(results),
+        "prefix_tokens": prefix_len,
+        "suffix_tokens": sum(ids.shape[1] - prefix_len for ids in task_input_ids.values()),
+        "saved_prefill_tokens": prefix_len * (len(results) - 1),
+        "new_tokens": sum(len(tokens) for tokens in results.values()),
+        "prefill_seconds": prefill_seconds,
+        "seconds": seconds,
+    }
+
+
+def verifyMultiTask(max_new_tokens=12):
+    """Check on a tiny model that shared-prefix outputs equal separate greedy generations (torch and ONNX)."""
+    import tempfile
+    from transformers import Qwen2VLImageProcessor
+    from OnnxBackend import OnnxSketchModel
+    from OnnxExport import buildTinyModel, exportModel, _multimodalInputs, _prepareImageInputs
+    from ReferenceSketches import referenceSketch
+
+    model = buildTinyModel()
+    model.generation_config.eos_token_id = None
+    config = model.config
+    image_processor = Qwen2VLImageProcessor()
+    pixel_values, image_grid_thw = _prepareImageInputs(image_processor, referenceSketch(), 56)
+    num_image_tokens = int(image_grid_thw.prod()) // config.vision_config.spatial_merge_size ** 2
+    prefix = [5, 6, 7, config.vision_start_token_id] + [config.image_token_id] * num_image_tokens \
+        + [config.vision_end_token_id]
+    task_input_ids = {
+        TASK_STORY: torch.tensor([prefix + [8, 9, 10, 11]]),
+        TASK_VOCABULARY: torch.tensor([prefix + [12, 13]]),
+        TASK_GERMAN_SENTENCE: torch.tensor([prefix + [8, 14, 15]]),
+    }
+    limits = {task: max_new_tokens for task in task_input_ids}
+
+    expected = {}
+    separate_seconds = 0.0
+    for task, input_ids in task_input_ids.items():
+        inputs = _multimodalInputs(model, input_ids, pixel_values, image_grid_thw)
+        start = time.perf_counter()
+        with torch.no_grad():
+            output = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False)
+        separate_seconds += time.perf_counter() - start
+        expected[task] = output[0, input_ids.shape[1]:].tolist()
+
+    results, stats = multiTaskGenerate(model, task_input_ids, pixel_values, image_grid_thw, limits)
+    ok = results == expected
+    print(f"torch: prefix {stats['prefix_tokens']} tokens shared by {stats['tasks']} tasks, "
+          f"{stats['seconds']:.3f}s vs {separate_seconds:.3f}s separately, outputs match: {ok}")
+
+    with tempfile.TemporaryDirectory() as onnx_dir:
+        exportModel(model, image_processor, onnx_dir, 56)
+        onnx_model = OnnxSketchModel(onnx_dir)
+        onnx_model.metadata["eos_token_ids"] = []
+        onnx_model.metadata["generation"]["do_sample"] = False
+        onnx_inputs = {task: ids.numpy() for task, ids in task_input_ids.items()}
+        onnx_results, onnx_stats = multiTaskGenerateOnnx(onnx_model, onnx_inputs, pixel_values.numpy(),
+                                                         image_grid_thw.numpy(), limits)
+    onnx_ok = onnx_results == expected
+    print(f"onnx:  {onnx_stats['seconds']:.3f}s, outputs match: {onnx_ok}")
+
+    ok = ok and onnx_ok
+    print("Verification " + ("passed" if ok else "FAILED"))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared-prefill multi-task generation.")
+    parser.add_argument("--verify", action="store_true",
+                        help="Compare shared-prefix outputs with separate generations on a tiny model")
+    args = parser.parse_args()
+
+    if args.verify:
+        return 0 if verifyMultiTask() else 1
+    parser.print_help()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
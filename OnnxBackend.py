@@ -0,0 +1,198 @@
+"""
+ONNX Backend - Runs an exported Qwen2-VL model with ONNX Runtime
+The model directory is produced once by OnnxExport.py
+"""
+
+import json
+import os
+import numpy as np
+
+# Default location of the exported model (created by OnnxExport.py)
+DEFAULT_ONNX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "onnx_model")
+
+# Files inside an exported model directory
+METADATA_FILE = "metadata.json"
+VISION_FILE = "vision.onnx"
+DECODER_FILE = "decoder.onnx"
+EMBED_FILE = "embed_tokens.npy"
+
+
+def computeRopeIndex(input_ids, image_token_id, image_grid_thw, spatial_merge_size):
+    """Compute Qwen2-VL multimodal (M-RoPE) position ids for one sequence.
+
+    Text tokens advance all three (temporal, height, width) axes together,
+    image tokens are laid out on their merged patch grid. Returns the
+    position ids with shape (3, 1, seq_len) and the offset to add to the
+    sequence index for every generated token.
+    """
+    input_ids = np.asarray(input_ids).reshape(-1)
+    positions = []
+    start = 0
+    next_position = 0
+    image_index = 0
+
+    image_starts = np.flatnonzero(input_ids == image_token_id)
+    while start < len(input_ids):
+        remaining = image_starts[image_starts >= start]
+        if len(remaining) == 0 or image_index >= len(image_grid_thw):
+            text_len = len(input_ids) - start
+            positions.append(np.tile(np.arange(text_len) + next_position, (3, 1)))
+            break
+
+        # Text before the image
+        text_len = int(remaining[0]) - start
+        positions.append(np.tile(np.arange(text_len) + next_position, (3, 1)))
+        next_position += text_len
+
+        # Image patches on the merged grid
+        t, h, w = (int(v) for v in image_grid_thw[image_index])
+        h, w = h // spatial_merge_size, w // spatial_merge_size
+        t_index = np.repeat(np.arange(t), h * w)
+        h_index = np.tile(np.repeat(np.arange(h), w), t)
+        w_index = np.tile(np.arange(w), t * h)
+        positions.append(np.stack([t_index, h_index, w_index]) + next_position)
+        next_position += max(t, h, w)
+
+        start = int(remaining[0]) + t * h * w
+        image_index += 1
+
+    position_ids = np.concatenate(positions, axis=1).astype(np.int64)
+    rope_delta = int(position_ids.max()) + 1 - len(input_ids)
+    return position_ids.reshape(3, 1, -1), rope_delta
+
+
+def selectNextToken(logits, do_sample=False, temperature=1.0, top_k=0, top_p=1.0, rng=None):
+    """Pick the next token id from last-position logits like transformers' generate()."""
+    logits = np.asarray(logits, dtype=np.float64).reshape(-1)
+    if not do_sample or top_k == 1:
+        return int(np.argmax(logits))
+
+    logits = logits / max(temperature, 1e-5)
+    if top_k and top_k < len(logits):
+        kth = np.partition(logits, -top_k)[-top_k]
+        logits = np.where(logits < kth, -np.inf, logits)
+
+    probs = np.exp(logits - np.max(logits))
+    probs /= probs.sum()
+    if top_p < 1.0:
+        order = np.argsort(-probs)
+        cumulative = np.cumsum(probs[order])
+        # Keep the smallest prefix whose mass reaches top_p (always at least one token)
+        keep = cumulative - probs[order] < top_p
+        filtered = np.zeros_like(probs)
+        filtered[order[keep]] = probs[order[keep]]
+        probs = filtered / filtered.sum()
+
+    rng = rng or np.random.default_rng()
+    return int(rng.choice(len(probs), p=probs))
+
+
+class OnnxSketchModel:
+    """Qwen2-VL vision encoder + decoder with KV cache running on ONNX Runtime."""
+
+    def __init__(self, model_dir=DEFAULT_ONNX_DIR, num_threads=None):
+        import onnxruntime as ort
+
+        with open(os.path.join(model_dir, METADATA_FILE), "r", encoding="utf-8") as f:
+            self.metadata = json.load(f)
+        self.model_dir = model_dir
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        providers = ["CPUExecutionProvider"]
+
+        self.vision = ort.InferenceSession(os.path.join(model_dir, VISION_FILE), options, providers=providers)
+        self.decoder = ort.InferenceSession(os.path.join(model_dir, DECODER_FILE), options, providers=providers)
+
+        # Memory-mapped so that only the rows of the tokens actually used are paged in
+        self.embed_tokens = np.load(os.path.join(model_dir, EMBED_FILE), mmap_mode="r")
+
+        self.num_layers = self.metadata["num_layers"]
+        self.past_shape = (1, self.metadata["num_key_value_heads"], 0, self.metadata["head_dim"])
+
+    def imageSize(self):
+        """Get the (width, height) images must be resized to (the vision graph is fixed-size)."""
+        return tuple(self.metadata["image_size"])
+
+    def encodeImage(self, pixel_values, image_grid_thw):
+        """Run the vision tower on processor pixel values."""
+        expected = [list(self.metadata["image_grid_thw"])]
+        if np.asarray(image_grid_thw).tolist() != expected:
+            raise ValueError(
+                f"ONNX vision encoder was exported for image grid {expected}, "
+                f"got {np.asarray(image_grid_thw).tolist()}. Resize the image to {self.imageSize()}."
+            )
+        return self.vision.run(None, {"pixel_values": np.asarray(pixel_values, dtype=np.float32)})[0]
+
+    def embed(self, input_ids):
+        """Look up token embeddings."""
+        return np.asarray(self.embed_tokens[np.asarray(input_ids).reshape(-1)], dtype=np.float32)[None]
+
+    def forward(self, inputs_embeds, attention_mask, position_ids, past):
+        """Run the decoder once. Returns last-position logits and the updated KV cache."""
+        feeds = {
+            "inputs_embeds": inputs_embeds.astype(np.float32),
+            "attention_mask": attention_mask.astype(np.int64),
+            "position_ids": position_ids.astype(np.int64),
+        }
+        for i in range(self.num_layers):
+            feeds[f"past_key_{i}"] = past[2 * i]
+            feeds[f"past_value_{i}"] = past[2 * i + 1]
+        outputs = self.decoder.run(None, feeds)
+        return outputs[0][0, -1], outputs[1:]
+
+    def prefill(self, input_ids, pixel_values, image_grid_thw):
+        """Encode the image and the prompt. Returns (logits, past, rope_delta)."""
+        inputs_embeds = self.embed(input_ids)
+        image_mask = np.asarray(input_ids).reshape(-1) == self.metadata["image_token_id"]
+        if pixel_values is not None and image_mask.any():
+            inputs_embeds[0, image_mask] = self.encodeImage(pixel_values, image_grid_thw)
+
+        position_ids, rope_delta = computeRopeIndex(
+            input_ids,
+            self.metadata["image_token_id"],
+            image_grid_thw if image_grid_thw is not None else [],
+            self.metadata["spatial_merge_size"],
+        )
+        attention_mask = np.ones((1, inputs_embeds.shape[1]), dtype=np.int64)
+        past = [np.zeros(self.past_shape, dtype=np.float32) for _ in range(2 * self.num_layers)]
+        logits, past = self.forward(inputs_embeds, attention_mask, position_ids, past)
+        return logits, past, rope_delta
+
+    def extend(self, input_ids, past, past_len, rope_delta):
+        """Feed text tokens after a cached prefix of past_len tokens. Returns (logits, past)."""
+        input_ids = np.asarray(input_ids).reshape(-1)
+        positions = np.arange(past_len, past_len + len(input_ids), dtype=np.int64) + rope_delta
+        position_ids = np.broadcast_to(positions, (3, 1, len(input_ids)))
+        attention_mask = np.ones((1, past_len + len(input_ids)), dtype=np.int64)
+        return self.forward(self.embed(input_ids), attention_mask, position_ids, past)
+
+    def decode(self, logits, past, seq_len, rope_delta, max_new_tokens=500, temperature=None, rng=None):
+        """Generate new token ids from the logits and KV cache of a prefilled sequence of seq_len tokens."""
+        generation = self.metadata.get("generation", {})
+        do_sample = generation.get("do_sample", False)
+        top_k = generation.get("top_k", 0) or 0
+        top_p = generation.get("top_p", 1.0) or 1.0
+        if temperature is None:
+            temperature = generation.get("temperature", 1.0) or 1.0
+        eos_token_ids = set(self.metadata.get("eos_token_ids", []))
+
+        new_tokens = []
+        for _ in range(max_new_tokens):
+            token = selectNextToken(logits, do_sample, temperature, top_k, top_p, rng)
+            new_tokens.append(token)
+            if token in eos_token_ids or len(new_tokens) == max_new_tokens:
+                break
+            logits, past = self.extend([token], past, seq_len, rope_delta)
+            seq_len += 1
+
+        return new_tokens
+
+    def generate(self, input_ids, pixel_values=None, image_grid_thw=None, max_new_tokens=500,
+                 temperature=None, seed=None):
+        """Generate new token ids (without the prompt) for a single sequence."""
+        logits, past, rope_delta = self.prefill(input_ids, pixel_values, image_grid_thw)
+        return self.decode(logits, past, np.asarray(input_ids).size, rope_delta, max_new_tokens, temperature,
+                           np.random.default_rng(seed))
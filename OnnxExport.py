@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+ONNX Export - One-time conversion of Qwen2-VL to ONNX for the ONNX Runtime backend
+
+Usage:
+    python OnnxExport.py                      # export Qwen/Qwen2-VL-2B-Instruct to ./onnx_model
+    python OnnxExport.py --verify             # export a tiny random model and compare with PyTorch
+    python OnnxExport.py --benchmark          # compare torch vs ONNX Runtime latency on the exported model
+"""
+
+import argparse
+import inspect
+import json
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import torch
+
+from OnnxBackend import (
+    DEFAULT_ONNX_DIR, METADATA_FILE, VISION_FILE, DECODER_FILE, EMBED_FILE, OnnxSketchModel
+)
+from ReferenceSketches import referenceSketch
+
+DEFAULT_MODEL_NAME = "Qwen/Qwen2-VL-2B-Instruct"
+
+# The vision graph is traced for one fixed image size (multiple of 28 = patch 14 x merge 2)
+DEFAULT_IMAGE_SIZE = 448
+
+OPSET_VERSION = 17
+
+
+def _visionTower(model):
+    """Get the vision tower across transformers versions."""
+    visual = getattr(model.model, "visual", None)
+    return visual if visual is not None else model.visual
+
+
+def _languageModel(model):
+    """Get the text decoder (without LM head) across transformers versions."""
+    language_model = getattr(model.model, "language_model", None)
+    return language_model if language_model is not None else model.model
+
+
+def _cacheTensors(cache):
+    """Flatten a transformers KV cache into [key_0, value_0, key_1, value_1, ...]."""
+    if hasattr(cache, "layers"):
+        pairs = [(layer.keys, layer.values) for layer in cache.layers]
+    else:
+        pairs = zip(cache.key_cache, cache.value_cache)
+    return [tensor for pair in pairs for tensor in pair]
+
+
+class _VisionWrapper(torch.nn.Module):
+    """Vision tower with the image grid baked in as a constant."""
+
+    def __init__(self, visual, image_grid_thw):
+        super().__init__()
+        self.visual = visual
+        self.register_buffer("image_grid_thw", image_grid_thw)
+
+    def forward(self, pixel_values):
+        output = self.visual(pixel_values, grid_thw=self.image_grid_thw)
+        # Newer transformers return the merged image embeddings as pooler_output
+        return getattr(output, "pooler_output", output)
+
+
+class _DecoderWrapper(torch.nn.Module):
+    """Text decoder + LM head with an explicit, flattened KV cache."""
+
+    def __init__(self, language_model, lm_head, num_layers):
+        super().__init__()
+        self.language_model = language_model
+        self.lm_head = lm_head
+        self.num_layers = num_layers
+
+    def forward(self, inputs_embeds, attention_mask, position_ids, *past):
+        from transformers import DynamicCache
+
+        cache = DynamicCache()
+        for i in range(self.num_layers):
+            cache.update(past[2 * i], past[2 * i + 1], i)
+
+        output = self.language_model(
+            inputs_embeds=inputs_embeds,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=cache,
+            use_cache=True,
+        )
+        # Only the last position is needed for decoding; full logits would be seq_len x vocab
+        logits = self.lm_head(output.last_hidden_state[:, -1:, :])
+        return (logits, *_cacheTensors(output.past_key_values))
+
+
+def _textConfig(config):
+    """Get the text config across transformers versions."""
+    text_config = getattr(config, "text_config", None)
+    return text_config if text_config is not None else config
+
+
+def _prepareImageInputs(image_processor, image, image_size):
+    """Run the image processor on a sketch letterboxed to the export size."""
+    from SketchAnalyzer import fitImage
+
+    inputs = image_processor(images=[fitImage(image, image_size)], return_tensors="pt")
+    return inputs["pixel_values"], inputs["image_grid_thw"]
+
+
+def exportModel(model, image_processor, output_dir, image_size=DEFAULT_IMAGE_SIZE, processor=None):
+    """Export the vision tower, decoder and token embeddings of a float model to output_dir."""
+    os.makedirs(output_dir, exist_ok=True)
+    model = model.float().eval()
+    config = model.config
+    text_config = _textConfig(config)
+
+    num_layers = text_config.num_hidden_layers
+    num_kv_heads = text_config.num_key_value_heads
+    head_dim = getattr(text_config, "head_dim", None) or text_config.hidden_size // text_config.num_attention_heads
+    hidden_size = text_config.hidden_size
+
+    # Tracer warnings about constants are expected: the image grid is fixed on purpose
+    warnings.filterwarnings("ignore", category=torch.jit.TracerWarning)
+    warnings.filterwarnings("ignore", message=".*legacy TorchScript-based ONNX export.*")
+
+    # Vision tower for the fixed image size
+    pixel_values, image_grid_thw = _prepareImageInputs(image_processor, referenceSketch(), image_size)
+    with torch.no_grad():
+        torch.onnx.export(
+            _VisionWrapper(_visionTower(model), image_grid_thw),
+            (pixel_values,),
+            os.path.join(output_dir, VISION_FILE),
+            input_names=["pixel_values"],
+            output_names=["image_embeds"],
+            opset_version=OPSET_VERSION,
+            dynamo=False,
+        )
+
+    # Decoder with KV cache inputs; traced with a non-empty cache, run with any length (including 0)
+    seq_len, past_len = 3, 2
+    past = [torch.zeros(1, num_kv_heads, past_len, head_dim) for _ in range(2 * num_layers)]
+    dummy_inputs = (
+        torch.zeros(1, seq_len, hidden_size),
+        torch.ones(1, past_len + seq_len, dtype=torch.long),
+        torch.arange(past_len, past_len + seq_len).view(1, 1, -1).expand(3, 1, seq_len).contiguous(),
+        *past,
+    )
+    past_names = [f"past_{kind}_{i}" for i in range(num_layers) for kind in ("key", "value")]
+    present_names = [f"present_{kind}_{i}" for i in range(num_layers) for kind in ("key", "value")]
+    dynamic_axes = {
+        "inputs_embeds": {1: "seq_len"},
+        "attention_mask": {1: "total_len"},
+        "position_ids": {2: "seq_len"},
+    }
+    dynamic_axes.update({name: {2: "past_len"} for name in past_names})
+    dynamic_axes.update({name: {2: "total_len"} for name in present_names})
+    with torch.no_grad():
+        torch.onnx.export(
+            _DecoderWrapper(_languageModel(model), model.lm_head, num_layers),
+            dummy_inputs,
+            os.path.join(output_dir, DECODER_FILE),
+            input_names=["inputs_embeds", "attention_mask", "position_ids", *past_names],
+            output_names=["logits", *present_names],
+            dynamic_axes=dynamic_axes,
+            opset_version=OPSET_VERSION,
+            dynamo=False,
+        )
+
+    # Token embeddings are looked up in NumPy (memory-mapped) instead of being duplicated in a graph
+    embed_weight = model.get_input_embeddings().weight.detach().numpy().astype(np.float32)
+    np.save(os.path.join(output_dir, EMBED_FILE), embed_weight)
+
+    generation_config = model.generation_config
+    eos_token_id = generation_config.eos_token_id
+    if eos_token_id is None:
+        eos_token_id = text_config.eos_token_id
+    metadata = {
+        "num_layers": num_layers,
+        "num_key_value_heads": num_kv_heads,
+        "head_dim": head_dim,
+        "hidden_size": hidden_size,
+        "image_token_id": config.image_token_id,
+        "spatial_merge_size": config.vision_config.spatial_merge_size,
+        "image_size": [image_size, image_size],
+        "image_grid_thw": image_grid_thw[0].tolist(),
+        "eos_token_ids": eos_token_id if isinstance(eos_token_id, list) else [eos_token_id],
+        "generation": {
+            "do_sample": bool(generation_config.do_sample),
+            "top_k": generation_config.top_k if generation_config.top_k is not None else 50,
+            "top_p": generation_config.top_p if generation_config.top_p is not None else 1.0,
+            "temperature": generation_config.temperature if generation_config.temperature is not None else 1.0,
+        },
+    }
+    with open(os.path.join(output_dir, METADATA_FILE), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+
+    if processor is not None:
+        processor.save_pretrained(output_dir)
+    return metadata
+
+
+def _multimodalInputs(model, input_ids, pixel_values, image_grid_thw):
+    """Build torch model inputs for a hand-made token sequence with one image."""
+    inputs = {
+        "input_ids": input_ids,
+        "attention_mask": torch.ones_like(input_ids),
+        "pixel_values": pixel_values,
+        "image_grid_thw": image_grid_thw,
+    }
+    # Newer transformers need the token types for M-RoPE (normally returned by the processor)
+    if "mm_token_type_ids" in inspect.signature(model.forward).parameters:
+        inputs["mm_token_type_ids"] = (input_ids == model.config.image_token_id).int()
+    return inputs
+
+
+def _torchGenerate(model, input_ids, pixel_values, image_grid_thw, max_new_tokens):
+    """Greedy generation with the torch model; returns only the new token ids."""
+    with torch.no_grad():
+        output = model.generate(
+            **_multimodalInputs(model, input_ids, pixel_values, image_grid_thw),
+            max_new_tokens=max_new_tokens,
+            min_new_tokens=max_new_tokens,
+            do_sample=False,
+        )
+    return output[0, input_ids.shape[1]:].tolist()
+
+
+def _onnxGenerate(onnx_model, input_ids, pixel_values, image_grid_thw, max_new_tokens):
+    """Greedy generation with the ONNX Runtime backend (EOS ignored to match min_new_tokens)."""
+    onnx_model.metadata["eos_token_ids"] = []
+    onnx_model.metadata["generation"]["do_sample"] = False
+    return onnx_model.generate(input_ids.numpy(), pixel_values.numpy(), image_grid_thw.numpy(), max_new_tokens)
+
+
+def _timed(function, *args, repeats=3):
+    """Run function a few times and return (last result, best wall time in seconds)."""
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def _printLatency(torch_seconds, onnx_seconds, max_new_tokens):
+    """Print the torch vs ONNX Runtime latency comparison."""
+    print(f"{'backend':<10}{'latency (s)':>14}{'ms/token':>12}")
+    for name, seconds in (("torch", torch_seconds), ("onnx", onnx_seconds)):
+        print(f"{name:<10}{seconds:>14.3f}{seconds * 1000 / max_new_tokens:>12.1f}")
+    print(f"speedup: {torch_seconds / onnx_seconds:.2f}x")
+
+
+def buildTinyModel(seed=0):
+    """Build a small randomly initialized Qwen2-VL model for export verification."""
+    from transformers import Qwen2VLConfig, Qwen2VLForConditionalGeneration
+
+    torch.manual_seed(seed)
+    config = Qwen2VLConfig(
+        vision_config={"depth": 2, "embed_dim": 32, "hidden_size": 64, "num_heads": 2, "mlp_ratio": 2},
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        vocab_size=1000,
+        bos_token_id=0,
+        eos_token_id=1,
+        video_token_id=996,
+        image_token_id=997,
+        vision_start_token_id=998,
+        vision_end_token_id=999,
+        rope_scaling={"type": "mrope", "mrope_section": [2, 3, 3]},
+        attn_implementation="eager",
+    )
+    return Qwen2VLForConditionalGeneration(config).eval()
+
+
+def verifyExport(image_size=56, max_new_tokens=16, atol=1e-3):
+    """Export a tiny random model and check the ONNX outputs against PyTorch. Returns True on success."""
+    from transformers import Qwen2VLImageProcessor
+
+    model = buildTinyModel()
+    image_processor = Qwen2VLImageProcessor()
+    config = model.config
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        exportModel(model, image_processor, output_dir, image_size)
+        onnx_model = OnnxSketchModel(output_dir)
+
+        # A different sketch than the one used for tracing
+        sketch = referenceSketch().transpose(0)
+        pixel_values, image_grid_thw = _prepareImageInputs(image_processor, sketch, image_size)
+        num_image_tokens = int(image_grid_thw.prod()) // config.vision_config.spatial_merge_size ** 2
+        input_ids = torch.tensor([[5, 6, 7, config.vision_start_token_id]
+                                  + [config.image_token_id] * num_image_tokens
+                                  + [config.vision_end_token_id, 8, 9, 10]])
+
+        with torch.no_grad():
+            torch_embeds = _VisionWrapper(_visionTower(model), image_grid_thw)(pixel_values).numpy()
+            torch_logits = model(
+                **_multimodalInputs(model, input_ids, pixel_values, image_grid_thw)
+            ).logits[0, -1].numpy()
+        onnx_embeds = onnx_model.encodeImage(pixel_values.numpy(), image_grid_thw.numpy())
+        onnx_logits, _, _ = onnx_model.prefill(input_ids.numpy(), pixel_values.numpy(), image_grid_thw.numpy())
+
+        torch_tokens, torch_seconds = _timed(_torchGenerate, model, input_ids, pixel_values, image_grid_thw,
+                                             max_new_tokens)
+        onnx_tokens, onnx_seconds = _timed(_onnxGenerate, onnx_model, input_ids, pixel_values, image_grid_thw,
+                                           max_new_tokens)
+
+    embeds_diff = float(np.abs(torch_embeds - onnx_embeds).max())
+    logits_diff = float(np.abs(torch_logits - onnx_logits).max())
+    tokens_match = torch_tokens == onnx_tokens
+    print(f"vision embeddings max abs diff: {embeds_diff:.2e}")
+    print(f"prefill logits max abs diff:    {logits_diff:.2e}")
+    print(f"greedy tokens match:            {tokens_match} ({len(onnx_tokens)} tokens)")
+    _printLatency(torch_seconds, onnx_seconds, max_new_tokens)
+
+    ok = embeds_diff <= atol and logits_diff <= atol and tokens_match
+    print("Verification " + ("passed" if ok else "FAILED"))
+    return ok
+
+
+def benchmark(model_name, onnx_dir, max_new_tokens=32):
+    """Compare torch and ONNX Runtime latency for the reference sketch on the real model."""
+    from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
+    from SketchAnalyzer import SketchAnalyzer, buildMessages, fitImage
+
+    onnx_model = OnnxSketchModel(onnx_dir)
+    processor = AutoProcessor.from_pretrained(onnx_dir)
+    model = Qwen2VLForConditionalGeneration.from_pretrained(model_name, torch_dtype=torch.float32).eval()
+
+    image = fitImage(referenceSketch(), onnx_model.imageSize()[0])
+    text = processor.apply_chat_template(buildMessages(image, SketchAnalyzer.generatePrompt()), tokenize=False,
+                                         add_generation_prompt=True)
+    inputs = processor(text=[text], images=[image], return_tensors="pt")
+
+    torch_tokens, torch_seconds = _timed(_torchGenerate, model, inputs["input_ids"], inputs["pixel_values"],
+                                         inputs["image_grid_thw"], max_new_tokens, repeats=1)
+    onnx_tokens, onnx_seconds = _timed(_onnxGenerate, onnx_model, inputs["input_ids"], inputs["pixel_values"],
+                                       inputs["image_grid_thw"], max_new_tokens, repeats=1)
+
+    print(f"greedy tokens match: {torch_tokens == onnx_tokens}")
+    _printLatency(torch_seconds, onnx_seconds, max_new_tokens)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export Qwen2-VL to ONNX for the ONNX Runtime backend.")
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME, help="Hugging Face model name or local path")
+    parser.add_argument("--output", default=DEFAULT_ONNX_DIR, help="Directory for the exported model")
+    parser.add_argument("--image-size", type=int, default=DEFAULT_IMAGE_SIZE,
+                        help="Square image size the vision encoder is exported for (multiple of 28)")
+    parser.add_argument("--verify", action="store_true",
+                        help="Export a tiny random model and check ONNX outputs against PyTorch")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Compare torch and ONNX Runtime latency on an already exported model")
+    parser.add_argument("--max-new-tokens", type=int, default=32, help="Tokens to generate when benchmarking")
+    args = parser.parse_args()
+
+    if args.image_size % 28:
+        parser.error("--image-size must be a multiple of 28")
+
+    if args.verify:
+        return 0 if verifyExport() else 1
+
+    if args.benchmark:
+        benchmark(args.model, args.output, args.max_new_tokens)
+        return 0
+
+    from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
+
+    print(f"Loading {args.model} in float32 for export...")
+    processor = AutoProcessor.from_pretrained(args.model, trust_remote_code=True)
+    model = Qwen2VLForConditionalGeneration.from_pretrained(
+        args.model, torch_dtype=torch.float32, attn_implementation="eager", trust_remote_code=True
+    )
+    print(f"Exporting to {args.output} (image size {args.image_size})...")
+    exportModel(model, processor.image_processor, args.output, args.image_size, processor)
+    print("Export complete. Select it with DRAWLINGO_BACKEND=onnx.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Parameter Sweep - Latency vs. quality of the inference settings on the reference sketches
+Every setting of a grid (image size, quantization, max_new_tokens, temperature) runs the
+reference sketches through the model; latency, peak memory, output length and consistency
+with a reference output (cut to the same token limit) are reported as a table with the
+Pareto-optimal settings marked
+
+Usage:
+    python ParameterSweep.py                               # full grid with the locally cached model
+    python ParameterSweep.py --quantizations int8 --max-new-tokens 64 128 --sketches house cat
+    python ParameterSweep.py --apply                       # also save the chosen setting as the tuned config
+"""
+
+import argparse
+import difflib
+import gc
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+import torch
+
+from AutoTuner import IMAGE_SIZES
+
+QUANTIZATIONS = ("none", "int8", "4bit")  # from highest to lowest fidelity
+MAX_NEW_TOKENS = (64, 128, 256)
+TEMPERATURES = (0.0, 0.7, 1.0)
+
+# Load settings per quantization mode (4bit keeps the checkpoint dtype for the non-quantized parts)
+QUANTIZATION_LOADS = {
+    "none": {"dtype": "auto", "quantization": "none"},
+    "int8": {"dtype": "float32", "quantization": "int8"},
+    "4bit": {"dtype": "auto", "quantization": "4bit"},
+}
+
+DEFAULT_OUTPUT = "sweep_results.json"
+MEMORY_POLL_SECONDS = 0.005
+
+# Objectives of the Pareto front: (key, True if larger is better)
+OBJECTIVES = (("latency_s", False), ("peak_memory_mb", False), ("consistency", True))
+
+
+def _rssMb():
+    """Current resident memory of this process in MB."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        # ru_maxrss is the peak so far (KB on Linux), the best available without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class PeakMemory:
+    """Context manager measuring the peak memory of a block (GPU memory on CUDA, else process RSS)."""
+
+    def __init__(self):
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+        else:
+            self.peak_mb = _rssMb()
+            self._thread = threading.Thread(target=self._poll, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak_mb = max(self.peak_mb, _rssMb())
+        else:
+            self.peak_mb = torch.cuda.max_memory_allocated() / 2 ** 20
+        return False
+
+    def _poll(self):
+        # torch kernels release the GIL, so this thread keeps sampling during generation
+        while not self._stop.wait(MEMORY_POLL_SECONDS):
+            self.peak_mb = max(self.peak_mb, _rssMb())
+
+
+def consistencyScore(text, reference):
+    """Similarity of two outputs in [0, 1]: matching word ratio of the lower-cased texts.
+
+    The ratio also drops with the length difference, so the reference should be cut to the
+    same token limit as the output.
+    """
+    words = text.lower().split()
+    reference_words = reference.lower().split()
+    if not words and not reference_words:
+        return 1.0
+    return difflib.SequenceMatcher(None, words, reference_words, autojunk=False).ratio()
+
+
+def paretoFront(rows, objectives=OBJECTIVES):
+    """Indices of the rows that no other row beats on every objective."""
+    def dominates(a, b):
+        better_or_equal = all((a[key] >= b[key]) if larger else (a[key] <= b[key]) for key, larger in objectives)
+        strictly_better = any((a[key] > b[key]) if larger else (a[key] < b[key]) for key, larger in objectives)
+        return better_or_equal and strictly_better
+
+    return [i for i, row in enumerate(rows) if not any(dominates(other, row) for other in rows)]
+
+
+def _generate(model, processor, image, prompt, setting, device):
+    """One generation for a sweep setting. Returns (text, new token ids, seconds, peak memory MB)."""
+    from SketchAnalyzer import buildMessages, fitImage, generationKwargs, prepareInputs
+
+    inputs = prepareInputs(processor, buildMessages(fitImage(image, setting["image_size"]), prompt), device)
+    torch.manual_seed(0)
+    with PeakMemory() as memory:
+        start = time.perf_counter()
+        with torch.no_grad():
+            output = model.generate(**inputs, **generationKwargs(setting))
+        seconds = time.perf_counter() - start
+    new_tokens = output[0, inputs.input_ids.shape[1]:].tolist()
+    text = processor.decode(new_tokens, skip_special_tokens=True).strip()
+    return text, new_tokens, seconds, memory.peak_mb
+
+
+def _summarize(setting, runs):
+    """Average the per-sketch runs of one setting."""
+    count = len(runs)
+    return dict(
+        setting,
+        latency_s=sum(run["seconds"] for run in runs) / count,
+        peak_memory_mb=max(run["peak_memory_mb"] for run in runs),
+        output_tokens=sum(run["output_tokens"] for run in runs) / count,
+        consistency=sum(run["consistency"] for run in runs) / count,
+    )
+
+
+def runSweep(model_name, image_sizes=IMAGE_SIZES, quantizations=QUANTIZATIONS, max_new_tokens=MAX_NEW_TOKENS,
+             temperatures=TEMPERATURES, sketch_names=None, status=print):
+    """Run the reference sketches under every setting of the grid.
+
+    The reference output of each sketch is the greedy output of the highest-fidelity
+    setting (first loadable quantization, largest image size and token limit). Each run
+    is compared with the reference cut to the run's token limit, so that a lower limit
+    does not score worse for the length alone.
+    Returns (per-setting summaries, per-run results, reference outputs).
+    """
+    from transformers import AutoProcessor
+    from ReferenceSketches import referenceSketches
+    from SketchAnalyzer import SketchAnalyzer, loadQwenModel
+
+    processor = AutoProcessor.from_pretrained(model_name, trust_remote_code=True, local_files_only=True)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    prompt = SketchAnalyzer.generatePrompt()
+    sketches = referenceSketches()
+    if sketch_names:
+        sketches = {name: sketches[name] for name in sketch_names}
+
+    quantizations = sorted(quantizations, key=QUANTIZATIONS.index)
+    summaries = []
+    results = []
+    references = None
+    for quantization in quantizations:
+        status(f"Loading {model_name} ({quantization})...")
+        try:
+            model = loadQwenModel(model_name, QUANTIZATION_LOADS[quantization])
+        except Exception as e:
+            print(f"Skipping {quantization}: {e}")
+            continue
+
+        if references is None:
+            reference_setting = {"image_size": max(image_sizes), "max_new_tokens": max(max_new_tokens),
+                                 "temperature": 0.0}
+            status(f"Reference outputs ({quantization}, {reference_setting['image_size']}px, greedy)...")
+            references = {name: _generate(model, processor, image, prompt, reference_setting, device)[1]
+                          for name, image in sketches.items()}
+        if getattr(model.generation_config, "top_k", None) == 1 and any(temperatures):
+            print("Note: the model's generation config has top_k=1, so temperature does not change the output")
+
+        # Warm-up run so that one-time initialization is not measured
+        _generate(model, processor, next(iter(sketches.values())), prompt,
+                  {"image_size": min(image_sizes), "max_new_tokens": 4, "temperature": 0.0}, device)
+
+        for image_size in image_sizes:
+            for tokens in max_new_tokens:
+                truncated = {name: processor.decode(ids[:tokens], skip_special_tokens=True).strip()
+                             for name, ids in references.items()}
+                for temperature in temperatures:
+                    setting = {"quantization": quantization, "image_size": image_size,
+                               "max_new_tokens": tokens, "temperature": temperature}
+                    runs = []
+                    for name, image in sketches.items():
+                        text, ids, seconds, peak_mb = _generate(model, processor, image, prompt, setting, device)
+                        runs.append(dict(setting, sketch=name, output=text, output_tokens=len(ids), seconds=seconds,
+                                         peak_memory_mb=peak_mb, consistency=consistencyScore(text, truncated[name])))
+                    results.extend(runs)
+                    summary = _summarize(setting, runs)
+                    summaries.append(summary)
+                    print(f"{quantization:>5} image={image_size:<4} tokens={tokens:<4} temp={temperature:<4} "
+                          f"{summary['latency_s']:.2f}s consistency={summary['consistency']:.2f}")
+
+        del model
+        gc.collect()
+
+    if not summaries:
+        raise RuntimeError("No quantization mode could be loaded")
+    for i in paretoFront(summaries):
+        summaries[i]["pareto"] = True
+    references = {name: processor.decode(ids, skip_special_tokens=True).strip() for name, ids in references.items()}
+    return summaries, results, references
+
+
+def formatTable(summaries):
+    """Sweep summaries as a text table sorted by latency (* marks Pareto-optimal settings)."""
+    header = (f"{'':1} {'quant':>5} {'image':>5} {'tokens':>6} {'temp':>4} {'latency s':>9} "
+              f"{'peak MB':>8} {'out tok':>7} {'consist.':>8}")
+    lines = [header, "-" * len(header)]
+    for row in sorted(summaries, key=lambda row: row["latency_s"]):
+        lines.append(f"{'*' if row.get('pareto') else '':1} {row['quantization']:>5} {row['image_size']:>5} "
+                     f"{row['max_new_tokens']:>6} {row['temperature']:>4.1f} {row['latency_s']:>9.2f} "
+                     f"{row['peak_memory_mb']:>8.0f} {row['output_tokens']:>7.1f} {row['consistency']:>8.2f}")
+    return "\n".join(lines)
+
+
+def chooseSetting(summaries, min_consistency):
+    """Fastest Pareto-optimal setting that is at least min_consistency consistent, or None."""
+    candidates = [row for row in summaries if row.get("pareto") and row["consistency"] >= min_consistency]
+    return min(candidates, key=lambda row: row["latency_s"]) if candidates else None
+
+
+def main():
+    # Only locally available weights are used; nothing is downloaded during a sweep
+    # (set before anything imports huggingface_hub, which reads it once)
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+    from SketchAnalyzer import MODEL_NAME
+    from ReferenceSketches import REFERENCE_SKETCHES
+
+    parser = argparse.ArgumentParser(description="Sweep inference settings and report latency vs. quality.")
+    parser.add_argument("--model", default=MODEL_NAME,
+                        help="Cached Hugging Face model name or local path (e.g. a prepared snapshot)")
+    parser.add_argument("--image-sizes", type=int, nargs="+", default=list(IMAGE_SIZES))
+    parser.add_argument("--quantizations", nargs="+", choices=QUANTIZATIONS, default=list(QUANTIZATIONS))
+    parser.add_argument("--max-new-tokens", type=int, nargs="+", default=list(MAX_NEW_TOKENS))
+    parser.add_argument("--temperatures", type=float, nargs="+", default=list(TEMPERATURES))
+    parser.add_argument("--sketches", nargs="+", choices=sorted(REFERENCE_SKETCHES),
+                        help="Reference sketches to run (default: all)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSON file for the full results")
+    parser.add_argument("--apply", action="store_true",
+                        help="Save the fastest Pareto-optimal setting into this machine's tuned config")
+    parser.add_argument("--min-consistency", type=float, default=0.5,
+                        help="Lowest consistency accepted by --apply")
+    args = parser.parse_args()
+
+    summaries, results, references = runSweep(args.model, args.image_sizes, args.quantizations,
+                                              args.max_new_tokens, args.temperatures, args.sketches)
+    print()
+    print(formatTable(summaries))
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"model": args.model, "summaries": summaries, "results": results, "references": references},
+                  f, indent=2)
+    print(f"\nFull results saved to {args.output}")
+
+    if args.apply:
+        from AutoTuner import loadTunedConfig, saveTunedConfig
+        from SketchAnalyzer import DEFAULT_INFERENCE_CONFIG
+
+        best = chooseSetting(summaries, args.min_consistency)
+        if best is None:
+            print(f"No Pareto-optimal setting reaches consistency {args.min_consistency}; tuned config unchanged")
+            return 1
+        config = dict(DEFAULT_INFERENCE_CONFIG, **(loadTunedConfig() or {}))
+        config.update({key: best[key] for key in ("image_size", "max_new_tokens", "temperature")})
+        config.update(QUANTIZATION_LOADS[best["quantization"]])
+        saveTunedConfig(config, summaries)
+        print(f"Saved tuned config: {config}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
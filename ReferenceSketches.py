@@ -0,0 +1,135 @@
+"""
+Reference Sketches - Fixed, programmatically drawn sketches for benchmarking
+"""
+
+import math
+
+from PIL import Image, ImageDraw
+
+# Default size of the reference sketches (matches the default canvas size)
+DEFAULT_SIZE = (800, 600)
+
+
+def drawHouse(size=DEFAULT_SIZE):
+    """Draw a simple child-like house with a door, a window and a roof."""
+    width, height = size
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+
+    line = max(2, width // 160)
+    left, right = int(width * 0.3), int(width * 0.7)
+    top, bottom = int(height * 0.45), int(height * 0.85)
+
+    # Walls and roof
+    draw.rectangle((left, top, right, bottom), outline="black", width=line)
+    draw.line((left, top, width // 2, int(height * 0.2), right, top), fill="red", width=line, joint="curve")
+
+    # Door and window
+    doorWidth = (right - left) // 5
+    draw.rectangle((width // 2 - doorWidth // 2, bottom - (bottom - top) // 2, width // 2 + doorWidth // 2, bottom),
+                   outline="black", width=line)
+    draw.rectangle((left + doorWidth // 2, top + doorWidth // 2, left + doorWidth * 3 // 2, top + doorWidth * 3 // 2),
+                   outline="blue", width=line)
+
+    # Ground
+    draw.line((0, bottom, width, bottom), fill="green", width=line)
+    return image
+
+
+def drawSun(size=DEFAULT_SIZE):
+    """Draw a smiling sun with rays."""
+    width, height = size
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+
+    line = max(2, width // 160)
+    cx, cy, radius = width // 2, height // 2, min(width, height) // 5
+    draw.ellipse((cx - radius, cy - radius, cx + radius, cy + radius), outline="orange", width=line)
+    for i in range(12):
+        angle = i * math.pi / 6
+        inner, outer = radius * 1.25, radius * 1.8
+        draw.line((cx + inner * math.cos(angle), cy + inner * math.sin(angle),
+                   cx + outer * math.cos(angle), cy + outer * math.sin(angle)), fill="orange", width=line)
+
+    # Eyes and smile
+    eye = radius // 8
+    for ex in (cx - radius // 3, cx + radius // 3):
+        draw.ellipse((ex - eye, cy - radius // 3 - eye, ex + eye, cy - radius // 3 + eye), fill="black")
+    draw.arc((cx - radius // 2, cy - radius // 4, cx + radius // 2, cy + radius // 2), 20, 160, fill="black", width=line)
+    return image
+
+
+def drawCat(size=DEFAULT_SIZE):
+    """Draw a sitting cat: round head with ears and whiskers on an oval body, with a tail."""
+    width, height = size
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+
+    line = max(2, width // 160)
+    cx = width // 2
+    head = min(width, height) // 8
+    head_y = int(height * 0.35)
+
+    # Body and tail
+    draw.ellipse((cx - head * 1.6, head_y + head * 0.6, cx + head * 1.6, head_y + head * 4.2), outline="black", width=line)
+    draw.arc((cx + head * 0.8, head_y + head * 2.2, cx + head * 3.2, head_y + head * 4.4), 180, 330,
+             fill="black", width=line)
+
+    # Head and ears
+    draw.ellipse((cx - head, head_y - head, cx + head, head_y + head), fill="white", outline="black", width=line)
+    for side in (-1, 1):
+        draw.line((cx + side * head * 0.8, head_y - head * 0.5, cx + side * head * 0.9, head_y - head * 1.6,
+                   cx + side * head * 0.2, head_y - head * 0.95), fill="black", width=line, joint="curve")
+
+    # Eyes, nose and whiskers
+    eye = max(2, head // 8)
+    for side in (-1, 1):
+        ex = cx + side * head // 3
+        draw.ellipse((ex - eye, head_y - head // 4 - eye, ex + eye, head_y - head // 4 + eye), fill="green")
+        for dy in (-head // 8, head // 8):
+            draw.line((cx + side * head // 5, head_y + head // 4, cx + side * head * 1.4, head_y + head // 4 + dy * 2),
+                      fill="black", width=max(1, line // 2))
+    draw.polygon((cx - eye, head_y + head // 8, cx + eye, head_y + head // 8, cx, head_y + head // 4), fill="pink")
+    return image
+
+
+def drawTree(size=DEFAULT_SIZE):
+    """Draw a tree with a brown trunk, a green crown and a few apples."""
+    width, height = size
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+
+    line = max(2, width // 160)
+    cx = width // 2
+    trunk = width // 20
+    draw.rectangle((cx - trunk, int(height * 0.55), cx + trunk, int(height * 0.9)), outline="brown", width=line)
+    crown = min(width, height) // 4
+    crown_y = int(height * 0.38)
+    draw.ellipse((cx - crown, crown_y - crown, cx + crown, crown_y + crown), fill="white", outline="green", width=line)
+
+    apple = max(4, crown // 8)
+    for ax, ay in ((-0.4, -0.2), (0.3, -0.4), (0.1, 0.3), (-0.2, 0.5)):
+        x, y = cx + int(ax * crown), crown_y + int(ay * crown)
+        draw.ellipse((x - apple, y - apple, x + apple, y + apple), fill="red")
+
+    draw.line((0, int(height * 0.9), width, int(height * 0.9)), fill="green", width=line)
+    return image
+
+
+# Sketches used for quality comparisons (ParameterSweep.py)
+REFERENCE_SKETCHES = {
+    "house": drawHouse,
+    "sun": drawSun,
+    "cat": drawCat,
+    "tree": drawTree,
+}
+
+
+def referenceSketch(size=DEFAULT_SIZE):
+    """Get the fixed reference sketch used for latency measurements."""
+    return drawHouse(size)
+
+
+def referenceSketches(size=DEFAULT_SIZE):
+    """Get all reference sketches by name."""
+    return {name: draw(size) for name, draw in REFERENCE_SKETCHES.items()}
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Semantic Cache - Reuses stories generated for near-identical sketches
+Sketches are embedded with a cheap pooled ink feature and matched by cosine similarity
+
+Usage:
+    python SemanticCache.py            # show statistics of the persisted cache
+    python SemanticCache.py --clear    # delete all cached stories
+"""
+
+import argparse
+import hashlib
+import os
+import numpy as np
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "drawlingo", "semantic_cache.npz")
+DEFAULT_CAPACITY = 512
+DEFAULT_THRESHOLD = 0.92
+
+# Side of the pooled ink grid (embedding size is EMBEDDING_GRID ** 2)
+EMBEDDING_GRID = 16
+
+
+def sketchEmbedding(gray, grid=EMBEDDING_GRID):
+    """Embed a grayscale sketch (2D uint8 array, white background) as a unit vector.
+
+    The ink is cropped to its bounding box, padded to a square (so position and
+    scale on the canvas do not matter) and average-pooled to a grid x grid map.
+    Returns None for an empty sketch.
+    """
+    ink = 1.0 - np.asarray(gray, dtype=np.float32) / 255.0
+    rows = np.flatnonzero(ink.max(axis=1) > 0.1)
+    cols = np.flatnonzero(ink.max(axis=0) > 0.1)
+    if len(rows) == 0:
+        return None
+    ink = ink[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+    # Pad to a square whose side is a multiple of the grid, ink centered
+    side = -(-max(ink.shape) // grid) * grid
+    square = np.zeros((side, side), dtype=np.float32)
+    top, left = (side - ink.shape[0]) // 2, (side - ink.shape[1]) // 2
+    square[top:top + ink.shape[0], left:left + ink.shape[1]] = ink
+
+    cell = side // grid
+    pooled = square.reshape(grid, cell, grid, cell).mean(axis=(1, 3)).reshape(-1)
+    pooled -= pooled.mean()
+    norm = np.linalg.norm(pooled)
+    if norm == 0.0:
+        return None
+    return pooled / norm
+
+
+def _promptKey(prompt):
+    """Stable key for a prompt (a cached story is only valid for the same prompt)."""
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+
+
+class SemanticCache:
+    """Bounded nearest-neighbor index of sketch embeddings -> generated stories."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, capacity=DEFAULT_CAPACITY, threshold=DEFAULT_THRESHOLD,
+                 dim=EMBEDDING_GRID ** 2):
+        self.path = path
+        self.capacity = capacity
+        self.threshold = threshold
+        self.dim = dim
+
+        self.embeddings = np.zeros((capacity, dim), dtype=np.float32)
+        self.last_used = np.zeros(capacity, dtype=np.int64)
+        self.prompt_keys = [""] * capacity
+        self.stories = [""] * capacity
+        self.size = 0
+        self.clock = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False  # changed since the last save
+
+        if path and os.path.exists(path):
+            try:
+                self.load()
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Semantic cache could not be loaded, starting empty: {e}")
+
+    def lookup(self, embedding, prompt):
+        """Get the cached story of the most similar sketch for this prompt, or None."""
+        story = None
+        if embedding is not None and self.size:
+            similarities = self.embeddings[:self.size] @ embedding
+            key = _promptKey(prompt)
+            for index in np.argsort(-similarities):
+                if similarities[index] < self.threshold:
+                    break
+                if self.prompt_keys[index] == key:
+                    story = self.stories[index]
+                    self.clock += 1
+                    self.last_used[index] = self.clock
+                    break
+
+        if story is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.dirty = True
+        return story
+
+    def insert(self, embedding, prompt, story):
+        """Add a story, evicting the least recently used entry when full."""
+        if embedding is None or not story:
+            return
+        if self.size < self.capacity:
+            index = self.size
+            self.size += 1
+        else:
+            index = int(np.argmin(self.last_used[:self.size]))
+
+        self.clock += 1
+        self.embeddings[index] = embedding
+        self.last_used[index] = self.clock
+        self.prompt_keys[index] = _promptKey(prompt)
+        self.stories[index] = story
+        self.dirty = True
+
+    def clear(self):
+        """Remove all entries and reset the statistics."""
+        self.size = 0
+        self.clock = 0
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def stats(self):
+        """Get hit-rate metrics and occupancy."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": self.size,
+            "capacity": self.capacity,
+        }
+
+    def flush(self):
+        """Save the index if it changed since the last save (lookups and inserts only mark it dirty)."""
+        if self.dirty and self.path:
+            self.save()
+
+    def save(self):
+        """Persist the index (written to a temporary file, then renamed)."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                embeddings=self.embeddings[:self.size],
+                last_used=self.last_used[:self.size],
+                prompt_keys=np.array(self.prompt_keys[:self.size], dtype=str),
+                stories=np.array(self.stories[:self.size], dtype=str),
+                counters=np.array([self.clock, self.hits, self.misses], dtype=np.int64),
+            )
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def load(self):
+        """Load a persisted index, keeping the most recently used entries if it is over capacity."""
+        with np.load(self.path, allow_pickle=False) as data:
+            embeddings = data["embeddings"]
+            last_used = data["last_used"]
+            prompt_keys = data["prompt_keys"].tolist()
+            stories = data["stories"].tolist()
+            counters = data["counters"]
+
+        if embeddings.ndim != 2 or embeddings.shape[1] != self.dim:
+            raise ValueError(f"embedding size {embeddings.shape[1:]} does not match {self.dim}")
+
+        keep = np.argsort(-last_used)[:self.capacity]
+        self.size = len(keep)
+        self.embeddings[:self.size] = embeddings[keep]
+        self.last_used[:self.size] = last_used[keep]
+        for slot, index in enumerate(keep):
+            self.prompt_keys[slot] = prompt_keys[index]
+            self.stories[slot] = stories[index]
+        self.clock, self.hits, self.misses = (int(v) for v in counters)
+
+
+_shared_cache = None
+
+
+def sharedCache():
+    """The process-wide cache used by all SketchAnalyzer instances (one file, one index)."""
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = SemanticCache()
+    return _shared_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the Drawlingo semantic story cache.")
+    parser.add_argument("--path", default=DEFAULT_CACHE_PATH, help="Cache file")
+    parser.add_argument("--clear", action="store_true", help="Delete all cached stories")
+    args = parser.parse_args()
+
+    cache = SemanticCache(args.path)
+    if args.clear:
+        cache.clear()
+        print("Semantic cache cleared.")
+        return
+
+    stats = cache.stats()
+    print(f"entries:  {stats['size']} / {stats['capacity']}")
+    print(f"hits:     {stats['hits']}")
+    print(f"misses:   {stats['misses']}")
+    print(f"hit rate: {stats['hit_rate']:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,185 +4,663 @@ Based on official Qwen2-VL example code
 """
 
 import base64
+import os
+import time
 from io import BytesIO
-from PyQt6.QtCore import QObject, pyqtSignal, QThread
+from PyQt6.QtCore import QObject, pyqtSignal, QThread, QTimer
 from PIL import Image
+import numpy as np
 import torch
+from SemanticCache import sharedCache, sketchEmbedding
+from AnalysisScheduler import AnalysisRequest, QUEUED, RUNNING, estimateCost, sharedScheduler
 
 # Global model cache (shared across workers)
 _model_cache = None
 _processor_cache = None
+_onnx_model_cache = None
+_draft_model_cache = None
+_draft_model_name_cache = None
+_inference_config = None
+
+MODEL_NAME = "Qwen/Qwen2-VL-2B-Instruct"
+
+# Settings used when no tuned config exists (see AutoTuner.py and ParameterSweep.py);
+# 0 means "library default"
+DEFAULT_INFERENCE_CONFIG = {
+    "num_threads": 0,
+    "dtype": "auto",
+    "quantization": "4bit",
+    "image_size": 0,
+    "max_new_tokens": 500,
+    "temperature": 0.7,
+}
+
+# Changes to the semantic cache are written to disk at most this often (and when the window closes)
+CACHE_SAVE_DELAY_MS = 30000
+
+# Inference backends
+BACKEND_TORCH = "torch"
+BACKEND_ONNX = "onnx"  # requires a one-time export with OnnxExport.py
+
+
+def fitImage(image, size):
+    """Letterbox an image onto a white square of the given size, keeping its aspect ratio."""
+    scale = min(size / image.width, size / image.height)
+    resized = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                           Image.Resampling.LANCZOS)
+    canvas = Image.new("RGB", (size, size), "white")
+    canvas.paste(resized, ((size - resized.width) // 2, (size - resized.height) // 2))
+    return canvas
+
+
+def loadQwenModel(model_name, config):
+    """Load Qwen2-VL with the dtype and quantization of an inference config."""
+    from transformers import Qwen2VLForConditionalGeneration
+    
+    quantization = config.get("quantization", "4bit")
+    kwargs = {}
+    if quantization == "4bit":
+        kwargs["load_in_4bit"] = True  # Critical for low RAM
+    else:
+        dtype = config.get("dtype", "auto")
+        kwargs["torch_dtype"] = dtype if dtype == "auto" else getattr(torch, dtype)
+    
+    model = Qwen2VLForConditionalGeneration.from_pretrained(
+        model_name,
+        device_map="auto",
+        trust_remote_code=True,
+        **kwargs
+    )
+    if quantization == "int8":
+        # Dynamic int8 quantization of the linear layers (CPU only)
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def generationKwargs(config):
+    """model.generate() arguments for the decoding settings of an inference config (temperature 0 = greedy)."""
+    kwargs = {"max_new_tokens": config["max_new_tokens"]}
+    if config["temperature"] > 0:
+        kwargs["temperature"] = config["temperature"]
+    else:
+        kwargs["do_sample"] = False
+    return kwargs
+
+
+def prepareInputs(processor, messages, device):
+    """Turn a conversation into model inputs on the given device."""
+    from qwen_vl_utils import process_vision_info
+    
+    text = processor.apply_chat_template(
+        messages,
+        tokenize=False,
+        add_generation_prompt=True
+    )
+    image_inputs, _ = process_vision_info(messages)
+    
+    return processor(
+        text=[text],
+        images=image_inputs,
+        return_tensors="pt"
+    ).to(device)
+
+
+def buildMessages(image, prompt):
+    """Build the Qwen2-VL conversation for a sketch and prompt."""
+    # Match official example format exactly
+    return [
+        {"role": "system", "content": "You are a kindergarten teacher. You are telling a story to a 3-year-old child. The story based on the image and the prompt."}, 
+        {
+            "role": "user",
+            "content": [
+                {"type": "image", "image": image},
+                {"type": "text", "text": prompt}
+            ]
+        }
+    ]
+
+    # return [
+    #     {
+    #         "role": "system",
+    #         "content": "You are “Drawlingo”, a friendly art and language teacher for English-speaking children learning German.\n\nAlways speak to the child directly in a warm, simple way.\n\nFor EVERY answer, follow EXACTLY this 3-line structure:\n\n1) A short praise + English description of what the child drew, in English.\n2) On a single line: English noun, space, comma, space, then the German noun with a capital letter. Example: \"Tree, Baum.\"\n3) One short sentence in simple German that describes the drawing, talking to the child. Example: \"Du hast einen schönen Baum gemalt!\"\n\nRules:\n- Use ONLY English and German.\n- Do not explain grammar.\n- Do not translate the German sentence back to English.\n- No bullet points, no numbering in the output. Just three plain lines of text.\n- If there are several objects, pick ONE main object to teach."
+    #     },
+    #     {
+    #         "role": "user",
+    #         "content": [
+    #             {"type": "image", "image": image},
+    #             {"type": "text", "text": "Talk to the child following the 3-line structure."}
+    #         ]
+    #     }
+    # ]
+
 
 class SketchAnalyzerWorker(QThread):
     """Worker thread for running the model inference."""
     
     finished = pyqtSignal(str)  # story
+    finishedTasks = pyqtSignal(dict)  # task name -> text (multi-task requests)
     error = pyqtSignal(str)  # error message
     status = pyqtSignal(str)  # status update
+    cancelled = pyqtSignal()  # stopped after requestInterruption(); nothing else is emitted
     
-    def __init__(self, image_base64, prompt):
+    def __init__(self, image_base64, prompt, backend=BACKEND_TORCH, draft_model_name=None, tasks=None):
         super().__init__()
         self.image_base64 = image_base64
         self.prompt = prompt
+        self.backend = backend
+        self.draft_model_name = draft_model_name
+        self.tasks = tasks  # task name -> prompt; None for a single story
     
     def run(self):
         """Run the analysis in a separate thread."""
         try:
             self.status.emit("Loading model...")
             
-            # Import here to avoid blocking main thread during import
-            from transformers import Qwen2VLForConditionalGeneration, AutoProcessor
-            from qwen_vl_utils import process_vision_info
-            
-            global _model_cache, _processor_cache
-            
-            # Load model if not already cached (shared across workers)
-            if _model_cache is None:
-                model_name = "Qwen/Qwen2-VL-2B-Instruct"
-                
-                self.status.emit("Downloading/loading model (first time may take a while)...")
-                _processor_cache = AutoProcessor.from_pretrained(
-                    model_name,
-                    trust_remote_code=True
-                )
-                
-                self.status.emit("Loading model into memory...")
-                _model_cache = Qwen2VLForConditionalGeneration.from_pretrained(
-                    model_name,
-                    device_map="auto",
-                    trust_remote_code=True,
-                    load_in_4bit=True  # Critical for low RAM
-                )
-            
-            model = _model_cache
-            processor = _processor_cache
-            
             # Decode base64 image
-            self.status.emit("Processing image...")
             image_data = base64.b64decode(self.image_base64)
-            image = Image.open(BytesIO(image_data)).convert("RGB")            
-            # Format input (Qwen2-VL uses conversation-style input)
-            # Match official example format exactly
-            messages = [
-                {"role": "system", "content": "You are a kindergarten teacher. You are telling a story to a 3-year-old child. The story based on the image and the prompt."}, 
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "image", "image": image},
-                        {"type": "text", "text": self.prompt}
-                    ]
-                }
-            ]
+            image = Image.open(BytesIO(image_data)).convert("RGB")
 
-            # messages = [
-            #     {
-            #         "role": "system",
-            #         "content": "You are “Drawlingo”, a friendly art and language teacher for English-speaking children learning German.\n\nAlways speak to the child directly in a warm, simple way.\n\nFor EVERY answer, follow EXACTLY this 3-line structure:\n\n1) A short praise + English description of what the child drew, in English.\n2) On a single line: English noun, space, comma, space, then the German noun with a capital letter. Example: \"Tree, Baum.\"\n3) One short sentence in simple German that describes the drawing, talking to the child. Example: \"Du hast einen schönen Baum gemalt!\"\n\nRules:\n- Use ONLY English and German.\n- Do not explain grammar.\n- Do not translate the German sentence back to English.\n- No bullet points, no numbering in the output. Just three plain lines of text.\n- If there are several objects, pick ONE main object to teach."
-            #     },
-            #     {
-            #         "role": "user",
-            #         "content": [
-            #             {"type": "image", "image": image},
-            #             {"type": "text", "text": "Talk to the child following the 3-line structure."}
-            #         ]
-            #     }
-            # ]
-
-            
-            # Prepare inputs - following official example
-            self.status.emit("Preparing inputs...")
-            text = processor.apply_chat_template(
-                messages,
-                tokenize=False,
-                add_generation_prompt=True
-            )
-            image_inputs, _ = process_vision_info(messages)
-            
-            # Determine device (CUDA if available, else CPU)
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            
-            inputs = processor(
-                text=[text],
-                images=image_inputs,
-                return_tensors="pt"
-            ).to(device)
-            
-            # Generate
-            self.status.emit("Generating story...")
-            with torch.no_grad():
-                output = model.generate(**inputs, max_new_tokens=500, temperature=0.7)
-            
-            # Decode - match official example exactly
-            result = processor.batch_decode(output, skip_special_tokens=True)[0]
-            
-            story = result.split("assistant")[-1].strip()
+            if self.tasks:
+                if self.backend == BACKEND_ONNX:
+                    results = self.runOnnxTasks(image)
+                else:
+                    results = self.runTorchTasks(image)
+            elif self.backend == BACKEND_ONNX:
+                story = self.runOnnx(image)
+            else:
+                story = self.runTorch(image)
             
-            # Fallback if ASSISTANT: marker not found
-            if not story:
-                story = result.strip()
+            # A cancelled run may have been cut short, so its output is dropped
+            if self.isInterruptionRequested():
+                self.cancelled.emit()
+                return
             
             self.status.emit("Story generated successfully!")
-            self.finished.emit(story)
+            if self.tasks:
+                self.finishedTasks.emit(results)
+            else:
+                self.finished.emit(story)
             
         except ImportError as e:
             error_msg = (
                 f"Missing Python dependencies. Please install:\n"
-                f"pip install transformers accelerate torch torchvision pillow bitsandbytes qwen-vl-utils\n"
+                f"pip install transformers accelerate torch torchvision pillow bitsandbytes qwen-vl-utils onnxruntime\n"
                 f"Error: {str(e)}"
             )
-            self.error.emit(error_msg)
+            self.fail(error_msg)
         except Exception as e:
             error_msg = f"Analysis failed: {str(e)}"
-            self.error.emit(error_msg)
+            self.fail(error_msg)
+    
+    def fail(self, message):
+        """Report an error, unless the run was cancelled and nobody waits for it."""
+        if self.isInterruptionRequested():
+            self.cancelled.emit()
+        else:
+            self.error.emit(message)
+    
+    def stoppingCriteria(self):
+        """Stopping criteria that end model.generate() once requestInterruption() is called."""
+        from transformers import StoppingCriteria, StoppingCriteriaList
+        
+        worker = self
+        
+        class Interrupted(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                return torch.full((input_ids.shape[0],), worker.isInterruptionRequested(),
+                                  dtype=torch.bool, device=input_ids.device)
+        
+        return StoppingCriteriaList([Interrupted()])
+    
+    def loadTorchModel(self):
+        """Load the PyTorch model and processor once (shared across workers)."""
+        # Import here to avoid blocking main thread during import
+        from transformers import AutoProcessor
+        
+        global _model_cache, _processor_cache, _inference_config
+        
+        # Load model if not already cached (shared across workers)
+        if _model_cache is None:
+            from ModelSnapshot import DEFAULT_SNAPSHOT_DIR, loadSnapshot, snapshotMetadata
+            
+            model_name = MODEL_NAME
+            
+            # Prefer a prepared local snapshot (see ModelSnapshot.py), loaded offline; it fixes
+            # dtype and quantization, so only the remaining settings come from the tuned config
+            start = time.perf_counter()
+            snapshot_dir = os.environ.get("DRAWLINGO_SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR)
+            metadata = snapshotMetadata(snapshot_dir)
+            if metadata is not None:
+                _inference_config = self.loadInferenceConfig(metadata["config"])
+                _inference_config.update(dtype=metadata["config"]["dtype"],
+                                         quantization=metadata["config"]["quantization"])
+            else:
+                _inference_config = self.loadInferenceConfig()
+            if _inference_config["num_threads"]:
+                torch.set_num_threads(_inference_config["num_threads"])
+            
+            if metadata is not None:
+                self.status.emit("Loading prepared model snapshot...")
+                _model_cache, _processor_cache, metadata = loadSnapshot(snapshot_dir, metadata)
+                source = snapshot_dir
+            else:
+                self.status.emit("Downloading/loading model (first time may take a while)...")
+                _processor_cache = AutoProcessor.from_pretrained(
+                    model_name,
+                    trust_remote_code=True
+                )
+                
+                self.status.emit("Loading model into memory...")
+                _model_cache = loadQwenModel(model_name, _inference_config)
+                source = model_name
+            
+            load_seconds = time.perf_counter() - start
+            print(f"Model loaded from {source} in {load_seconds:.1f}s")
+            self.status.emit(f"Model loaded in {load_seconds:.1f}s")
+        
+        return _model_cache, _processor_cache
+    
+    def runTorch(self, image):
+        """Generate the story with the PyTorch model."""
+        model, processor = self.loadTorchModel()
+        
+        # Format input (Qwen2-VL uses conversation-style input)
+        self.status.emit("Processing image...")
+        if _inference_config["image_size"]:
+            image = fitImage(image, _inference_config["image_size"])
+        messages = buildMessages(image, self.prompt)
+        
+        # Prepare inputs - following official example
+        self.status.emit("Preparing inputs...")
+        
+        # Determine device (CUDA if available, else CPU)
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        
+        inputs = prepareInputs(processor, messages, device)
+        
+        # Generate (assisted by the draft model if one is configured)
+        draft_model = self.loadDraftModel(device) if self.draft_model_name else None
+        self.status.emit("Generating story...")
+        if draft_model is not None:
+            from SpeculativeDecoding import speculativeGenerate
+            
+            tokens, stats = speculativeGenerate(model, draft_model, inputs,
+                                                max_new_tokens=_inference_config["max_new_tokens"],
+                                                temperature=_inference_config["temperature"])
+            print(
+                f"Speculative decoding: acceptance {stats['acceptance_rate']:.1%}, "
+                f"{stats['tokens_per_pass']:.2f} tokens per pass, "
+                f"{stats['tokens'] / stats['seconds']:.1f} tokens/s"
+            )
+            return processor.batch_decode([tokens], skip_special_tokens=True)[0].strip()
+        
+        with torch.no_grad():
+            output = model.generate(**inputs, **generationKwargs(_inference_config),
+                                    stopping_criteria=self.stoppingCriteria())
+        
+        # Decode - match official example exactly
+        result = processor.batch_decode(output, skip_special_tokens=True)[0]
+        
+        story = result.split("assistant")[-1].strip()
+        
+        # Fallback if ASSISTANT: marker not found
+        if not story:
+            story = result.strip()
+        return story
+    
+    def loadInferenceConfig(self, fallback=None):
+        """Load this machine's tuned inference config; fallback (else the defaults) if it was never tuned.
+        
+        Calibration is never run here, so it cannot stall an analysis; see AutoTuner.py.
+        """
+        from AutoTuner import loadTunedConfig
+        
+        config = loadTunedConfig()
+        if config is None and fallback is None:
+            print("No tuned inference settings for this machine, using the defaults "
+                  "(run 'python AutoTuner.py' or 'python main.py --retune' to tune)")
+        return dict(DEFAULT_INFERENCE_CONFIG, **(config or fallback or {}))
+    
+    def loadDraftModel(self, device):
+        """Load the configured draft model once; returns None (plain decoding) if it is unavailable."""
+        from SpeculativeDecoding import loadDraftModel
+        
+        global _draft_model_cache, _draft_model_name_cache
+        
+        if _draft_model_cache is None or _draft_model_name_cache != self.draft_model_name:
+            self.status.emit(f"Loading draft model {self.draft_model_name}...")
+            try:
+                _draft_model_cache = loadDraftModel(self.draft_model_name, device)
+                _draft_model_name_cache = self.draft_model_name
+            except Exception as e:
+                print(f"Draft model unavailable, using standard decoding: {e}")
+                _draft_model_cache = None
+                _draft_model_name_cache = None
+        return _draft_model_cache
+    
+    def runTorchTasks(self, image):
+        """Generate all tasks with the PyTorch model from one shared image prefill."""
+        from MultiTaskGeneration import multiTaskGenerate
+        
+        model, processor = self.loadTorchModel()
+        
+        self.status.emit("Processing image...")
+        if _inference_config["image_size"]:
+            image = fitImage(image, _inference_config["image_size"])
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        
+        self.status.emit("Preparing inputs...")
+        task_inputs = {
+            task: prepareInputs(processor, buildMessages(image, prompt), device)
+            for task, prompt in self.tasks.items()
+        }
+        first = next(iter(task_inputs.values()))
+        
+        self.status.emit("Generating story, vocabulary and sentence...")
+        results, stats = multiTaskGenerate(
+            model,
+            {task: inputs["input_ids"] for task, inputs in task_inputs.items()},
+            first["pixel_values"],
+            first["image_grid_thw"],
+            self.taskMaxNewTokens(),
+            temperature=_inference_config["temperature"]
+        )
+        print(f"Multi-task generation: {stats['tasks']} tasks sharing {stats['prefix_tokens']} prefix tokens, "
+              f"{stats['seconds']:.1f}s")
+        return {task: processor.batch_decode([tokens], skip_special_tokens=True)[0].strip()
+                for task, tokens in results.items()}
+    
+    def taskMaxNewTokens(self):
+        """Token limits of the multi-task outputs; the story follows the inference config."""
+        from MultiTaskGeneration import TASK_MAX_NEW_TOKENS, TASK_STORY
+        
+        return dict(TASK_MAX_NEW_TOKENS, **{TASK_STORY: _inference_config["max_new_tokens"]})
+    
+    def loadOnnxModel(self):
+        """Load the exported ONNX Runtime model and its processor once (shared across workers)."""
+        from transformers import AutoProcessor
+        from OnnxBackend import DEFAULT_ONNX_DIR, OnnxSketchModel
+        
+        global _onnx_model_cache, _processor_cache, _inference_config
+        
+        # Only the decoding settings apply to ONNX; calibration is torch specific
+        if _inference_config is None:
+            from AutoTuner import loadTunedConfig
+            _inference_config = dict(DEFAULT_INFERENCE_CONFIG, **(loadTunedConfig() or {}))
+        
+        model_dir = os.environ.get("DRAWLINGO_ONNX_DIR", DEFAULT_ONNX_DIR)
+        if _onnx_model_cache is None:
+            if not os.path.isdir(model_dir):
+                raise RuntimeError(
+                    f"No exported ONNX model found in {model_dir}. Run: python OnnxExport.py"
+                )
+            self.status.emit("Loading ONNX model into memory...")
+            _onnx_model_cache = OnnxSketchModel(model_dir)
+        if _processor_cache is None:
+            _processor_cache = AutoProcessor.from_pretrained(model_dir)
+        
+        return _onnx_model_cache, _processor_cache
+    
+    def onnxInputs(self, processor, image, prompt):
+        """Processor outputs (NumPy) for the ONNX backend."""
+        messages = buildMessages(image, prompt)
+        text = processor.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=True
+        )
+        return processor(
+            text=[text],
+            images=[image],
+            return_tensors="np"
+        )
+    
+    def runOnnx(self, image):
+        """Generate the story with the exported ONNX Runtime model."""
+        model, processor = self.loadOnnxModel()
+        
+        # The vision graph was exported for one fixed image size
+        self.status.emit("Processing image...")
+        image = fitImage(image, model.imageSize()[0])
+        
+        self.status.emit("Preparing inputs...")
+        inputs = self.onnxInputs(processor, image, self.prompt)
+        
+        self.status.emit("Generating story...")
+        tokens = model.generate(
+            inputs["input_ids"],
+            inputs["pixel_values"],
+            inputs["image_grid_thw"],
+            max_new_tokens=_inference_config["max_new_tokens"],
+            temperature=_inference_config["temperature"]
+        )
+        return processor.batch_decode([tokens], skip_special_tokens=True)[0].strip()
+    
+    def runOnnxTasks(self, image):
+        """Generate all tasks with the ONNX Runtime model from one shared image prefill."""
+        from MultiTaskGeneration import multiTaskGenerateOnnx
+        
+        model, processor = self.loadOnnxModel()
+        
+        self.status.emit("Processing image...")
+        image = fitImage(image, model.imageSize()[0])
+        
+        self.status.emit("Preparing inputs...")
+        task_inputs = {task: self.onnxInputs(processor, image, prompt) for task, prompt in self.tasks.items()}
+        first = next(iter(task_inputs.values()))
+        
+        self.status.emit("Generating story, vocabulary and sentence...")
+        results, stats = multiTaskGenerateOnnx(
+            model,
+            {task: inputs["input_ids"] for task, inputs in task_inputs.items()},
+            first["pixel_values"],
+            first["image_grid_thw"],
+            self.taskMaxNewTokens(),
+            temperature=_inference_config["temperature"]
+        )
+        print(f"Multi-task generation: {stats['tasks']} tasks sharing {stats['prefix_tokens']} prefix tokens, "
+              f"{stats['seconds']:.1f}s")
+        return {task: processor.batch_decode([tokens], skip_special_tokens=True)[0].strip()
+                for task, tokens in results.items()}
 
 
 class SketchAnalyzer(QObject):
     """Analyzer class that manages sketch analysis using Qwen2-VL model."""
     
     analysisComplete = pyqtSignal(str)  # story
+    tasksComplete = pyqtSignal(dict)  # task name -> text (see MultiTaskGeneration.py)
     analysisError = pyqtSignal(str)  # error message
     statusUpdate = pyqtSignal(str)  # status update
     
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, session=None, scheduler=None, cache=None):
         super().__init__(parent)
         self.worker = None
+        self.request = None
+        
+        # All analyzers share one model through the scheduler; each canvas is its own session
+        self.scheduler = scheduler or sharedScheduler()
+        self.session = self.scheduler.addSession(session)
+        self.scheduler.queueChanged.connect(self.onQueueChanged)
+        self.scheduler.requestExpired.connect(self.onRequestExpired)
+        
+        # Seconds within which a result must be ready, or the request is dropped (0 = no deadline)
+        self.deadline_seconds = float(os.environ.get("DRAWLINGO_ANALYSIS_DEADLINE", "0")) or None
+        
+        self.backend = os.environ.get("DRAWLINGO_BACKEND", BACKEND_TORCH)
+        
+        # Optional draft model for speculative decoding (torch backend only)
+        self.draft_model_name = os.environ.get("DRAWLINGO_DRAFT_MODEL") or None
+        
+        # Semantic cache of past sketches, shared like the model (disable with DRAWLINGO_SEMANTIC_CACHE=0)
+        self.cache = None
+        if os.environ.get("DRAWLINGO_SEMANTIC_CACHE", "1") != "0":
+            self.cache = cache or sharedCache()
+        self.cache_save_timer = QTimer(self)
+        self.cache_save_timer.setSingleShot(True)
+        self.cache_save_timer.setInterval(CACHE_SAVE_DELAY_MS)
+        self.cache_save_timer.timeout.connect(self.saveCache)
+    
+    def setBackend(self, backend):
+        """Set the inference backend (BACKEND_TORCH or BACKEND_ONNX)."""
+        if backend not in (BACKEND_TORCH, BACKEND_ONNX):
+            raise ValueError(f"Unknown backend: {backend}")
+        self.backend = backend
+    
+    def setDraftModel(self, model_name):
+        """Set the draft model for speculative decoding (None disables it)."""
+        self.draft_model_name = model_name or None
+    
+    def storyPrompt(self):
+        """Get the story prompt: the user-input prompt from the UI if available, else generatePrompt()."""
+        parent_widget = self.parent()
+        if parent_widget and hasattr(parent_widget, "getCustomPrompt"):
+            user_prompt = parent_widget.getCustomPrompt()
+            if user_prompt and user_prompt.strip():
+                return user_prompt.strip()
+        return self.generatePrompt()
+    
+    def cancelWorker(self):
+        """Cancel any queued or running analysis (a running one stops at its next token and is dropped)."""
+        if self.request is not None:
+            self.scheduler.cancel(self.request)
+            self.request = None
+    
+    def submitWorker(self, worker, cost):
+        """Queue a worker on the shared scheduler; it starts when the model is free."""
+        request = AnalysisRequest(self.session, worker, cost, self.deadline_seconds)
+        worker.finished.connect(lambda _: self.finishRequest(request))
+        worker.finishedTasks.connect(lambda _: self.finishRequest(request))
+        worker.error.connect(lambda _: self.finishRequest(request))
+        worker.cancelled.connect(lambda: self.finishRequest(request))
+        worker.status.connect(lambda text: None if request.cancelled else self.statusUpdate.emit(text))
+        self.worker = worker
+        self.request = request
+        self.scheduler.submit(request)
+    
+    def finishRequest(self, request):
+        """Tell the scheduler that a request is done and report its wait and service time."""
+        if request.state != RUNNING:
+            return
+        if request.cancelled:
+            # The worker has emitted its last signal; join it before the scheduler lets it go
+            request.worker.wait()
+            self.scheduler.finish(request)
+            return
+        self.scheduler.finish(request)
+        print(f"[{self.session}] waited {request.waitSeconds():.1f}s, "
+              f"generated in {request.serviceSeconds():.1f}s")
+        if request is self.request:
+            self.request = None
+    
+    def onQueueChanged(self):
+        """Show the queue position while this session's request waits for the model."""
+        if self.request is not None and self.request.state == QUEUED:
+            ahead = self.scheduler.position(self.request)
+            self.statusUpdate.emit(f"Waiting for the model ({ahead} request{'s' if ahead != 1 else ''} ahead)...")
+    
+    def onRequestExpired(self, request):
+        """Report a request of this session that missed its deadline."""
+        if request is self.request:
+            self.request = None
+            self.analysisError.emit("The model was busy for too long. Please try again.")
+    
+    def schedulerStats(self):
+        """Get this session's wait and service time metrics."""
+        return self.scheduler.stats(self.session)
     
     def analyzeSketch(self, pixmap):
         """Analyze a sketch and generate a story."""
+        prompt = self.storyPrompt()
+        
+        # Cancel any existing worker
+        self.cancelWorker()
+        
+        # Offer the story of a near-identical earlier sketch immediately
+        embedding = None
+        if self.cache is not None:
+            embedding = sketchEmbedding(self.pixmapToGray(pixmap))
+            story = self.cache.lookup(embedding, prompt)
+            if story is not None:
+                self.scheduleCacheSave()
+                self.scheduler.recordCacheHit(self.session)
+                self.statusUpdate.emit("Found a story for a similar drawing!")
+                self.analysisComplete.emit(story)
+                return
+        
         # Convert QPixmap to base64
         image_base64 = self.pixmapToBase64(pixmap)
         if not image_base64:
             self.analysisError.emit("Failed to encode image.")
             return
         
-        # Generate prompt
-        prompt = self.generatePrompt()
-        # INSERT_YOUR_CODE
-        # Get the user-input prompt from the UI, if available; fallback to generatePrompt()
-        parent_widget = self.parent()
-        if parent_widget and hasattr(parent_widget, "getCustomPrompt"):
-            user_prompt = parent_widget.getCustomPrompt()
-            if user_prompt and user_prompt.strip():
-                prompt = user_prompt.strip()
-            else:
-                prompt = self.generatePrompt()
-        else:
-            prompt = self.generatePrompt()
-
-        breakpoint()
-
+        # Create the worker thread; the scheduler starts it when the model is free
+        worker = SketchAnalyzerWorker(image_base64, prompt, self.backend, self.draft_model_name)
+        worker.finished.connect(self.analysisComplete.emit)
+        if self.cache is not None:
+            worker.finished.connect(lambda story: self.cacheStory(embedding, prompt, story))
+        worker.error.connect(self.analysisError.emit)
+        self.submitWorker(worker, estimateCost(prompt, self.maxNewTokens()))
+    
+    def analyzeSketchTasks(self, pixmap):
+        """Analyze a sketch once and generate the story, a vocabulary card and a German sentence.
         
-        # Cancel any existing worker
-        if self.worker and self.worker.isRunning():
-            self.worker.terminate()
-            self.worker.wait()
+        The image is encoded once for all tasks; results arrive together via tasksComplete.
+        The semantic cache only holds single stories and is not used here.
+        """
+        from MultiTaskGeneration import TASK_MAX_NEW_TOKENS, TASK_STORY, taskPrompts
+        
+        tasks = taskPrompts(self.storyPrompt())
+        self.cancelWorker()
+        
+        image_base64 = self.pixmapToBase64(pixmap)
+        if not image_base64:
+            self.analysisError.emit("Failed to encode image.")
+            return
+        
+        worker = SketchAnalyzerWorker(image_base64, tasks[TASK_STORY], self.backend, self.draft_model_name, tasks)
+        worker.finishedTasks.connect(self.tasksComplete.emit)
+        worker.error.connect(self.analysisError.emit)
+        limits = dict(TASK_MAX_NEW_TOKENS, **{TASK_STORY: self.maxNewTokens()})
+        self.submitWorker(worker, sum(estimateCost(prompt, limits[task]) for task, prompt in tasks.items()))
+    
+    def maxNewTokens(self):
+        """Story token limit of the current (or default) inference config."""
+        return (_inference_config or DEFAULT_INFERENCE_CONFIG)["max_new_tokens"]
+    
+    def cacheStory(self, embedding, prompt, story):
+        """Add a generated story to the semantic cache (saved later, off the input path)."""
+        self.cache.insert(embedding, prompt, story)
+        self.scheduleCacheSave()
+    
+    def scheduleCacheSave(self):
+        """Save the semantic cache after CACHE_SAVE_DELAY_MS, so that hits and inserts never wait for the disk."""
+        if not self.cache_save_timer.isActive():
+            self.cache_save_timer.start()
+    
+    def saveCache(self):
+        """Write pending semantic cache changes to disk now (also called when the window closes)."""
+        self.cache_save_timer.stop()
+        if self.cache is not None:
+            self.cache.flush()
+    
+    def setCacheThreshold(self, threshold):
+        """Set the cosine similarity above which a cached story is reused (the cache is shared by all analyzers)."""
+        if self.cache is not None:
+            self.cache.threshold = threshold
+    
+    def cacheStats(self):
+        """Get semantic cache hit-rate metrics (None if the cache is disabled)."""
+        return self.cache.stats() if self.cache is not None else None
+    
+    def pixmapToGray(self, pixmap):
+        """Convert QPixmap to a 2D grayscale NumPy array."""
+        from PyQt6.QtGui import QImage
         
-        # Create and start worker thread
-        self.worker = SketchAnalyzerWorker(image_base64, prompt)
-        self.worker.finished.connect(self.analysisComplete.emit)
-        self.worker.error.connect(self.analysisError.emit)
-        self.worker.status.connect(self.statusUpdate.emit)
-        self.worker.start()
+        image = pixmap.toImage().convertToFormat(QImage.Format.Format_Grayscale8)
+        bits = image.constBits()
+        bits.setsize(image.sizeInBytes())
+        rows = np.frombuffer(bits, dtype=np.uint8).reshape(image.height(), image.bytesPerLine())
+        return rows[:, :image.width()].copy()
     
     def pixmapToBase64(self, pixmap):
         """Convert QPixmap to base64 string."""
@@ -197,7 +675,8 @@ class SketchAnalyzer(QObject):
         data = byte_array.data()
         return base64.b64encode(data).decode('utf-8')
     
-    def generatePrompt(self):
+    @staticmethod
+    def generatePrompt():
         """Generate the prompt for story generation."""
         return (
             "Tell a story based on the sketch in easy English. The short story is for a 3-year-old child. The story should not be longer than 8 sentences."
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Speculative Decoding - Assisted generation with a small local draft model
+The draft model proposes a few tokens, the main Qwen2-VL model verifies them in one forward pass
+
+Usage:
+    python SpeculativeDecoding.py --verify                               # tiny random models, output must match
+    python SpeculativeDecoding.py --draft Qwen/Qwen2-0.5B-Instruct       # acceptance rate and speedup
+"""
+
+import argparse
+import sys
+import time
+
+import torch
+
+from OnnxBackend import computeRopeIndex
+
+DEFAULT_NUM_DRAFT_TOKENS = 4
+
+
+def _decodingSettings(model, temperature=None):
+    """Resolve (greedy, temperature, top_k, top_p) from the model's generation config."""
+    config = model.generation_config
+    temperature = temperature if temperature is not None else (config.temperature or 1.0)
+    top_k = config.top_k if config.top_k is not None else 50
+    top_p = config.top_p if config.top_p is not None else 1.0
+    # top_k == 1 is greedy regardless of do_sample (Qwen2-VL-Instruct ships with it)
+    greedy = not config.do_sample or top_k == 1
+    return greedy, temperature, top_k, top_p
+
+
+def _probabilities(logits, temperature, top_k, top_p):
+    """Apply temperature / top-k / top-p like transformers' sampling and return probabilities."""
+    logits = logits.float() / max(temperature, 1e-5)
+    if top_k and top_k < logits.shape[-1]:
+        kth = torch.topk(logits, top_k).values[..., -1:]
+        logits = logits.masked_fill(logits < kth, float("-inf"))
+    probs = torch.softmax(logits, dim=-1)
+    if top_p < 1.0:
+        sorted_probs, order = torch.sort(probs, descending=True)
+        # Keep the smallest prefix whose mass reaches top_p (always at least one token)
+        remove = torch.cumsum(sorted_probs, dim=-1) - sorted_probs >= top_p
+        probs = probs.scatter(-1, order, sorted_probs.masked_fill(remove, 0.0))
+        probs = probs / probs.sum(dim=-1, keepdim=True)
+    return probs
+
+
+def _positionIds(past_len, seq_len, rope_delta, device):
+    """M-RoPE position ids for text tokens appended after the prompt."""
+    positions = torch.arange(past_len, past_len + seq_len, device=device) + rope_delta
+    return positions.view(1, 1, -1).expand(3, 1, -1)
+
+
+def _matchVocab(probs, size):
+    """Pad or trim draft probabilities to the main model's vocabulary size."""
+    if probs.shape[-1] >= size:
+        return probs[..., :size]
+    return torch.nn.functional.pad(probs, (0, size - probs.shape[-1]))
+
+
+def _draftPromptIds(input_ids, config):
+    """Strip the image span from the prompt: the text-only draft model cannot see it."""
+    ids = input_ids[0].tolist()
+    vision_ids = {config.vision_start_token_id, config.vision_end_token_id, config.image_token_id}
+    return torch.tensor([[token for token in ids if token not in vision_ids]], device=input_ids.device)
+
+
+def speculativeGenerate(model, draft_model, inputs, max_new_tokens=500, temperature=None,
+                        num_draft_tokens=DEFAULT_NUM_DRAFT_TOKENS, seed=None):
+    """Generate with draft proposals verified by the main model.
+
+    inputs are the processor outputs for a single sequence (input_ids,
+    pixel_values, image_grid_thw). Greedy decoding yields exactly the main
+    model's greedy output; sampling uses rejection sampling so tokens follow
+    the main model's distribution. Returns (new token ids, stats).
+    """
+    from transformers import DynamicCache
+
+    greedy, temperature, top_k, top_p = _decodingSettings(model, temperature)
+    generator = torch.Generator(device="cpu")
+    if seed is not None:
+        generator.manual_seed(seed)
+    eos_token_ids = model.generation_config.eos_token_id
+    if not isinstance(eos_token_ids, list):
+        eos_token_ids = [eos_token_ids]
+
+    def pick(probs_or_logits):
+        if greedy:
+            return int(torch.argmax(probs_or_logits))
+        return int(torch.multinomial(probs_or_logits.float().cpu(), 1, generator=generator))
+
+    def distribution(logits):
+        return logits if greedy else _probabilities(logits, temperature, top_k, top_p)
+
+    start = time.perf_counter()
+    device = inputs["input_ids"].device
+    input_ids = inputs["input_ids"]
+
+    # Prefill the main model with the image; positions are computed explicitly (version independent)
+    position_ids, rope_delta = computeRopeIndex(
+        input_ids.cpu().numpy(), model.config.image_token_id,
+        inputs["image_grid_thw"].cpu().numpy(), model.config.vision_config.spatial_merge_size
+    )
+    main_cache = DynamicCache()
+    with torch.no_grad():
+        logits = model(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            pixel_values=inputs["pixel_values"],
+            image_grid_thw=inputs["image_grid_thw"],
+            position_ids=torch.from_numpy(position_ids).to(device),
+            past_key_values=main_cache,
+            use_cache=True,
+        ).logits[0, -1]
+    main_len = input_ids.shape[1]
+    pending = pick(distribution(logits))
+
+    # Prefill the draft model with the text part of the prompt
+    draft_cache = DynamicCache()
+    draft_backlog = _draftPromptIds(input_ids, model.config)[0].tolist()
+
+    new_tokens = []
+    drafted = accepted = main_passes = 0
+    while True:
+        new_tokens.append(pending)
+        if pending in eos_token_ids or len(new_tokens) >= max_new_tokens:
+            break
+
+        # Draft proposes up to k tokens autoregressively
+        k = min(num_draft_tokens, max_new_tokens - len(new_tokens))
+        feed = draft_backlog + [pending]
+        proposals, proposal_probs = [], []
+        with torch.no_grad():
+            for _ in range(k):
+                draft_logits = draft_model(
+                    input_ids=torch.tensor([feed], device=draft_model.device),
+                    past_key_values=draft_cache,
+                    use_cache=True,
+                ).logits[0, -1]
+                draft_dist = distribution(draft_logits)
+                token = pick(draft_dist)
+                proposals.append(token)
+                proposal_probs.append(draft_dist)
+                feed = [token]
+        draft_backlog = []
+        drafted += k
+
+        # Main model scores the pending token and all proposals in one pass
+        candidates = torch.tensor([[pending] + proposals], device=device)
+        with torch.no_grad():
+            verify_logits = model(
+                input_ids=candidates,
+                attention_mask=torch.ones(1, main_len + candidates.shape[1], dtype=torch.long, device=device),
+                position_ids=_positionIds(main_len, candidates.shape[1], rope_delta, device),
+                past_key_values=main_cache,
+                use_cache=True,
+            ).logits[0]
+        main_passes += 1
+
+        num_accepted = 0
+        next_token = None
+        for i, token in enumerate(proposals):
+            target = distribution(verify_logits[i])
+            if greedy:
+                if token != int(torch.argmax(target)):
+                    next_token = int(torch.argmax(target))
+                    break
+            else:
+                draft_dist = _matchVocab(proposal_probs[i].to(target.device), target.shape[-1])
+                ratio = target[token] / draft_dist[token].clamp_min(1e-10)
+                if torch.rand(1, generator=generator).item() >= ratio.item():
+                    # Rejected: resample from the residual so the output follows the main model
+                    residual = (target - draft_dist).clamp_min(0.0)
+                    next_token = pick(residual / residual.sum() if residual.sum() > 0 else target)
+                    break
+            num_accepted += 1
+        if next_token is None:
+            # Every proposal accepted: the last position gives a bonus token
+            next_token = pick(distribution(verify_logits[len(proposals)]))
+        accepted += num_accepted
+
+        stop = False
+        for token in proposals[:num_accepted]:
+            new_tokens.append(token)
+            if token in eos_token_ids or len(new_tokens) >= max_new_tokens:
+                stop = True
+                break
+        if stop:
+            break
+
+        # Roll both caches back to the accepted prefix (negative crop removes that many tokens)
+        main_len += 1 + num_accepted
+        if num_accepted < k:
+            main_cache.crop(-(k - num_accepted))
+        if num_accepted < k - 1:
+            draft_cache.crop(-(k - 1 - num_accepted))
+        if num_accepted == k:
+            # The last proposal was never fed to the draft model
+            draft_backlog = [proposals[-1]]
+        pending = next_token
+
+    seconds = time.perf_counter() - start
+    stats = {
+        "tokens": len(new_tokens),
+        "drafted": drafted,
+        "accepted": accepted,
+        "acceptance_rate": accepted / drafted if drafted else 0.0,
+        "main_passes": main_passes + 1,
+        "tokens_per_pass": len(new_tokens) / (main_passes + 1),
+        "seconds": seconds,
+    }
+    return new_tokens, stats
+
+
+def loadDraftModel(name, device=None):
+    """Load a small causal LM to use as the draft model (must share the main model's tokenizer)."""
+    from transformers import AutoModelForCausalLM
+
+    draft_model = AutoModelForCausalLM.from_pretrained(name, torch_dtype="auto", trust_remote_code=True)
+    if device is not None:
+        draft_model = draft_model.to(device)
+    return draft_model.eval()
+
+
+def buildTinyDraft(model):
+    """Build a text-only draft model that shares the weights of a tiny Qwen2-VL model's decoder."""
+    from transformers import Qwen2Config, Qwen2ForCausalLM
+
+    text_config = getattr(model.config, "text_config", None) or model.config
+    config = Qwen2Config(
+        vocab_size=text_config.vocab_size,
+        hidden_size=text_config.hidden_size,
+        intermediate_size=text_config.intermediate_size,
+        num_hidden_layers=text_config.num_hidden_layers,
+        num_attention_heads=text_config.num_attention_heads,
+        num_key_value_heads=text_config.num_key_value_heads,
+        bos_token_id=0,
+        eos_token_id=1,
+    )
+    draft_model = Qwen2ForCausalLM(config).eval()
+    language_model = getattr(model.model, "language_model", None)
+    if language_model is None:
+        language_model = model.model
+    draft_model.model.load_state_dict(language_model.state_dict())
+    draft_model.lm_head.load_state_dict(model.lm_head.state_dict())
+    return draft_model
+
+
+def _printStats(label, stats):
+    """Print acceptance rate and throughput of one run."""
+    print(f"{label}: {stats['tokens']} tokens in {stats['seconds']:.3f}s, "
+          f"acceptance {stats['acceptance_rate']:.1%}, {stats['tokens_per_pass']:.2f} tokens per main pass")
+
+
+def _baselineGenerate(model, inputs, max_new_tokens):
+    """Plain model.generate() on the same inputs; returns (new tokens, seconds)."""
+    start = time.perf_counter()
+    with torch.no_grad():
+        output = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False)
+    return output[0, inputs["input_ids"].shape[1]:].tolist(), time.perf_counter() - start
+
+
+def verifySpeculative(max_new_tokens=24):
+    """Check on tiny models that greedy speculative output equals plain greedy generation."""
+    from OnnxExport import buildTinyModel, _multimodalInputs, _prepareImageInputs
+    from ReferenceSketches import referenceSketch
+    from transformers import Qwen2VLImageProcessor
+
+    model = buildTinyModel()
+    draft_model = buildTinyDraft(model)
+    config = model.config
+
+    pixel_values, image_grid_thw = _prepareImageInputs(Qwen2VLImageProcessor(), referenceSketch(), 56)
+    num_image_tokens = int(image_grid_thw.prod()) // config.vision_config.spatial_merge_size ** 2
+    input_ids = torch.tensor([[5, 6, 7, config.vision_start_token_id]
+                              + [config.image_token_id] * num_image_tokens
+                              + [config.vision_end_token_id, 8, 9, 10]])
+    inputs = _multimodalInputs(model, input_ids, pixel_values, image_grid_thw)
+
+    model.generation_config.eos_token_id = None
+    expected, baseline_seconds = _baselineGenerate(model, inputs, max_new_tokens)
+    ok = True
+    for num_draft_tokens in (1, 4):
+        tokens, stats = speculativeGenerate(model, draft_model, inputs, max_new_tokens,
+                                            num_draft_tokens=num_draft_tokens)
+        match = tokens == expected
+        ok = ok and match
+        _printStats(f"k={num_draft_tokens}", stats)
+        print(f"  greedy output matches main model: {match}")
+
+    # Sampling path (rejection sampling) must run and respect the length limit
+    model.generation_config.do_sample = True
+    model.generation_config.top_k = 50
+    tokens, stats = speculativeGenerate(model, draft_model, inputs, max_new_tokens, temperature=0.7, seed=0)
+    _printStats("sampling", stats)
+    ok = ok and len(tokens) == max_new_tokens
+
+    print("Verification " + ("passed" if ok else "FAILED"))
+    return ok
+
+
+def benchmark(model_name, draft_name, max_new_tokens, num_draft_tokens):
+    """Compare plain and speculative decoding on the reference sketch."""
+    from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
+    from qwen_vl_utils import process_vision_info
+    from ReferenceSketches import referenceSketch
+    from SketchAnalyzer import SketchAnalyzer, buildMessages
+
+    processor = AutoProcessor.from_pretrained(model_name, trust_remote_code=True)
+    model = Qwen2VLForConditionalGeneration.from_pretrained(model_name, torch_dtype="auto",
+                                                            trust_remote_code=True).eval()
+    draft_model = loadDraftModel(draft_name, model.device)
+
+    messages = buildMessages(referenceSketch(), SketchAnalyzer.generatePrompt())
+    text = processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    image_inputs, _ = process_vision_info(messages)
+    inputs = processor(text=[text], images=image_inputs, return_tensors="pt").to(model.device)
+
+    expected, baseline_seconds = _baselineGenerate(model, inputs, max_new_tokens)
+    tokens, stats = speculativeGenerate(model, draft_model, inputs, max_new_tokens,
+                                        num_draft_tokens=num_draft_tokens)
+    print(f"baseline: {len(expected)} tokens in {baseline_seconds:.3f}s")
+    _printStats("speculative", stats)
+    print(f"speedup: {baseline_seconds / stats['seconds']:.2f}x")
+    print(f"greedy output matches main model: {tokens == expected}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speculative decoding with a small draft model.")
+    parser.add_argument("--model", default="Qwen/Qwen2-VL-2B-Instruct", help="Main model")
+    parser.add_argument("--draft", help="Draft model sharing the main model's tokenizer")
+    parser.add_argument("--verify", action="store_true", help="Check output equivalence on tiny random models")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--num-draft-tokens", type=int, default=DEFAULT_NUM_DRAFT_TOKENS)
+    args = parser.parse_args()
+
+    if args.verify:
+        return 0 if verifySpeculative() else 1
+    if not args.draft:
+        parser.error("--draft is required unless --verify is given")
+    benchmark(args.model, args.draft, args.max_new_tokens, args.num_draft_tokens)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
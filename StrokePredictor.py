@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Stroke Predictor - Extrapolates the next milliseconds of a stylus stroke
+Used by DrawingCanvas to draw a temporary predicted ink overlay that hides input-to-display lag
+
+Usage:
+    python StrokePredictor.py                          # replay synthetic strokes and print metrics
+    python StrokePredictor.py --strokes strokes.jsonl  # replay strokes recorded with DRAWLINGO_RECORD_STROKES
+"""
+
+import argparse
+import json
+import math
+
+import numpy as np
+
+DEFAULT_HORIZON_MS = 16.0  # about one frame at 60 Hz
+HISTORY_SIZE = 6
+PREDICTION_STEPS = 3
+
+# Never predict further than this, so a sudden stop does not leave a long false tail
+MAX_PREDICTION_PX = 40.0
+
+# Samples older than this (relative to the newest one) are ignored
+MAX_SAMPLE_AGE_MS = 60.0
+
+# Default input-to-display latency assumed when replaying strokes
+DEFAULT_LATENCY_MS = 24.0
+
+
+class StrokePredictor:
+    """Extrapolates position and pressure from recent stylus samples (time in milliseconds)."""
+
+    def __init__(self, horizon_ms=DEFAULT_HORIZON_MS, history_size=HISTORY_SIZE):
+        self.horizon_ms = horizon_ms
+        self.history_size = history_size
+        self.samples = []
+
+    def reset(self):
+        """Forget the samples of the previous stroke."""
+        self.samples = []
+
+    def addSample(self, timestamp_ms, x, y, pressure=1.0):
+        """Add a stylus sample; samples with a repeated timestamp replace the previous one."""
+        if self.samples and timestamp_ms <= self.samples[-1][0]:
+            self.samples[-1] = (self.samples[-1][0], x, y, pressure)
+            return
+        self.samples.append((float(timestamp_ms), float(x), float(y), float(pressure)))
+        if len(self.samples) > self.history_size:
+            del self.samples[0]
+
+    def predict(self, horizon_ms=None):
+        """Predicted (x, y, pressure) points up to horizon_ms ahead, or [] if there is too little history."""
+        horizon_ms = self.horizon_ms if horizon_ms is None else horizon_ms
+        newest = self.samples[-1][0] if self.samples else 0.0
+        recent = [sample for sample in self.samples if newest - sample[0] <= MAX_SAMPLE_AGE_MS]
+        if len(recent) < 3 or horizon_ms <= 0:
+            return []
+
+        data = np.array(recent, dtype=np.float64)
+        t = data[:, 0] - newest
+        # Weighted least-squares quadratic (linear with few samples) fitted to x, y and pressure at once;
+        # newer samples count more
+        degree = 2 if len(recent) >= 4 else 1
+        weights = np.linspace(0.5, 1.0, len(t))[:, None]
+        basis = np.vander(t, degree + 1, increasing=True) * weights
+        try:
+            coefficients = np.linalg.solve(basis.T @ basis, basis.T @ (data[:, 1:] * weights))
+        except np.linalg.LinAlgError:
+            return []
+
+        # Offsets from the fitted value at t=0 keep the overlay attached to the real ink
+        steps = horizon_ms * np.arange(1, PREDICTION_STEPS + 1) / PREDICTION_STEPS
+        offsets = np.vander(steps, degree + 1, increasing=True)[:, 1:] @ coefficients[1:]
+        distance = np.hypot(offsets[:, 0], offsets[:, 1])
+        offsets[:, :2] *= np.minimum(1.0, MAX_PREDICTION_PX / np.maximum(distance, 1e-9))[:, None]
+        points = data[-1, 1:] + offsets
+        points[:, 2] = points[:, 2].clip(0.0, 1.0)
+        return [tuple(point) for point in points.tolist()]
+
+
+def syntheticStrokes(count=20, rate_hz=200.0, seed=0):
+    """Handwriting-like strokes sampled like a stylus: (t_ms, x, y, pressure) with jitter."""
+    rng = np.random.default_rng(seed)
+    strokes = []
+    for _ in range(count):
+        duration_ms = rng.uniform(300, 900)
+        t = np.arange(0.0, duration_ms, 1000.0 / rate_hz)
+        t += rng.normal(0.0, 0.3, len(t)).cumsum().clip(-1.0, 1.0)
+        u = t / duration_ms
+        # Loops and curves with a speed that rises and falls like a real pen stroke
+        phase = u - np.sin(2 * np.pi * u) / (2 * np.pi)
+        frequency = rng.uniform(1.0, 3.0)
+        x = 100 + rng.uniform(200, 500) * phase + rng.uniform(20, 60) * np.sin(2 * np.pi * frequency * phase)
+        y = 300 + rng.uniform(40, 150) * np.sin(2 * np.pi * rng.uniform(0.5, 2.0) * phase + rng.uniform(0, 6))
+        x += rng.normal(0.0, 0.3, len(t))
+        y += rng.normal(0.0, 0.3, len(t))
+        pressure = (0.4 + 0.5 * np.sin(np.pi * u)).clip(0.0, 1.0)
+        strokes.append(list(zip(t.tolist(), x.tolist(), y.tolist(), pressure.tolist())))
+    return strokes
+
+
+def saveStroke(path, samples):
+    """Append one recorded stroke to a JSON-lines file."""
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps([[round(value, 3) for value in sample] for sample in samples]) + "\n")
+
+
+def loadStrokes(path):
+    """Load strokes recorded with saveStroke()."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _positionAt(times, xs, ys, t):
+    """Recorded pen position at time t (linear interpolation)."""
+    return np.interp(t, times, xs), np.interp(t, times, ys)
+
+
+def evaluatePrediction(strokes, horizon_ms=DEFAULT_HORIZON_MS, latency_ms=DEFAULT_LATENCY_MS):
+    """Replay strokes through the predictor and measure prediction error and perceived latency.
+
+    The displayed ink tip lags the pen by latency_ms. Perceived latency is how far back in
+    time the pen was at the position of the displayed tip: latency_ms without prediction,
+    ideally latency_ms - horizon_ms with it.
+    """
+    errors = []
+    lag_without = []
+    lag_with = []
+    for stroke in strokes:
+        data = np.asarray(stroke, dtype=np.float64)
+        times, xs, ys = data[:, 0], data[:, 1], data[:, 2]
+        predictor = StrokePredictor(horizon_ms)
+        for t, x, y, pressure in stroke:
+            predictor.addSample(t, x, y, pressure)
+            display_time = t + latency_ms
+            if display_time > times[-1]:
+                break
+            points = predictor.predict()
+            if not points:
+                continue
+
+            actual = _positionAt(times, xs, ys, t + horizon_ms)
+            errors.append(math.hypot(points[-1][0] - actual[0], points[-1][1] - actual[1]))
+
+            # Search the recorded path for the moment that best matches each displayed tip
+            offsets = np.arange(0.0, latency_ms + horizon_ms + 1.0, 1.0)
+            past_x, past_y = _positionAt(times, xs, ys, display_time - offsets)
+            for tip, lags in (((x, y), lag_without), (points[-1][:2], lag_with)):
+                distances = np.hypot(past_x - tip[0], past_y - tip[1])
+                lags.append(float(offsets[int(np.argmin(distances))]))
+
+    if not errors:
+        raise ValueError("Strokes are too short to evaluate")
+    errors = np.asarray(errors)
+    perceived_without = float(np.mean(lag_without))
+    perceived_with = float(np.mean(lag_with))
+    return {
+        "samples": len(errors),
+        "mean_error_px": float(errors.mean()),
+        "p95_error_px": float(np.percentile(errors, 95)),
+        "perceived_latency_ms": perceived_with,
+        "perceived_latency_without_ms": perceived_without,
+        "latency_reduction_ms": perceived_without - perceived_with,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure stylus stroke prediction on recorded strokes.")
+    parser.add_argument("--strokes", help="JSON-lines file recorded with DRAWLINGO_RECORD_STROKES")
+    parser.add_argument("--horizon", type=float, default=DEFAULT_HORIZON_MS, help="Prediction horizon (ms)")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY_MS,
+                        help="Input-to-display latency to simulate (ms)")
+    args = parser.parse_args()
+
+    strokes = loadStrokes(args.strokes) if args.strokes else syntheticStrokes()
+    source = args.strokes or "synthetic strokes"
+    metrics = evaluatePrediction(strokes, args.horizon, args.latency)
+    print(f"{len(strokes)} strokes from {source}, horizon {args.horizon:.0f} ms, latency {args.latency:.0f} ms")
+    print(f"prediction error:  mean {metrics['mean_error_px']:.2f} px, p95 {metrics['p95_error_px']:.2f} px")
+    print(f"perceived latency: {metrics['perceived_latency_without_ms']:.1f} ms -> "
+          f"{metrics['perceived_latency_ms']:.1f} ms "
+          f"({metrics['latency_reduction_ms']:.1f} ms less)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+Stroke Tessellator - Variable-width pressure strokes as filled outline polygons
+The (x, y, pressure) samples of a stylus stroke are interpolated (Catmull-Rom positions,
+linear width) and turned into outline polygons with NumPy, filled as the curve becomes final
+
+Usage:
+    python StrokeTessellator.py            # quality and throughput vs. the per-segment renderer
+"""
+
+import argparse
+import math
+import time
+
+import numpy as np
+from PyQt6.QtCore import QPoint, QPointF, QRect, Qt
+from PyQt6.QtGui import QColor, QImage, QPainter, QPen, QPolygonF, QRegion
+
+# Interpolated points are at most this far apart (pixels)
+SUBDIVISION_PX = 3.0
+MAX_SUBDIVISIONS = 8
+
+# Points of a round cap (half circle) and of a dot
+CAP_POINTS = 8
+DOT_POINTS = 16
+
+# Thinnest rendered stroke (radius in pixels), so light pressure never disappears
+MIN_RADIUS = 0.5
+
+# Offsets at joins are stretched by 1/cos(half turn angle), at most by this factor
+MITER_LIMIT = 2.0
+
+# Strokes are filled as pieces of this many segments (at fixed positions), since large
+# antialiased polygons rasterize slower than a few overlapping small ones
+MAX_POLYGON_SEGMENTS = 32
+
+# Samples per flush when replaying strokes (about one frame of 200 Hz stylus input at 25 fps)
+SAMPLES_PER_FLUSH = 8
+
+
+def _catmullRomBasis(steps):
+    """(steps, 4) Catmull-Rom weights of the four control points at t = 0, 1/steps, ..."""
+    basis = _BASES.get(steps)
+    if basis is None:
+        t = np.arange(steps)[:, None] / steps
+        basis = np.hstack([-0.5 * t ** 3 + t ** 2 - 0.5 * t, 1.5 * t ** 3 - 2.5 * t ** 2 + 1.0,
+                           -1.5 * t ** 3 + 2.0 * t ** 2 + 0.5 * t, 0.5 * t ** 3 - 0.5 * t ** 2])
+        _BASES[steps] = basis
+    return basis
+
+
+_BASES = {}
+# Rotations that sweep a normal through the tangent to the opposite side, and a full circle
+_CAP_TURN = np.exp(-1j * np.linspace(0.0, math.pi, CAP_POINTS + 2)[1:-1])
+_DOT = np.exp(1j * np.linspace(0.0, 2.0 * math.pi, DOT_POINTS, endpoint=False))
+
+
+def interpolateStroke(samples, first_segment=0, end_segment=None):
+    """Catmull-Rom interpolation of (x, y, radius) samples for the segments first_segment..end_segment.
+
+    samples is (N, 3). Returns (M, 3) points ending at the sample after the last segment,
+    and the index of the first point of every segment. Each segment is subdivided on its
+    own into points at most SUBDIVISION_PX apart (up to MAX_SUBDIVISIONS), so its points
+    do not depend on which other segments are interpolated with it. The radius is
+    interpolated with the same spline, so the width changes smoothly.
+    """
+    count = len(samples)
+    if end_segment is None:
+        end_segment = count - 1
+    if count < 2 or end_segment <= first_segment:
+        return samples[first_segment:first_segment + 1].copy(), np.empty(0, dtype=int)
+    ends = samples[first_segment:end_segment + 1, :2]
+    steps = [min(MAX_SUBDIVISIONS, max(1, math.ceil(length / SUBDIVISION_PX)))
+             for length in np.hypot(*(ends[1:] - ends[:-1]).T).tolist()]
+
+    # End points are repeated so the first and last segments have neighbours
+    padded = np.concatenate([samples[:1], samples, samples[-1:]])
+    owners = np.repeat(np.arange(first_segment, end_segment), steps)
+    controls = padded[owners[:, None] + np.arange(4)]  # (points, 4, 3)
+    basis = np.concatenate([_catmullRomBasis(segment_steps) for segment_steps in steps])
+    points = np.einsum("ij,ijk->ik", basis, controls)
+    return np.concatenate([points, samples[end_segment:end_segment + 1]]), np.cumsum([0] + steps[:-1])
+
+
+def strokeOutline(samples):
+    """Closed outline around (x, y, radius) points, with round caps at both ends.
+
+    Returns the (M, 2) outline and the indices of corners too sharp for the outline
+    (drawn as dots by the caller). Points are handled as complex numbers, which keeps
+    the number of NumPy calls (the main cost for short flushes) low.
+    """
+    points = np.ascontiguousarray(samples[:, :2]).view(np.complex128)[:, 0]
+    radii = np.maximum(samples[:, 2], MIN_RADIUS)
+    if len(points) == 1:
+        return (points[0] + radii[0] * _DOT).view(np.float64).reshape(-1, 2), np.empty(0, dtype=int)
+
+    directions = points[1:] - points[:-1]
+    directions /= np.maximum(np.abs(directions), 1e-9)
+
+    # Vertex tangents bisect the adjacent segment directions; a full reversal keeps the incoming one
+    tangents = np.empty_like(points)
+    tangents[0] = directions[0]
+    tangents[-1] = directions[-1]
+    np.add(directions[:-1], directions[1:], out=tangents[1:-1])
+    lengths = np.abs(tangents)
+    reversed_ = lengths < 1e-6
+    if reversed_.any():
+        tangents[reversed_] = np.concatenate([directions[:1], directions])[reversed_]
+        lengths[reversed_] = 1.0
+    tangents /= lengths
+
+    # Stretch the offsets at joins so that the outline keeps the width of both segments
+    cosines = np.ones(len(points))
+    cosines[1:-1] = np.abs((tangents[1:-1] * directions[1:].conj()).real)
+    offsets = 1j * tangents * (radii / np.maximum(cosines, 1.0 / MITER_LIMIT))
+
+    # Round caps: from the left side around the tip to the right side (and back at the start)
+    end_cap = points[-1] + (1j * radii[-1] * tangents[-1]) * _CAP_TURN
+    start_cap = points[0] - (1j * radii[0] * tangents[0]) * _CAP_TURN
+    outline = np.concatenate([points + offsets, end_cap, (points - offsets)[::-1], start_cap])
+    return outline.view(np.float64).reshape(-1, 2), np.flatnonzero(cosines < 1.0 / MITER_LIMIT)
+
+
+def segmentRects(points, starts, margin=2):
+    """Bounding QRects of the segments in interpolateStroke() output, grown by the offset and margin.
+
+    starts are the segments' first point indices (empty for a single point). Many small
+    rectangles keep the dirty region (and the undo history) close to the ink.
+    """
+    if len(starts) == 0:
+        low = points.min(axis=0, keepdims=True)
+        high = points.max(axis=0, keepdims=True)
+    else:
+        ends = points[np.append(starts[1:], len(points) - 1)]
+        low = np.minimum(np.minimum.reduceat(points[:-1], starts), ends)
+        high = np.maximum(np.maximum.reduceat(points[:-1], starts), ends)
+    # Offsets at joins are up to MITER_LIMIT radii long
+    grow = MITER_LIMIT * np.maximum(high[:, 2], MIN_RADIUS) + margin
+    left = np.floor(low[:, 0] - grow).astype(int)
+    top = np.floor(low[:, 1] - grow).astype(int)
+    right = np.ceil(high[:, 0] + grow).astype(int)
+    bottom = np.ceil(high[:, 1] + grow).astype(int)
+    return [QRect(x, y, r - x + 1, b - y + 1) for x, y, r, b in
+            zip(left.tolist(), top.tolist(), right.tolist(), bottom.tolist())]
+
+
+def toPolygon(outline):
+    """Convert an (M, 2) float array to a QPolygonF by writing its point buffer directly."""
+    polygon = QPolygonF()
+    polygon.resize(len(outline))
+    buffer = polygon.data()
+    buffer.setsize(outline.size * 8)
+    np.frombuffer(buffer, dtype=np.float64)[:] = outline.ravel()
+    return polygon
+
+
+class PressureStroke:
+    """One stylus stroke drawn as filled variable-width outlines, flushed in batches of samples.
+
+    A segment is final once the sample after it is known (Catmull-Rom needs it). Only final
+    segments are drawn into the target, as pieces of MAX_POLYGON_SEGMENTS segments at fixed
+    positions: a flush restores the pixels around the new segments from the image before the
+    stroke and fills the pieces there again, so no pixel is blended twice and the result does
+    not depend on how often the stroke is flushed. The provisional last segment is kept as
+    the tail, which the widget paints on top (drawTail()).
+    """
+
+    def __init__(self, color, base_width):
+        self.color = QColor(color)
+        self.base_width = base_width
+        self.samples = []  # (x, y, radius)
+        self.final_segments = 0
+        self.points = np.empty((0, 3))  # interpolated points of the final segments
+        self.starts = np.empty(0, dtype=int)  # index of every final segment's first point
+        self.pieces = []  # (QPolygonF, corner dots, bounding QRect); only the last may grow
+        self.tail = None  # (QPolygonF, corner dots) of the provisional segment
+        self.tail_rect = QRect()
+        self.dirty = False
+
+    def addSample(self, x, y, pressure):
+        """Add a stylus sample (a repeated position only updates the width).
+
+        A pressure of 0 (reported by some tablets on release) keeps the previous width.
+        """
+        if pressure > 0.0:
+            radius = self.base_width * pressure / 2.0
+        else:
+            radius = self.samples[-1][2] if self.samples else self.base_width / 2.0
+        if self.samples and self.samples[-1][:2] == (x, y):
+            self.samples[-1] = (x, y, max(self.samples[-1][2], radius))
+        else:
+            self.samples.append((x, y, radius))
+        self.dirty = True
+
+    def lastRadius(self):
+        """Radius at the newest sample (0 before the first sample)."""
+        return max(self.samples[-1][2], MIN_RADIUS) if self.samples else 0.0
+
+    def flush(self, painter, before, final=False):
+        """Draw the segments that became final since the last flush and update the tail.
+
+        before is the target as it was before the stroke. Returns the QRects drawn into the target.
+        """
+        count = len(self.samples)
+        if count == 0 or not (self.dirty or final and self.tail is not None):
+            return []
+        self.dirty = False
+        end = count - 1 if final else max(self.final_segments, count - 2)
+        # Segments from final_segments on need one sample before them
+        offset = max(0, self.final_segments - 1)
+        data = np.array(self.samples[offset:], dtype=np.float64)
+
+        rects = []
+        if end > self.final_segments or final and not self.pieces:
+            points, starts = interpolateStroke(data, self.final_segments - offset, end - offset)
+            self.starts = np.concatenate([self.starts, starts + len(self.points)])
+            self.points = np.concatenate([self.points, points[:-1]])
+            # The previous last segment is redrawn too: its end cap becomes a join
+            rects = segmentRects(*self._finalPoints(data[end - offset], offset, end))
+            for index in range(self.final_segments // MAX_POLYGON_SEGMENTS,
+                               max(end - 1, 0) // MAX_POLYGON_SEGMENTS + 1):
+                begin = index * MAX_POLYGON_SEGMENTS
+                stop = min(end, begin + MAX_POLYGON_SEGMENTS)
+                points, _ = self._finalPoints(data[stop - offset], begin, stop)
+                del self.pieces[index:]
+                self.pieces.append(self._outline(points))
+            self.final_segments = end
+            self._redraw(painter, before, rects)
+
+        if final:
+            self.tail = None
+            self.tail_rect = QRect()
+        else:
+            points, _ = interpolateStroke(data, end - offset, count - 1 - offset)
+            polygon, dots, self.tail_rect = self._outline(points)
+            self.tail = (polygon, dots)
+        return rects
+
+    def drawTail(self, painter):
+        """Fill the provisional tail of the stroke (antialiasing is up to the painter)."""
+        if self.tail is not None:
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.setBrush(self.color)
+            self._fill(painter, *self.tail)
+
+    def _finalPoints(self, end_sample, begin, end):
+        """Interpolated points and segment starts of the final segments begin..end (as interpolateStroke()).
+
+        end_sample is the (x, y, radius) sample at the end of the last segment.
+        """
+        if begin == end:
+            return end_sample[None], np.empty(0, dtype=int)
+        first = self.starts[begin]
+        last = self.starts[end] if end < len(self.starts) else len(self.points)
+        return np.concatenate([self.points[first:last], end_sample[None]]), self.starts[begin:end] - first
+
+    @staticmethod
+    def _outline(points):
+        """Outline QPolygonF, corner dots (QPointF, radius) and bounding QRect of interpolated points."""
+        outline, corners = strokeOutline(points)
+        dots = [(QPointF(x, y), max(radius, MIN_RADIUS)) for x, y, radius in points[corners].tolist()]
+        polygon = toPolygon(outline)
+        grow = math.ceil(max(points[:, 2].max(), MIN_RADIUS)) + 2
+        return polygon, dots, polygon.boundingRect().toAlignedRect().adjusted(-grow, -grow, grow, grow)
+
+    def _redraw(self, painter, before, rects):
+        """Restore rects from before and fill the pieces of the stroke inside them again."""
+        region = QRegion()
+        for rect in rects:
+            region = region.united(rect)
+        painter.save()
+        painter.setClipRegion(region)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+        bounds = region.boundingRect().intersected(before.rect())
+        painter.drawImage(bounds.topLeft(), before, bounds)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(self.color)
+        for polygon, dots, piece_bounds in self.pieces:
+            if region.intersects(piece_bounds):
+                self._fill(painter, polygon, dots)
+        painter.restore()
+
+    @staticmethod
+    def _fill(painter, polygon, dots):
+        painter.drawPolygon(polygon, Qt.FillRule.WindingFill)
+        for center, radius in dots:
+            painter.drawEllipse(center, radius, radius)
+
+
+def renderTessellated(image, stroke, color=Qt.GlobalColor.black, base_width=3.0,
+                      samples_per_flush=SAMPLES_PER_FLUSH):
+    """Draw (t, x, y, pressure) samples onto a QImage with PressureStroke, flushing like the canvas."""
+    before = image.copy()
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+    pressure_stroke = PressureStroke(color, base_width)
+    for i, (_, x, y, pressure) in enumerate(stroke):
+        pressure_stroke.addSample(x, y, pressure)
+        if (i + 1) % samples_per_flush == 0:
+            pressure_stroke.flush(painter, before)
+    pressure_stroke.flush(painter, before, final=True)
+    painter.end()
+
+
+def renderSegments(image, stroke, color=Qt.GlobalColor.black, base_width=3.0):
+    """Draw samples the way the per-segment canvas path does: one constant-width line per event.
+
+    Antialiased like the tessellated renderer and the reference, so the comparison is about the geometry.
+    """
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+    pen = QPen(QColor(color), base_width)
+    pen.setCapStyle(Qt.PenCapStyle.RoundCap)
+    pen.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
+    last = QPoint(round(stroke[0][1]), round(stroke[0][2]))
+    if stroke[0][3] > 0.0:
+        pen.setWidthF(base_width * stroke[0][3])
+    for _, x, y, pressure in stroke[1:]:
+        point = QPoint(round(x), round(y))
+        painter.setPen(pen)
+        painter.drawLine(last, point)
+        last = point
+        # Like tabletEvent, the new width applies from the next segment on
+        if pressure > 0.0:
+            pen.setWidthF(base_width * pressure)
+    painter.end()
+
+
+def renderReference(size, stroke, base_width=3.0, supersample=4):
+    """Ideal rendering: dense round dabs with linearly interpolated width, supersampled, as coverage (H, W)."""
+    width, height = size
+    image = QImage(width * supersample, height * supersample, QImage.Format.Format_Grayscale8)
+    image.fill(255)
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+    painter.setPen(Qt.PenStyle.NoPen)
+    painter.setBrush(QColor(0, 0, 0))
+    data = np.asarray(stroke, dtype=np.float64)
+    spacing = 0.25
+    distance = np.concatenate([[0.0], np.cumsum(np.hypot(*np.diff(data[:, 1:3], axis=0).T))])
+    at = np.arange(0.0, distance[-1] + spacing, spacing)
+    xs = np.interp(at, distance, data[:, 1]) * supersample
+    ys = np.interp(at, distance, data[:, 2]) * supersample
+    radii = np.maximum(np.interp(at, distance, data[:, 3]) * base_width / 2.0, MIN_RADIUS) * supersample
+    for x, y, radius in zip(xs.tolist(), ys.tolist(), radii.tolist()):
+        painter.drawEllipse(QPointF(x, y), radius, radius)
+    painter.end()
+    small = image.scaled(width, height, Qt.AspectRatioMode.IgnoreAspectRatio,
+                         Qt.TransformationMode.SmoothTransformation)
+    return inkCoverage(small)
+
+
+def inkCoverage(image):
+    """Ink coverage in [0, 1] per pixel of a white-background QImage."""
+    image = image.convertToFormat(QImage.Format.Format_Grayscale8)
+    bits = image.constBits()
+    bits.setsize(image.sizeInBytes())
+    rows = np.frombuffer(bits, dtype=np.uint8).reshape(image.height(), image.bytesPerLine())
+    return 1.0 - rows[:, :image.width()] / 255.0
+
+
+def blankImage(size):
+    """White RGB32 QImage of (width, height) to render test strokes on."""
+    image = QImage(size[0], size[1], QImage.Format.Format_RGB32)
+    image.fill(0xFFFFFFFF)
+    return image
+
+
+def compareRenderers(strokes, size=(900, 600), base_width=3.0, repeats=3):
+    """Quality and throughput of the tessellated and per-segment renderers on (t, x, y, pressure) strokes.
+
+    Quality is the coverage difference to an ideal supersampled rendering, in pixels per
+    100 pixels of stroke length (lower is better). Throughput is the fastest of repeats
+    renderings, per sample.
+    """
+    results = {}
+    length = sum(float(np.hypot(*np.diff(np.asarray(stroke)[:, 1:3], axis=0).T).sum()) for stroke in strokes)
+    references = [renderReference(size, stroke, base_width) for stroke in strokes]
+    samples = sum(len(stroke) for stroke in strokes)
+    for name, render in (("tessellated", renderTessellated), ("segments", renderSegments)):
+        error = 0.0
+        seconds = 0.0
+        for stroke, reference in zip(strokes, references):
+            timings = []
+            for _ in range(repeats):
+                image = blankImage(size)
+                start = time.perf_counter()
+                render(image, stroke, base_width=base_width)
+                timings.append(time.perf_counter() - start)
+            seconds += min(timings)
+            error += float(np.abs(inkCoverage(image) - reference).sum())
+        results[name] = {
+            "error_px_per_100px": error / length * 100.0,
+            "us_per_sample": seconds / samples * 1e6,
+        }
+    return results
+
+
+def main():
+    from StrokePredictor import syntheticStrokes
+
+    parser = argparse.ArgumentParser(description="Compare the tessellated and per-segment pressure stroke renderers.")
+    parser.add_argument("--width", type=float, default=6.0, help="Pen width at full pressure")
+    parser.add_argument("--strokes", type=int, default=10, help="Number of synthetic strokes")
+    args = parser.parse_args()
+
+    results = compareRenderers(syntheticStrokes(args.strokes), base_width=args.width)
+    print(f"{'renderer':>12} {'error px/100px':>14} {'us/sample':>10}")
+    for name, result in results.items():
+        print(f"{name:>12} {result['error_px_per_100px']:>14.2f} {result['us_per_sample']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+Undo History - Memory-capped undo/redo of canvas edits stored as compressed dirty regions
+"""
+
+import zlib
+from collections import deque
+
+import numpy as np
+from PyQt6.QtCore import QRect
+from PyQt6.QtGui import QImage, QPainter
+
+DEFAULT_HISTORY_BYTES = 32 * 1024 * 1024
+
+# Canvas regions are stored as raw 32-bit pixels; level 1 is fast and sketches compress well
+COMPRESSION_LEVEL = 1
+IMAGE_FORMAT = QImage.Format.Format_RGB32
+
+# Dirty rectangles are snapped to a tile grid so that overlapping segments are stored once
+TILE_SIZE = 32
+
+# Rectangles captured or compressed per processPending() call, which keeps every idle step short
+RECTS_PER_STEP = 16
+
+
+def packImage(image):
+    """Compress the pixels of a QImage (converted to IMAGE_FORMAT)."""
+    if image.format() != IMAGE_FORMAT:
+        image = image.convertToFormat(IMAGE_FORMAT)
+    pixels = image.constBits()
+    pixels.setsize(image.sizeInBytes())
+    return zlib.compress(bytes(pixels), COMPRESSION_LEVEL)
+
+
+def tileRuns(rects, bounds, tile=TILE_SIZE):
+    """Cover rects with disjoint rectangles made of horizontal runs of grid tiles, clipped to bounds."""
+    if bounds.isEmpty() or not rects:
+        return []
+    # Tile ranges of the clipped rects, marked in a grid with a 2D difference array; empty rects mark nothing
+    corners = np.array([(rect.left(), rect.top(), rect.right(), rect.bottom()) for rect in rects])
+    lower = np.maximum(corners[:, :2], (bounds.left(), bounds.top()))
+    upper = np.minimum(corners[:, 2:], (bounds.right(), bounds.bottom()))
+    valid = (upper >= lower).all(axis=1)
+    lower = lower[valid] // tile
+    upper = upper[valid] // tile + 1
+    grid = np.zeros(((bounds.bottom() // tile) + 2, (bounds.right() // tile) + 3), dtype=np.int32)
+    np.add.at(grid, (lower[:, 1], lower[:, 0] + 1), 1)
+    np.add.at(grid, (lower[:, 1], upper[:, 0] + 1), -1)
+    np.add.at(grid, (upper[:, 1], lower[:, 0] + 1), -1)
+    np.add.at(grid, (upper[:, 1], upper[:, 0] + 1), 1)
+    grid = (grid.cumsum(axis=0).cumsum(axis=1) > 0).astype(np.int8)
+
+    runs = []
+    steps = np.diff(grid, axis=1)
+    starts = np.argwhere(steps == 1).tolist()
+    ends = np.argwhere(steps == -1)[:, 1].tolist()
+    for (row, start), end in zip(starts, ends):
+        run = QRect(start * tile, row * tile, (end - start) * tile, tile)
+        runs.append(run.intersected(bounds))
+    return runs
+
+
+def unpackImage(data, width, height):
+    """Rebuild a QImage from packImage() data."""
+    pixels = zlib.decompress(data)
+    # QImage does not own the buffer, so copy() before the bytes go away
+    return QImage(pixels, width, height, width * 4, IMAGE_FORMAT).copy()
+
+
+class HistoryEntry:
+    """One undoable edit: the pixels of its dirty rectangles and the ink bounding box, before and after.
+
+    The "before" pixels of each rectangle start as None and are captured as QImages from
+    the committed image; the "after" pixels are only needed for redo, so they are taken
+    from the canvas when the edit is undone. compress() replaces QImages with
+    packImage() data. Capturing and compressing can be spread over several calls.
+    """
+
+    def __init__(self, rects, source, ink_before, ink_after):
+        self.rects = rects
+        self.source = source
+        self.before = [None] * len(rects)
+        self.after = []
+        self.ink_before = QRect(ink_before)
+        self.ink_after = QRect(ink_after)
+        self.captured = 0
+        self.size = 0
+
+    def isCaptured(self):
+        return self.captured == len(self.rects)
+
+    def isPacked(self):
+        return self.isCaptured() and not any(isinstance(data, QImage) for data in self.before + self.after)
+
+    def capture(self, committed, count):
+        """Copy the before pixels of up to count more rectangles from the committed image and bring
+        it up to date from the source pixmap. Returns the size change in bytes."""
+        end = min(self.captured + count, len(self.rects))
+        painter = QPainter(committed)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+        size = 0
+        for i in range(self.captured, end):
+            rect = self.rects[i]
+            self.before[i] = committed.copy(rect)
+            painter.drawPixmap(rect.topLeft(), self.source, rect)
+            size += self.before[i].sizeInBytes()
+        painter.end()
+        self.captured = end
+        if self.isCaptured():
+            self.source = None
+        self.size += size
+        return size
+
+    def captureAfter(self, pixmap):
+        """Copy the after pixels from pixmap (which must show the edit). Returns the size change in bytes."""
+        self.after = [pixmap.copy(rect).toImage() for rect in self.rects]
+        size = sum(image.sizeInBytes() for image in self.after)
+        self.size += size
+        return size
+
+    def compress(self, count):
+        """Pack up to count more captured QImages. Returns the size change in bytes."""
+        size = 0
+        for pixels in (self.before, self.after):
+            for i, data in enumerate(pixels):
+                if count and isinstance(data, QImage):
+                    pixels[i] = packImage(data)
+                    size += len(pixels[i]) - data.sizeInBytes()
+                    count -= 1
+        self.size += size
+        return size
+
+    def images(self, pixels):
+        """QImages of the entry's rectangles from its (captured) before or after pixels."""
+        return [data if isinstance(data, QImage) else unpackImage(data, rect.width(), rect.height())
+                for rect, data in zip(self.rects, pixels)]
+
+
+class UndoHistory:
+    """Undo/redo stacks of dirty-region deltas against a committed copy of the canvas.
+
+    The committed image mirrors the canvas as of the last recorded edit, so the
+    "before" pixels of a new edit are read from it and only the edit's own rectangles
+    are copied. record() itself only works out the rectangles; the pixels are copied
+    and compressed a few rectangles at a time by processPending() (DrawingCanvas calls
+    it when idle), and capturePending() copies the rest at once before the canvas
+    changes again. Undo and redo repaint just those rectangles. Only the stored
+    regions count toward the memory cap: the committed image has the size of the
+    canvas and is needed however short the history is.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_HISTORY_BYTES):
+        self.max_bytes = max_bytes
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.pending = deque()
+        self.total_bytes = 0
+        self.committed = QImage()
+
+    def reset(self, pixmap):
+        """Forget all entries and take the pixmap as the committed state."""
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.pending.clear()
+        self.total_bytes = 0
+        self.committed = pixmap.toImage().convertToFormat(IMAGE_FORMAT)
+        self._evict()
+
+    def resize(self, width, height):
+        """Grow the committed image along with the canvas (new area is white)."""
+        if width <= self.committed.width() and height <= self.committed.height():
+            return
+        self.capturePending()
+        grown = QImage(max(width, self.committed.width()), max(height, self.committed.height()), IMAGE_FORMAT)
+        grown.fill(0xFFFFFFFF)
+        painter = QPainter(grown)
+        painter.drawImage(0, 0, self.committed)
+        painter.end()
+        self.committed = grown
+        self._evict()
+
+    def record(self, pixmap, dirty_rects, ink_before, ink_after):
+        """Record an edit of pixmap that touched dirty_rects (QRects) as a new undo entry.
+
+        pixmap must not change until the entry is captured (see capturePending()).
+        """
+        self.capturePending()
+        bounds = QRect(0, 0, self.committed.width(), self.committed.height())
+        rects = tileRuns(dirty_rects, bounds)
+        if not rects:
+            return
+
+        for entry in self.redo_stack:
+            self._drop(entry)
+        self.redo_stack.clear()
+        entry = HistoryEntry(rects, pixmap, ink_before, ink_after)
+        self.undo_stack.append(entry)
+        self.pending.append(entry)
+        self._evict()
+
+    def committedImage(self):
+        """Get the canvas as of the last recorded edit (captures the pending edits first)."""
+        self.capturePending()
+        return self.committed
+
+    def hasPending(self):
+        """Check if some recorded edits are not captured and compressed yet."""
+        return bool(self.pending)
+
+    def capturePending(self):
+        """Copy all pixels not captured yet (required before the canvas is edited again)."""
+        for entry in self.pending:
+            if not entry.isCaptured():
+                self.total_bytes += entry.capture(self.committed, len(entry.rects))
+        self._evict()
+
+    def processPending(self, count=RECTS_PER_STEP):
+        """Capture or compress the next count rectangles of the oldest pending edit.
+
+        Returns True if more work is waiting.
+        """
+        if self.pending:
+            entry = self.pending[0]
+            if not entry.isCaptured():
+                self.total_bytes += entry.capture(self.committed, count)
+            else:
+                self.total_bytes += entry.compress(count)
+                if entry.isPacked():
+                    self.pending.popleft()
+            self._evict()
+        return bool(self.pending)
+
+    def canUndo(self):
+        """Check if there is an edit to undo."""
+        return bool(self.undo_stack)
+
+    def canRedo(self):
+        """Check if there is an undone edit to redo."""
+        return bool(self.redo_stack)
+
+    def undo(self, pixmap):
+        """Restore the pixels before the last edit. Returns the entry, or None."""
+        self.capturePending()
+        if not self.undo_stack:
+            return None
+        entry = self.undo_stack.pop()
+        if not entry.after:
+            self.total_bytes += entry.captureAfter(pixmap)
+            if entry not in self.pending:
+                self.pending.append(entry)
+        self._apply(pixmap, entry.rects, entry.images(entry.before))
+        self.redo_stack.append(entry)
+        self._evict()
+        return entry
+
+    def redo(self, pixmap):
+        """Re-apply the last undone edit. Returns the entry, or None."""
+        self.capturePending()
+        if not self.redo_stack:
+            return None
+        entry = self.redo_stack.pop()
+        self._apply(pixmap, entry.rects, entry.images(entry.after))
+        self.undo_stack.append(entry)
+        return entry
+
+    def stats(self):
+        """Get entry counts and memory use."""
+        return {
+            "undo": len(self.undo_stack),
+            "redo": len(self.redo_stack),
+            "pending": len(self.pending),
+            "bytes": self.total_bytes + self.committed.sizeInBytes(),
+            "committed_bytes": self.committed.sizeInBytes(),
+            "max_bytes": self.max_bytes,
+        }
+
+    def setMaxBytes(self, max_bytes):
+        """Change the memory cap, evicting the oldest entries if needed."""
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def _drop(self, entry):
+        self.total_bytes -= entry.size
+        if entry in self.pending:
+            self.pending.remove(entry)
+
+    def _evict(self):
+        """Drop the oldest undo entries (then the farthest redo entries) until under the cap."""
+        if self.total_bytes <= self.max_bytes:
+            return
+        # A dropped edit must still bring the committed image up to date. Edits that are not
+        # compressed yet are dropped as they are: compressing here would stall the input
+        for entry in self.pending:
+            if not entry.isCaptured():
+                self.total_bytes += entry.capture(self.committed, len(entry.rects))
+        while self.total_bytes > self.max_bytes and self.undo_stack:
+            if len(self.undo_stack) == 1 and self.undo_stack[0] in self.pending:
+                # The last edit is compressed instead of being dropped for its raw size
+                entry = self.undo_stack[0]
+                self.total_bytes += entry.compress(2 * len(entry.rects))
+                self.pending.remove(entry)
+                continue
+            self._drop(self.undo_stack.popleft())
+        while self.total_bytes > self.max_bytes and self.redo_stack:
+            self._drop(self.redo_stack.pop(0))
+
+    def _apply(self, pixmap, rects, images):
+        """Paint region pixels (QImages) onto the pixmap and the committed image."""
+        pixmap_painter = QPainter(pixmap)
+        committed_painter = QPainter(self.committed)
+        for painter in (pixmap_painter, committed_painter):
+            painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+        for rect, image in zip(rects, images):
+            pixmap_painter.drawImage(rect.topLeft(), image)
+            committed_painter.drawImage(rect.topLeft(), image)
+        pixmap_painter.end()
+        committed_painter.end()
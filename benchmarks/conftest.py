@@ -0,0 +1,89 @@
+"""
+Benchmark fixtures - Offscreen Qt application and stored performance baselines
+
+Usage:
+    python -m pytest benchmarks                       # compare against benchmarks/canvas_baseline.json
+    python -m pytest benchmarks --update-baseline     # record new baseline values
+    python -m pytest benchmarks --bench-tolerance 0.5 # fail above 1.5x the baseline (default 2x)
+"""
+
+import json
+import os
+import sys
+
+# Must be set before the QApplication is created
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "canvas_baseline.json")
+
+
+def pytest_addoption(parser):
+    parser.addoption("--update-baseline", action="store_true", default=False,
+                     help="Write the measured metrics to the baseline file instead of comparing")
+    parser.addoption("--bench-tolerance", type=float, default=1.0,
+                     help="Allowed relative regression over the baseline (1.0 = twice as slow)")
+
+
+class Baseline:
+    """Stored metric values; measured values are compared against them or recorded."""
+
+    def __init__(self, path, update, tolerance):
+        self.path = path
+        self.update = update
+        self.tolerance = tolerance
+        self.values = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.values = json.load(f)
+        self.measured = {}
+
+    def check(self, name, value, unit):
+        """Record a metric and fail if it regressed past the baseline."""
+        self.measured[name] = (value, unit)
+        if self.update:
+            self.values[name] = round(value, 3)
+            return
+        baseline = self.values.get(name)
+        if baseline is None:
+            pytest.skip(f"No baseline for {name}; run with --update-baseline")
+        limit = baseline * (1.0 + self.tolerance)
+        assert value <= limit, (
+            f"{name} regressed: {value:.3f} {unit} > {limit:.3f} {unit} "
+            f"(baseline {baseline:.3f} {unit} + {self.tolerance:.0%})"
+        )
+
+    def save(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(dict(sorted(self.values.items())), f, indent=2)
+            f.write("\n")
+
+
+@pytest.fixture(scope="session")
+def qapp():
+    QtWidgets = pytest.importorskip("PyQt6.QtWidgets")
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    yield app
+
+
+@pytest.fixture(scope="session")
+def baseline(request):
+    config = request.config
+    stored = Baseline(BASELINE_FILE, config.getoption("--update-baseline"), config.getoption("--bench-tolerance"))
+    config._canvas_baseline = stored
+    yield stored
+    if stored.update:
+        stored.save()
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    stored = getattr(config, "_canvas_baseline", None)
+    if stored is None or not stored.measured:
+        return
+    terminalreporter.section("DrawingCanvas performance")
+    for name, (value, unit) in sorted(stored.measured.items()):
+        reference = stored.values.get(name)
+        reference_text = f"(baseline {reference:.3f})" if reference is not None and not stored.update else ""
+        terminalreporter.write_line(f"{name:<40}{value:>12.3f} {unit:<4}{reference_text}")
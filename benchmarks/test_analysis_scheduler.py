@@ -0,0 +1,75 @@
+"""
+AnalysisScheduler behaviour tests
+Requests run stand-in workers, so no model is loaded
+"""
+
+import time
+
+import pytest
+
+QtCore = pytest.importorskip("PyQt6.QtCore")
+
+from PyQt6.QtCore import QThread, pyqtSignal
+
+from AnalysisScheduler import CANCELLED, DONE, QUEUED, RUNNING, AnalysisRequest, AnalysisScheduler, estimateCost
+
+
+class _IdleWorker:
+    """Worker that never runs; the test decides when its request finishes."""
+
+    def start(self):
+        pass
+
+    def requestInterruption(self):
+        pass
+
+
+class _LoopWorker(QThread):
+    """Worker that runs until it is interrupted, like a generation loop checking its stopping criteria."""
+
+    stopped = pyqtSignal()
+
+    def run(self):
+        while not self.isInterruptionRequested():
+            time.sleep(0.001)
+        self.stopped.emit()
+
+
+def test_cancel_running_request(qapp):
+    """A cancelled running request stops cooperatively and keeps the model until its worker returns."""
+    scheduler = AnalysisScheduler()
+    worker = _LoopWorker()
+    running = AnalysisRequest("canvas-1", worker, 500)
+    worker.stopped.connect(lambda: scheduler.finish(running))
+    scheduler.submit(running)
+    waiting = scheduler.submit(AnalysisRequest("canvas-2", _IdleWorker(), 500))
+    assert running.state == RUNNING
+
+    scheduler.cancel(running)
+    assert running.state == RUNNING and waiting.state == QUEUED
+    assert worker.wait(5000)
+    qapp.processEvents()
+    assert running.state == CANCELLED and waiting.state == RUNNING
+    assert scheduler.stats("canvas-1")["cancelled"] == 1
+    assert scheduler.stats("canvas-1")["served"] == 0
+
+
+def test_short_request_goes_first(qapp):
+    """A single story submitted after a multi-task request starts before it (default prompts and limits)."""
+    pytest.importorskip("torch")
+    from MultiTaskGeneration import TASK_MAX_NEW_TOKENS, TASK_STORY, taskPrompts
+    from SketchAnalyzer import SketchAnalyzer
+
+    prompt = SketchAnalyzer.generatePrompt()
+    story_cost = estimateCost(prompt, TASK_MAX_NEW_TOKENS[TASK_STORY])
+    tasks_cost = sum(estimateCost(text, TASK_MAX_NEW_TOKENS[task]) for task, text in taskPrompts(prompt).items())
+
+    scheduler = AnalysisScheduler()
+    running = scheduler.submit(AnalysisRequest("canvas-1", _IdleWorker(), story_cost))
+    long = scheduler.submit(AnalysisRequest("canvas-2", _IdleWorker(), tasks_cost))
+    short = scheduler.submit(AnalysisRequest("canvas-3", _IdleWorker(), story_cost))
+    assert scheduler.position(short) < scheduler.position(long)
+
+    scheduler.finish(running)
+    assert running.state == DONE
+    assert short.state == RUNNING and long.state == QUEUED
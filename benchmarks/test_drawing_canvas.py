@@ -0,0 +1,412 @@
+"""
+DrawingCanvas performance regression tests
+Synthetic mouse, tablet and touch strokes are replayed on an offscreen canvas
+"""
+
+import math
+import time
+
+import pytest
+
+QtCore = pytest.importorskip("PyQt6.QtCore")
+QtGui = pytest.importorskip("PyQt6.QtGui")
+
+from PyQt6.QtCore import QEvent, QPointF, QSize, Qt
+from PyQt6.QtGui import QInputDevice, QMouseEvent, QPixmap, QPointingDevice, QResizeEvent, QTabletEvent, QTouchEvent
+from PyQt6.QtWidgets import QApplication
+
+from DrawingCanvas import DrawingCanvas
+from StrokePredictor import evaluatePrediction, syntheticStrokes
+from StrokeTessellator import blankImage, compareRenderers, inkCoverage, renderTessellated
+
+CANVAS_SIZES = [(640, 480), (1280, 800), (1920, 1080)]
+STROKE_EVENTS = 200
+EVENTS_PER_FRAME = 8
+STYLUS_INTERVAL_MS = 5
+TOUCH_CONTACTS = 10
+REPEATS = 7
+MIN_SAMPLE_SECONDS = 0.005
+
+
+def _sizeId(size):
+    return f"{size[0]}x{size[1]}"
+
+
+def _bestTime(function, repeats=REPEATS):
+    """Fastest wall time of one function() call in seconds.
+
+    Each sample loops the function long enough to be measurable; the minimum
+    over the samples is the least noisy estimate on a shared machine.
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        if time.perf_counter() - start >= MIN_SAMPLE_SECONDS:
+            break
+        loops *= 2
+
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        samples.append((time.perf_counter() - start) / loops)
+    return min(samples)
+
+
+def _strokePath(size, count=STROKE_EVENTS):
+    """A wavy stroke across the canvas with a varying pen pressure."""
+    width, height = size
+    points = []
+    for i in range(count):
+        t = i / (count - 1)
+        x = 20 + t * (width - 40)
+        y = height / 2 + math.sin(t * 6 * math.pi) * height / 3
+        pressure = 0.3 + 0.6 * abs(math.sin(t * 3 * math.pi))
+        points.append((QPointF(x, y), pressure))
+    return points
+
+
+class _TouchPoint:
+    """Minimal stand-in for QEventPoint (PyQt6 cannot create positioned event points)."""
+
+    def __init__(self, point_id, state, position):
+        self._id = point_id
+        self._state = state
+        self._position = position
+
+    def id(self):
+        return self._id
+
+    def state(self):
+        return self._state
+
+    def position(self):
+        return self._position
+
+
+class _SyntheticTouchEvent(QTouchEvent):
+    """QTouchEvent carrying synthetic touch points."""
+
+    def __init__(self, event_type, points):
+        super().__init__(event_type)
+        self._points = points
+
+    def points(self):
+        return self._points
+
+
+class _StylusEvent(QTabletEvent):
+    """QTabletEvent with a timestamp (PyQt6 has no setter for it)."""
+
+    def __init__(self, timestamp, *args):
+        super().__init__(*args)
+        self._timestamp = timestamp
+
+    def timestamp(self):
+        return self._timestamp
+
+
+def _mouseEvents(path):
+    press, move, release = QEvent.Type.MouseButtonPress, QEvent.Type.MouseMove, QEvent.Type.MouseButtonRelease
+    left, none = Qt.MouseButton.LeftButton, Qt.MouseButton.NoButton
+    modifiers = Qt.KeyboardModifier.NoModifier
+    events = [QMouseEvent(press, path[0][0], path[0][0], left, left, modifiers)]
+    events += [QMouseEvent(move, point, point, none, left, modifiers) for point, _ in path[1:-1]]
+    events.append(QMouseEvent(release, path[-1][0], path[-1][0], left, none, modifiers))
+    return events
+
+
+def _tabletEvents(path):
+    device = QPointingDevice(
+        "benchmark stylus", 1001, QInputDevice.DeviceType.Stylus, QPointingDevice.PointerType.Pen,
+        QInputDevice.Capability.Position | QInputDevice.Capability.Pressure, 1, 3
+    )
+    left, none = Qt.MouseButton.LeftButton, Qt.MouseButton.NoButton
+    modifiers = Qt.KeyboardModifier.NoModifier
+    events = []
+    for i, (point, pressure) in enumerate(path):
+        if i == 0:
+            event_type, button, buttons = QEvent.Type.TabletPress, left, left
+        elif i == len(path) - 1:
+            event_type, button, buttons = QEvent.Type.TabletRelease, left, none
+        else:
+            event_type, button, buttons = QEvent.Type.TabletMove, none, left
+        events.append(_StylusEvent(i * STYLUS_INTERVAL_MS, event_type, device, point, point, pressure,
+                                   0.0, 0.0, 0.0, 0.0, 0.0, modifiers, button, buttons))
+    return events
+
+
+def _touchEvents(path, point_id=0):
+    events = []
+    for i, (point, _) in enumerate(path):
+        if i == 0:
+            event_type, state = QEvent.Type.TouchBegin, QtGui.QEventPoint.State.Pressed
+        elif i == len(path) - 1:
+            event_type, state = QEvent.Type.TouchEnd, QtGui.QEventPoint.State.Released
+        else:
+            event_type, state = QEvent.Type.TouchUpdate, QtGui.QEventPoint.State.Updated
+        events.append(_SyntheticTouchEvent(event_type, [_TouchPoint(point_id, state, point)]))
+    return events
+
+
+def _multiTouchEvents(paths):
+    """Touch events of several simultaneous contacts, one path per touch point id."""
+    events = []
+    for contacts in zip(*(_touchEvents(path, point_id) for point_id, path in enumerate(paths))):
+        points = [point for event in contacts for point in event.points()]
+        events.append(_SyntheticTouchEvent(contacts[0].type(), points))
+    return events
+
+
+def _touchPaths(size, count=TOUCH_CONTACTS):
+    """Parallel strokes of several fingers spread over the canvas height."""
+    width, height = size
+    paths = []
+    for finger in range(count):
+        offset = (finger - (count - 1) / 2) * height / (count + 1)
+        paths.append([(QPointF(point.x(), min(max(point.y() / 3 + height / 3 + offset, 0), height - 1)), pressure)
+                      for point, pressure in _strokePath(size)])
+    return paths
+
+
+@pytest.fixture(params=CANVAS_SIZES, ids=_sizeId)
+def canvas(qapp, request):
+    widget = DrawingCanvas()
+    widget.resize(*request.param)
+    widget.show()
+    QApplication.processEvents()
+    yield widget
+    widget.close()
+    widget.deleteLater()
+    QApplication.processEvents()
+
+
+def _canvasSize(widget):
+    return (widget.width(), widget.height())
+
+
+def test_mouse_stroke(canvas, baseline):
+    events = _mouseEvents(_strokePath(_canvasSize(canvas)))
+
+    def stroke():
+        canvas.mousePressEvent(events[0])
+        for event in events[1:-1]:
+            canvas.mouseMoveEvent(event)
+        canvas.mouseReleaseEvent(events[-1])
+
+    seconds = _bestTime(stroke)
+    baseline.check(f"mouse_event_us@{_sizeId(_canvasSize(canvas))}", seconds / len(events) * 1e6, "us")
+
+
+def test_tablet_stroke(canvas, baseline):
+    events = _tabletEvents(_strokePath(_canvasSize(canvas)))
+
+    def stroke():
+        for event in events:
+            canvas.tabletEvent(event)
+
+    seconds = _bestTime(stroke)
+    baseline.check(f"tablet_event_us@{_sizeId(_canvasSize(canvas))}", seconds / len(events) * 1e6, "us")
+
+
+def test_tablet_stroke_segments(canvas, baseline):
+    """Stylus events drawn with the previous per-segment pen path (tessellation disabled)."""
+    events = _tabletEvents(_strokePath(_canvasSize(canvas)))
+    canvas.setPressureTessellation(False)
+
+    def stroke():
+        for event in events:
+            canvas.tabletEvent(event)
+
+    seconds = _bestTime(stroke)
+    baseline.check(f"tablet_segment_event_us@{_sizeId(_canvasSize(canvas))}", seconds / len(events) * 1e6, "us")
+
+
+def test_tablet_stroke_frame_time(canvas, baseline):
+    """A frame's worth of stylus events followed by the repaint that fills the tessellated outline."""
+    events = _tabletEvents(_strokePath(_canvasSize(canvas)))
+    frames = [events[i:i + EVENTS_PER_FRAME] for i in range(1, len(events) - 1, EVENTS_PER_FRAME)]
+
+    def stroke():
+        canvas.tabletEvent(events[0])
+        for frame in frames:
+            for event in frame:
+                canvas.tabletEvent(event)
+            QApplication.processEvents()
+        canvas.tabletEvent(events[-1])
+        QApplication.processEvents()
+
+    seconds = _bestTime(stroke)
+    baseline.check(f"tablet_frame_ms@{_sizeId(_canvasSize(canvas))}", seconds / len(frames) * 1e3, "ms")
+
+
+def test_touch_stroke(canvas, baseline):
+    events = _touchEvents(_strokePath(_canvasSize(canvas)))
+
+    def stroke():
+        for event in events:
+            canvas.event(event)
+
+    seconds = _bestTime(stroke)
+    baseline.check(f"touch_event_us@{_sizeId(_canvasSize(canvas))}", seconds / len(events) * 1e6, "us")
+
+
+def test_multi_touch_frame_time(canvas, baseline):
+    """Touch events of ten concurrent fingers followed by the repaint they trigger (one event per frame)."""
+    events = _multiTouchEvents(_touchPaths(_canvasSize(canvas)))
+
+    def stroke():
+        for event in events:
+            canvas.event(event)
+            QApplication.processEvents()
+
+    seconds = _bestTime(stroke)
+    assert not canvas.m_touchPoints
+    baseline.check(f"multi_touch_frame_ms@{_sizeId(_canvasSize(canvas))}", seconds / len(events) * 1e3, "ms")
+
+
+def test_stroke_frame_time(canvas, baseline):
+    """A frame's worth of mouse events followed by the repaint they trigger."""
+    events = _mouseEvents(_strokePath(_canvasSize(canvas)))
+    frames = [events[i:i + EVENTS_PER_FRAME] for i in range(1, len(events) - 1, EVENTS_PER_FRAME)]
+
+    def stroke():
+        canvas.mousePressEvent(events[0])
+        for frame in frames:
+            for event in frame:
+                canvas.mouseMoveEvent(event)
+            QApplication.processEvents()
+        canvas.mouseReleaseEvent(events[-1])
+        QApplication.processEvents()
+
+    seconds = _bestTime(stroke)
+    baseline.check(f"stroke_frame_ms@{_sizeId(_canvasSize(canvas))}", seconds / len(frames) * 1e3, "ms")
+
+
+def test_paint_event(canvas, baseline):
+    seconds = _bestTime(canvas.repaint)
+    baseline.check(f"paint_ms@{_sizeId(_canvasSize(canvas))}", seconds * 1e3, "ms")
+
+
+def test_resize_event(canvas, baseline):
+    """Growing the backing pixmap to the widget size."""
+    size = QSize(canvas.width(), canvas.height())
+    small = QSize(100, 100)
+
+    def grow():
+        canvas.m_pixmap = QPixmap(small)
+        canvas.resizeEvent(QResizeEvent(size, small))
+
+    seconds = _bestTime(grow)
+    baseline.check(f"resize_ms@{_sizeId(_canvasSize(canvas))}", seconds * 1e3, "ms")
+
+
+def test_clear_canvas(canvas, baseline):
+    seconds = _bestTime(canvas.clearCanvas)
+    baseline.check(f"clear_ms@{_sizeId(_canvasSize(canvas))}", seconds * 1e3, "ms")
+
+
+def test_get_sketch(canvas, baseline):
+    seconds = _bestTime(canvas.getSketch)
+    baseline.check(f"get_sketch_us@{_sizeId(_canvasSize(canvas))}", seconds * 1e6, "us")
+
+
+def test_undo_redo(canvas, baseline):
+    """Undo and redo of a short stroke (cost should follow the stroke, not the canvas)."""
+    path = [(QPointF(40 + i * 3, 60 + (i % 5) * 4), 1.0) for i in range(20)]
+    events = _mouseEvents(path)
+    canvas.mousePressEvent(events[0])
+    for event in events[1:-1]:
+        canvas.mouseMoveEvent(event)
+    canvas.mouseReleaseEvent(events[-1])
+
+    def undoRedo():
+        canvas.undo()
+        canvas.redo()
+
+    seconds = _bestTime(undoRedo)
+    baseline.check(f"undo_redo_us@{_sizeId(_canvasSize(canvas))}", seconds * 1e6, "us")
+
+
+def test_undo_redo_4k(qapp):
+    """Undo and redo restore the canvas at 4K, where the canvas copy alone exceeds the history cap."""
+    widget = DrawingCanvas()
+    widget.resize(3840, 2160)
+    widget.show()
+    QApplication.processEvents()
+    try:
+        blank = widget.m_pixmap.toImage()
+        events = _mouseEvents(_strokePath((3840, 2160)))
+        widget.mousePressEvent(events[0])
+        for event in events[1:-1]:
+            widget.mouseMoveEvent(event)
+        widget.mouseReleaseEvent(events[-1])
+        QApplication.processEvents()
+        drawn = widget.m_pixmap.toImage()
+        assert drawn != blank
+
+        assert widget.canUndo()
+        widget.undo()
+        assert widget.m_pixmap.toImage() == blank
+        assert widget.canRedo()
+        widget.redo()
+        assert widget.m_pixmap.toImage() == drawn
+    finally:
+        widget.close()
+        widget.deleteLater()
+        QApplication.processEvents()
+
+
+def test_ink_export(canvas, baseline):
+    """Exporting the inked region of a small sketch at half scale (independent of the canvas size)."""
+    events = _mouseEvents([(QPointF(60 + i * 4, 80 + (i % 7) * 6), 1.0) for i in range(40)])
+    canvas.mousePressEvent(events[0])
+    for event in events[1:-1]:
+        canvas.mouseMoveEvent(event)
+    canvas.mouseReleaseEvent(events[-1])
+
+    seconds = _bestTime(lambda: canvas.getInkSketch(0.5))
+    baseline.check(f"ink_export_us@{_sizeId(_canvasSize(canvas))}", seconds * 1e6, "us")
+
+
+def test_tablet_stroke_with_prediction(canvas, baseline):
+    """Stylus events with the predicted ink overlay enabled."""
+    events = _tabletEvents(_strokePath(_canvasSize(canvas)))
+    canvas.setPredictionEnabled(True)
+
+    def stroke():
+        for event in events:
+            canvas.tabletEvent(event)
+
+    seconds = _bestTime(stroke)
+    baseline.check(f"tablet_predicted_event_us@{_sizeId(_canvasSize(canvas))}", seconds / len(events) * 1e6, "us")
+
+
+def test_stroke_prediction_quality(baseline):
+    """Prediction error and perceived latency when replaying synthetic stylus strokes."""
+    metrics = evaluatePrediction(syntheticStrokes())
+    assert metrics["latency_reduction_ms"] > 0
+    baseline.check("prediction_error_px", metrics["mean_error_px"], "px")
+    baseline.check("perceived_latency_ms", metrics["perceived_latency_ms"], "ms")
+
+
+def test_pressure_stroke_quality(baseline):
+    """Coverage error of the tessellated and per-segment renderers against a supersampled reference."""
+    results = compareRenderers(syntheticStrokes(5), base_width=6.0, repeats=1)
+    assert results["tessellated"]["error_px_per_100px"] < results["segments"]["error_px_per_100px"]
+    for name, result in results.items():
+        baseline.check(f"pressure_stroke_error_px@{name}", result["error_px_per_100px"], "px")
+
+
+def test_pressure_stroke_flush_independence():
+    """A tessellated stroke flushed after every sample matches the same stroke drawn in one flush."""
+    for stroke in syntheticStrokes(3):
+        images = []
+        for samples_per_flush in (1, len(stroke)):
+            image = blankImage((900, 600))
+            renderTessellated(image, stroke, base_width=6.0, samples_per_flush=samples_per_flush)
+            images.append(inkCoverage(image))
+        assert (images[0] == images[1]).all()
@@ -2,21 +2,61 @@
 """
 Drawlingo - Sketch-Based Language Learning App
 Python version using PyQt6
+
+Usage:
+    python main.py                 # one drawing window
+    python main.py --retune        # tune the inference settings for this machine first
+    python main.py --sessions 3    # kiosk mode: three windows sharing one model
 """
 
+import argparse
 import sys
 from PyQt6.QtWidgets import QApplication
 from MainWindow import MainWindow
 
+def positiveInt(value):
+    """argparse type for a whole number of at least 1."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a whole number, got {value!r}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
 def main():
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description="Drawlingo - sketch-based language learning.")
+    parser.add_argument("--sessions", type=positiveInt, default=1,
+                        help="Number of drawing windows sharing one model (kiosk mode)")
+    parser.add_argument("--retune", action="store_true",
+                        help="Tune the inference settings for this machine before starting")
+    # Remaining arguments (e.g. -platform) are left to Qt
+    args, qt_args = parser.parse_known_args()
+    
+    # Run the hardware auto-tuning (AutoTuner.py) now, before the window opens
+    if args.retune:
+        from AutoTuner import runCalibration, saveTunedConfig
+        try:
+            config, results = runCalibration()
+        except RuntimeError as e:
+            # The app still starts, with the previously tuned or the default settings
+            print(f"Tuning failed, keeping the current inference settings: {e}", file=sys.stderr)
+        else:
+            saveTunedConfig(config, results)
+    
+    app = QApplication(sys.argv[:1] + qt_args)
     
     app.setApplicationName("Drawlingo")
     app.setApplicationVersion("2.0.0")
     app.setOrganizationName("Drawlingo")
     
-    window = MainWindow()
-    window.show()
+    # Several windows (one per child) share one loaded model through the analysis scheduler
+    sessions = args.sessions
+    windows = []
+    for i in range(sessions):
+        window = MainWindow(session=f"canvas-{i + 1}" if sessions > 1 else None)
+        window.show()
+        windows.append(window)
     
     sys.exit(app.exec())
 